@@ -0,0 +1,41 @@
+"""
+每次请求的参数绑定开销：每次都反射(inspect.signature/get_type_hints) vs 预编译的binding plan
+
+    python bench/bench_binding.py
+"""
+from pathlib import Path
+import io
+import sys
+import timeit
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from wax.lessweb import Application, Context  # noqa: E402
+from wax.lessweb.model import compile_binding, compile_service, fetch_param  # noqa: E402
+from wax.mock_api import mock_dealer  # noqa: E402
+from wax.tag_api import operation_detail  # noqa: E402
+
+
+def make_ctx(query: str) -> Context:
+    ctx = Context(Application())
+    ctx.request.load({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/op/x', 'QUERY_STRING': query,
+                      'wsgi.input': io.BytesIO()})
+    return ctx
+
+
+def reflect_every_time(ctx: Context, fn):
+    # 模拟预编译之前的行为：每次调用都重新inspect签名和service的类型注解
+    compile_service.cache_clear()
+    return compile_binding.__wrapped__(fn)(ctx)
+
+
+def main(number: int=20000):
+    print(f'{"dealer":<20} {"reflect(us)":>12} {"plan(us)":>10} {"speedup":>8}')
+    for name, dealer, query in [('mock_dealer', mock_dealer, ''),
+                                ('operation_detail', operation_detail, 'opId=get-user&show=json')]:
+        ctx = make_ctx(query)
+        before = timeit.timeit(lambda: reflect_every_time(ctx, dealer), number=number) / number * 1e6
+        after = timeit.timeit(lambda: fetch_param(ctx, dealer), number=number) / number * 1e6
+        print(f'{name:<20} {before:>12.2f} {after:>10.2f} {before / after:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+典型wax响应的JSON编码开销：之前的json.dumps(cls=ResponseEncoder) vs 各codec，以及请求body的解析
+
+    python bench/bench_codec.py
+"""
+from pathlib import Path
+import datetime
+import json
+import sys
+import timeit
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from wax.lessweb.bridge import ResponseBridge, make_response_encoder  # noqa: E402
+from wax.lessweb.codec import StdlibCodec, OrjsonCodec, UjsonCodec, orjson, ujson  # noqa: E402
+
+
+def user(i: int) -> dict:
+    return {'id': i, 'name': f'用户{i}', 'email': f'user{i}@example.com', 'score': i / 3, 'active': i % 2 == 0,
+            'tags': ['a', 'b'], 'profile': {'age': i % 90, 'city': 'Shanghai', 'bio': None}}
+
+
+CASES = [
+    ('static example', {'code': 0, 'data': user(1)}),
+    ('page of 20', {'total': 1000, 'rows': [user(i) for i in range(20)]}),
+    ('pql 10k rows', [user(i) for i in range(10000)]),
+    ('openapi.json', {'paths': {f'/api/v1/res{i}/{{id}}': {'get': {
+        'operationId': f'get-res{i}', 'parameters': [{'name': 'id', 'in': 'path', 'schema': {'type': 'integer'}}],
+        'responses': {'200': {'content': {'application/json': {'schema': {'$ref': f'#/components/schemas/R{i}'}}}}}}}
+        for i in range(500)}}),
+    ('with datetime', {'rows': [dict(user(i), created=datetime.datetime(2020, 1, 1, i % 24)) for i in range(100)]}),
+]
+
+
+def measure(fn, total: float=0.5) -> float:
+    number = max(1, int(total / timeit.timeit(fn, number=1)))
+    return timeit.timeit(fn, number=number) / number * 1e6
+
+
+def main():
+    encoder = make_response_encoder([])
+    bridge = ResponseBridge([])
+    codecs = [StdlibCodec()] + ([OrjsonCodec()] if orjson else []) + ([UjsonCodec()] if ujson else [])
+    print(f'{"response":<16} {"KB":>6} {"before(us)":>11}' + ''.join(f' {c.name + "(us)":>12}' for c in codecs)
+          + f' {"loads(us)":>10} {"fast loads(us)":>15}')
+    for name, obj in CASES:
+        data = codecs[-1].dumps(obj, bridge)
+        assert all(codec.dumps(obj, bridge) == data for codec in codecs)
+        before = measure(lambda: json.dumps(obj, ensure_ascii=False, cls=encoder).encode())
+        after = [measure(lambda: codec.dumps(obj, bridge)) for codec in codecs]
+        loads = measure(lambda: codecs[0].loads(data))
+        fast_loads = measure(lambda: codecs[-1].loads(data))
+        print(f'{name:<16} {len(data) / 1024:>6.1f} {before:>11.1f}' + ''.join(f' {t:>12.1f}' for t in after)
+              + f' {loads:>10.1f} {fast_loads:>15.1f}')
+
+
+if __name__ == '__main__':
+    main()
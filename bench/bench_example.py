@@ -0,0 +1,45 @@
+"""
+每次请求取example的开销：json.dumps + json.loads往返复制 vs 冻结后直接共享的example索引
+
+    python bench/bench_example.py
+"""
+from pathlib import Path
+import json
+import sys
+import timeit
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from wax.example_util import ExampleIndex  # noqa: E402
+
+
+def make_swagger(n_rows: int) -> dict:
+    rows = [{'id': i, 'name': f'user{i}', 'email': f'user{i}@example.com', 'tags': ['a', 'b', 'c'],
+             'profile': {'age': i % 90, 'city': 'Shanghai', 'bio': 'x' * 100}} for i in range(n_rows)]
+    return {'paths': {'/users': {'get': {'operationId': 'list-user', 'responses': {'200': {'content': {
+        'application/json': {'schema': {'type': 'object'}, 'examples': {
+            'ok': {'value': {'rows': rows, '__item__': [0, None]}}}}}}}}}}}
+
+
+def main(number: int=200):
+    print(f'{"example(KB)":>12} {"json(us)":>10} {"index(us)":>10}')
+    for n_rows in [10, 100, 1000]:
+        swagger_data = make_swagger(n_rows)
+        content = swagger_data['paths']['/users']['get']['responses']['200']['content']['application/json']
+        size = len(json.dumps(content['examples']['ok']['value'])) / 1024
+        index = ExampleIndex(swagger_data)
+
+        def round_trip():
+            for example_val in content['examples'].values():
+                return json.loads(json.dumps(example_val['value']))
+
+        def indexed():
+            hit, _ = index.hit('list-user', '')
+            return index.examples[hit.key]
+
+        assert round_trip() == indexed()
+        before = timeit.timeit(round_trip, number=number) / number * 1e6
+        after = timeit.timeit(indexed, number=number) / number * 1e6
+        print(f'{size:>12.1f} {before:>10.1f} {after:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+packed()的耗时与文件数量的关系：串行解析 vs 进程池并行解析
+
+    python bench/bench_pack.py [jobs]
+"""
+from pathlib import Path
+import os
+import sys
+import tempfile
+import time
+import yaml
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from wax.pack_util import packed, YamlLoader  # noqa: E402
+
+
+def make_spec(i: int, n_paths: int=20) -> dict:
+    paths = {}
+    for j in range(n_paths):
+        paths[f'/bench{i}/item{j}/{{id}}'] = {
+            'get': {
+                'operationId': f'get-bench{i}-item{j}',
+                'summary': f'bench {i} {j}',
+                'parameters': [{'name': 'id', 'in': 'path', 'required': True, 'schema': {'type': 'integer'}}],
+                'responses': {'200': {'description': 'OK', 'content': {'application/json': {
+                    'schema': {'$ref': f'#/components/schemas/Bench{i}'},
+                    'examples': {'ok': {'value': {'id': "path['id']", 'name': "'x'", '__item__': [0]}}},
+                }}}},
+            },
+        }
+    schema = {'type': 'object', 'properties': {f'field{k}': {'type': 'string', 'description': 'x' * 40}
+                                               for k in range(30)}}
+    return {'openapi': '3.0.0', 'info': {'title': 'bench', 'version': '1'},
+            'paths': paths, 'components': {'schemas': {f'Bench{i}': schema}}}
+
+
+def timeit(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+    print(f'yaml loader: {YamlLoader.__name__}, jobs: {jobs}')
+    print(f'{"files":>6} {"serial(s)":>10} {"jobs(s)":>10} {"speedup":>8}')
+    for n_files in [25, 50, 100, 200, 400]:
+        with tempfile.TemporaryDirectory() as tmp:
+            for i in range(n_files):
+                Path(tmp, f'api{i:04d}.yaml').write_text(yaml.dump(make_spec(i)), encoding='utf-8')
+            serial = timeit(lambda: packed(tmp, 'bench', '1'))
+            parallel = timeit(lambda: packed(tmp, 'bench', '1', jobs=jobs))
+            assert packed(tmp, 'bench', '1') == packed(tmp, 'bench', '1', jobs=jobs)
+        print(f'{n_files:>6} {serial:>10.3f} {parallel:>10.3f} {serial / parallel:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
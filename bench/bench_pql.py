@@ -0,0 +1,148 @@
+"""
+tests/test_pql.py式的查询放大到上万行：每次调用都eval编译lambda vs 按(表达式, 参数名)缓存的编译结果；
+嵌套__from__的等值join：逐行扫描 vs entity的哈希索引；
+数值entity的__filter__/__sort__：逐行执行lambda vs numpy整列计算(需要安装numpy)；
+带__item__的查询：全部行map、完整排序 vs 提前结束、top-k、只对选中的行map
+
+    python bench/bench_pql.py
+"""
+from pathlib import Path
+import json
+import os
+import sys
+import tempfile
+import timeit
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from wax import pql, vector_util  # noqa: E402
+
+
+SCHEMA = {
+    '__from__': 'p:Person',
+    'pid': "it['id'] * 10",
+    'title': "it['name'].upper()",
+    'year': "int(it['birthday'][:4])",
+    'isRoot': "not it['parent']",
+    'query': "query.get('q', '')",
+    '__filter__': "it['id'] % 3 != 0",
+    '__sort__': "it['birthday']",
+    '__except__': ['parent'],
+}
+
+
+def measure(fn, total: float=1.0) -> float:
+    number = max(1, int(total / timeit.timeit(fn, number=1)))
+    return timeit.timeit(fn, number=number) / number * 1e3
+
+
+def main():
+    cached = pql.compile_lambda
+    uncached = cached.__wrapped__
+    print(f'{"rows":>8} {"eval(ms)":>10} {"cached(ms)":>11} {"speedup":>8}')
+    with tempfile.TemporaryDirectory() as dirpath:
+        os.chdir(dirpath)
+        os.mkdir('entity')
+        for n_rows in [100, 1000, 10000]:
+            rows = [{'id': i, 'name': f'p{i}', 'parent': i // 10, 'birthday': f'{2000 + i % 20}-01-{1 + i % 28:02d}'}
+                    for i in range(n_rows)]
+            Path('entity/Person.json').write_text(json.dumps(rows))
+            run = lambda: pql.apply_schema({'query': {'q': 'x'}}, SCHEMA)  # noqa: E731
+            pql.compile_lambda = uncached
+            expected = run()
+            before = measure(run)
+            pql.compile_lambda = cached
+            assert run() == expected
+            after = measure(run)
+            print(f'{n_rows:>8} {before:>10.2f} {after:>11.2f} {before / after:>7.1f}x')
+        join_main()
+        columnar_main()
+        lazy_main()
+
+
+JOIN_SCHEMA = {
+    '__from__': 'u:User',
+    'orders': {'__from__': 'o:Order', '__filter__': "o['userId'] == u['id']", 'total': "o['amount'] * 100"},
+}
+
+
+def join_main():
+    print(f'{"users":>8} {"orders":>8} {"scan(ms)":>10} {"index(ms)":>10} {"speedup":>8}')
+    for n_users in [100, 300, 500]:
+        n_orders = n_users * 10
+        Path('entity/User.json').write_text(json.dumps([{'id': i, 'name': f'u{i}'} for i in range(n_users)]))
+        Path('entity/Order.json').write_text(json.dumps(
+            [{'id': i, 'userId': i * 7 % n_users, 'amount': i % 100} for i in range(n_orders)]))
+        plan = pql.compile_schema(JOIN_SCHEMA)
+        inner = plan.entries[0].sources[0]
+        join, vfilter = inner.join, inner.vfilter
+        assert join is not None
+        inner.join = inner.vfilter = None
+        expected = plan.run({})
+        before = measure(lambda: plan.run({}))
+        inner.join, inner.vfilter = join, vfilter
+        assert plan.run({}) == expected
+        after = measure(lambda: plan.run({}))
+        print(f'{n_users:>8} {n_orders:>8} {before:>10.1f} {after:>10.2f} {before / after:>7.0f}x')
+
+
+COLUMNAR_SCHEMA = {
+    '__from__': 'Metric',
+    '__filter__': "it['score'] > query['minScore'] and it['age'] * 12 < 600",
+    '__sort__': "it['score'] - it['age']",
+    '__reverse__': 'True',
+    '__only__': ['id', 'score'],
+}
+
+
+def columnar_main():
+    if vector_util.numpy is None:
+        print('numpy is not installed')
+        return
+    print(f'{"rows":>8} {"rowwise(ms)":>12} {"numpy(ms)":>10} {"speedup":>8}')
+    for n_rows in [1000, 10000, 100000]:
+        Path('entity/Metric.json').write_text(json.dumps(
+            [{'id': i, 'score': i * 37 % 1000 / 10, 'age': i % 80} for i in range(n_rows)]))
+        plan = pql.compile_schema(COLUMNAR_SCHEMA)
+        vfilter, vsort = plan.vfilter, plan.vsort
+        assert vfilter is not None and vsort is not None
+        env = {'query': {'minScore': 50}}
+        plan.vfilter = plan.vsort = None
+        expected = plan.run(dict(env))
+        before = measure(lambda: plan.run(dict(env)))
+        plan.vfilter, plan.vsort = vfilter, vsort
+        assert plan.run(dict(env)) == expected
+        after = measure(lambda: plan.run(dict(env)))
+        print(f'{n_rows:>8} {before:>12.1f} {after:>10.1f} {before / after:>7.1f}x')
+
+
+LAZY_SCHEMAS = {
+    'slice': {'__from__': 'Person', '__filter__': "it['id'] % 3 != 0", 'title': "it['name'].upper()",
+              '__item__': [0, 20]},
+    'top-k': {'__from__': 'Person', '__filter__': "it['id'] % 3 != 0", '__sort__': "it['birthday']",
+              '__reverse__': 'True', 'title': "it['name'].upper()", '__item__': [0, 20]},
+}
+
+
+def lazy_main():
+    print(f'{"query":>8} {"rows":>8} {"full(ms)":>10} {"lazy(ms)":>10} {"speedup":>8}')
+    for n_rows in [1000, 10000, 100000]:
+        Path('entity/Person.json').write_text(json.dumps(
+            [{'id': i, 'name': f'p{i}', 'birthday': f'{2000 + i * 7 % 20}-01-{1 + i % 28:02d}'}
+             for i in range(n_rows)]))
+        for name, schema in LAZY_SCHEMAS.items():
+            plan = compile_schema_full(schema)
+            expected = plan.run({})
+            before = measure(lambda: plan.run({}))
+            plan = pql.compile_schema(schema)
+            assert plan.run({}) == expected
+            after = measure(lambda: plan.run({}))
+            print(f'{name:>8} {n_rows:>8} {before:>10.2f} {after:>10.2f} {before / after:>7.1f}x')
+
+
+def compile_schema_full(schema: dict):
+    plan = pql.compile_schema(schema)
+    plan.filter_first, plan.limit, plan.map_last = False, None, False
+    return plan
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+单次校验的开销：jsonschema.validate(每次创建validator并检查schema) vs snapshot中预编译的validator，
+以及config.json中validator为jsonschema和codegen两种后端的对比
+
+    python bench/bench_validate.py
+"""
+from pathlib import Path
+import sys
+import timeit
+import warnings
+import jsonschema
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from wax.validator_util import spec_validators  # noqa: E402
+
+warnings.simplefilter('ignore', DeprecationWarning)  # RefResolver已被jsonschema标记为deprecated
+
+SWAGGER = {'paths': {}, 'components': {'schemas': {
+    'User': {'type': 'object', 'required': ['id', 'name'], 'properties': {
+        'id': {'type': 'integer', 'minimum': 1},
+        'name': {'type': 'string', 'maxLength': 20},
+        'email': {'type': 'string', 'format': 'email'},
+        'tags': {'type': 'array', 'items': {'type': 'string'}},
+    }},
+}}}
+
+CASES = [
+    ('param:path:id', {'type': 'integer'}, 42),
+    ('body:application/json', {'$ref': '#/components/schemas/User'},
+     {'id': 1, 'name': 'n', 'email': 'a@b.c', 'tags': ['x']}),
+    ('response:200:application/json', {'type': 'array', 'items': {'$ref': '#/components/schemas/User'}},
+     [{'id': i, 'name': 'n', 'email': 'a@b.c', 'tags': ['x', 'y']} for i in range(1, 21)]),
+    ('response:200:page500', {'type': 'array', 'items': {'$ref': '#/components/schemas/User'}},
+     [{'id': i, 'name': 'n', 'email': 'a@b.c', 'tags': ['x', 'y']} for i in range(1, 501)]),
+]
+
+
+def measure(fn, total: float=0.5) -> float:
+    number = max(1, int(total / timeit.timeit(fn, number=1)))
+    return timeit.timeit(fn, number=number) / number * 1e6
+
+
+def main():
+    resolver = jsonschema.RefResolver.from_schema(SWAGGER)
+    cached = spec_validators(SWAGGER, 'jsonschema')
+    codegen = spec_validators(SWAGGER, 'codegen')
+    print(f'{"location":<30} {"validate(us)":>13} {"jsonschema(us)":>15} {"codegen(us)":>12} {"speedup":>8}')
+    for location, schema, instance in CASES:
+        key = ('bench', location)
+        before = measure(lambda: jsonschema.validate(
+            instance, schema, resolver=resolver, format_checker=jsonschema.draft7_format_checker))
+        after = measure(lambda: cached.validate(instance, key=key, schema=schema))
+        compiled = measure(lambda: codegen.validate(instance, key=key, schema=schema))
+        print(f'{location:<30} {before:>13.2f} {after:>15.2f} {compiled:>12.2f} {after / compiled:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
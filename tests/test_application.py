@@ -0,0 +1,135 @@
+from unittest import TestCase
+from pathlib import Path
+import datetime
+import gzip
+import os
+import io
+import json
+import tempfile
+from wax.lessweb import Application, Context, ResourceVersion
+from wax.lessweb.application import iter_json_array
+from wax.lessweb.webapi import etag_matches, parse_http_date, http_date
+from wax.lessweb.compression import negotiate, supported_codings, StaticVariants
+
+
+def call(app, method, path, headers=None):
+    env = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '', 'wsgi.input': io.BytesIO(b'')}
+    for key, val in (headers or {}).items():
+        env['HTTP_' + key.upper().replace('-', '_')] = val
+    ret = {}
+
+    def start_resp(status, headers):
+        ret['status'], ret['headers'] = status, dict(headers)
+
+    body = b''.join(app.wsgifunc()(env, start_resp))
+    return ret['status'], ret['headers'], body
+
+
+class TestApplication(TestCase):
+    def test_etag_matches(self):
+        self.assertTrue(etag_matches('"a"', '"a"'))
+        self.assertTrue(etag_matches('"b", W/"a"', '"a"'))
+        self.assertTrue(etag_matches('*', '"a"'))
+        self.assertFalse(etag_matches('"ab"', '"a"'))
+        self.assertEqual(parse_http_date(http_date(1600000000)), 1600000000)
+        self.assertIsNone(parse_http_date('yesterday'))
+
+    def test_conditional_get(self):
+        app = Application()
+        app.add_get_mapping('/hello', lambda: {'hello': 'world'})
+        status, headers, body = call(app, 'GET', '/hello')
+        self.assertEqual((status, body), ('200 OK', b'{"hello": "world"}'))
+        etag = headers['ETag']
+        self.assertNotIn('Last-Modified', headers)
+        self.assertEqual(call(app, 'GET', '/hello', {'If-None-Match': etag})[::2], ('304 Not Modified', b''))
+        self.assertEqual(call(app, 'GET', '/hello', {'If-None-Match': '"other"'})[0], '200 OK')
+        status, headers, body = call(app, 'HEAD', '/hello')
+        self.assertEqual((status, headers['ETag'], body), ('200 OK', etag, b''))
+        self.assertEqual(call(app, 'HEAD', '/missing')[::2], ('404 Not Found', b''))
+        self.assertFalse(app.fixed_responses)
+
+    def test_fixed_version(self):
+        app = Application()
+        calls = []
+        app.add_get_mapping('/page', lambda: calls.append(1) or 'page')
+        app.set_version_provider(lambda ctx: ResourceVersion('g1', 1600000000.0, True))
+        status, headers, body = call(app, 'GET', '/page')
+        self.assertEqual((status, body), ('200 OK', b'page'))
+        self.assertTrue(headers['ETag'].startswith('"g1-'))
+        self.assertEqual(headers['Last-Modified'], 'Sun, 13 Sep 2020 12:26:40 GMT')
+        status, headers, body = call(app, 'GET', '/page', {'If-Modified-Since': headers['Last-Modified']})
+        self.assertEqual((status, body), ('304 Not Modified', b''))
+        self.assertEqual(call(app, 'GET', '/page', {'If-None-Match': headers['ETag']})[0], '304 Not Modified')
+        self.assertEqual(call(app, 'HEAD', '/page')[::2], ('200 OK', b''))
+        self.assertEqual(len(calls), 1)  # 命中后不再执行dealer
+        self.assertEqual(call(app, 'GET', '/page', {'If-None-Match': '"g0-x"'})[2], b'page')
+        self.assertEqual(len(calls), 2)
+
+    def test_compression(self):
+        app = Application()
+        calls = []
+        page = 'x' * 2000
+        app.add_get_mapping('/page', lambda: calls.append(1) or page)
+        app.add_get_mapping('/small', lambda: 'small')
+        app.set_version_provider(lambda ctx: ResourceVersion('g1', None, ctx.request.path == '/page'))
+        self.assertEqual(negotiate('br;q=0.5, gzip'), 'gzip')
+        self.assertEqual(negotiate('*'), supported_codings()[0])
+        status, headers, body = call(app, 'GET', '/page', {'Accept-Encoding': 'gzip'})
+        self.assertEqual((headers['Content-Encoding'], headers['Vary']), ('gzip', 'Accept-Encoding'))
+        self.assertTrue(headers['ETag'].endswith('-gzip"'))
+        self.assertEqual(gzip.decompress(body), page.encode())
+        self.assertEqual(app.compressed_bodies[headers['ETag']], body)
+        self.assertEqual(call(app, 'GET', '/page', {'Accept-Encoding': 'gzip', 'If-None-Match': headers['ETag']})[0],
+                         '304 Not Modified')
+        status, plain_headers, body = call(app, 'GET', '/page')
+        self.assertEqual(body, page.encode())
+        self.assertNotIn('Content-Encoding', plain_headers)
+        self.assertNotEqual(plain_headers['ETag'], headers['ETag'])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(list(app.compressed_bodies), [headers['ETag']])
+        status, headers, body = call(app, 'GET', '/small', {'Accept-Encoding': 'gzip'})
+        self.assertEqual(body, b'small')
+        self.assertNotIn('Content-Encoding', headers)
+
+    def test_static_variants(self):
+        with tempfile.TemporaryDirectory() as dirpath:
+            Path(dirpath, 'a.js').write_text('x' * 2000)
+            Path(dirpath, 'b.png').write_bytes(b'x' * 2000)
+            Path(dirpath, 'c.css').write_text('x')
+            variants = StaticVariants(dirpath, 1024)
+            self.assertEqual(variants.precompress(), len(supported_codings()))
+            # 压缩结果只在内存中，不写入静态目录
+            self.assertEqual(sorted(os.listdir(dirpath)), ['a.js', 'b.png', 'c.css'])
+            path = variants.root / 'a.js'
+            data = variants.get(path, 'gzip')
+            self.assertEqual(gzip.decompress(data), b'x' * 2000)
+            self.assertIs(variants.get(path, 'gzip'), data)
+            self.assertIsNone(variants.get(path, ''))
+            self.assertIsNone(variants.get(variants.root / 'b.png', 'gzip'))
+            path.write_text('y' * 3000)
+            os.utime(path, ns=(0, 10 ** 9))
+            self.assertEqual(gzip.decompress(variants.get(path, 'gzip')), b'y' * 3000)
+
+    def test_iter_json_array(self):
+        app = Application()
+        rows = [{'id': i, 'name': '名字%d' % i, 'at': datetime.datetime(2020, 1, 1)} for i in range(300)]
+        expected = app.dump_json(rows)
+        self.assertEqual(json.loads(expected)[1], {'id': 1, 'name': '名字1', 'at': '2020-01-01T00:00:00'})
+        chunks = list(iter_json_array(iter(rows), app.dump_json, chunk_size=1000))
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual(b''.join(chunks), expected)
+        self.assertEqual(b''.join(iter_json_array([], app.dump_json)), b'[]')
+
+        def stream_rows(ctx: Context):
+            return ctx.app.stream_json_array(ctx, (row for row in rows))
+
+        app.add_get_mapping('/rows', stream_rows)
+        status, headers, body = call(app, 'GET', '/rows')
+        self.assertEqual((body, headers['Content-Type']), (expected, 'application/json; charset=utf-8'))
+        self.assertNotIn('ETag', headers)
+        status, headers, body = call(app, 'GET', '/rows', {'Accept-Encoding': 'gzip'})
+        self.assertEqual((headers['Content-Encoding'], gzip.decompress(body)), ('gzip', expected))
+        app.set_json_codec('auto', compact=True)
+        compact = app.dump_json(rows)
+        self.assertEqual(json.loads(compact), json.loads(expected))
+        self.assertEqual(call(app, 'GET', '/rows')[2], compact)
@@ -0,0 +1,77 @@
+from unittest import TestCase
+from pathlib import Path
+import ast
+import copy
+import tempfile
+from wax.bundle_util import dump_bundle, load_bundle
+from wax.load_swagger import build_snapshot, bundle_snapshot, restore_snapshot
+
+
+SWAGGER = {
+    'openapi': '3.0.0',
+    'info': {'title': 't', 'version': '1'},
+    'paths': {
+        '/user/{id}': {
+            'parameters': [{'name': 'id', 'in': 'path', 'required': True, 'schema': {'$ref': '#/components/schemas/Id'}}],
+            'get': {
+                'operationId': 'get-user', 'summary': 'get', 'tags': ['用户-管理'],
+                'parameters': [{'name': 'verbose', 'in': 'query', 'schema': {'type': 'boolean'}}],
+                'responses': {'200': {'description': 'OK', 'content': {'application/json': {
+                    'schema': {'$ref': '#/components/schemas/User'},
+                    'examples': {'ok': {'value': {'id': 1, 'name': "'Tom'"}},
+                                 'pql': {'value': {'__from__': 'User', '__filter__': "it['id'] == 1", '__item__': [0]}}},
+                }}}},
+            },
+            'put': {
+                'operationId': 'put-user', 'summary': 'put',
+                'requestBody': {'content': {'application/json': {'schema': {'$ref': '#/components/schemas/User'}}}},
+                'responses': {'204': {'description': 'OK'}},
+            },
+        },
+    },
+    'components': {'schemas': {
+        'Id': {'type': 'integer'},
+        'User': {'type': 'object', 'properties': {'id': {'$ref': '#/components/schemas/Id'}, 'name': {'type': 'string'}},
+                 'required': ['id']},
+    }},
+}
+
+
+def plain(obj):
+    """
+    把snapshot中的对象展开成可以比较的值
+    """
+    if isinstance(obj, dict):
+        return {key: plain(val) for key, val in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [plain(val) for val in obj]
+    if isinstance(obj, ast.AST):
+        return ast.dump(obj)
+    if hasattr(obj, '__dict__'):
+        return type(obj).__name__, plain(vars(obj))
+    return obj
+
+
+class TestBundleUtil(TestCase):
+    def test_round_trip(self):
+        fresh = build_snapshot(copy.deepcopy(SWAGGER), generation=1)
+        with tempfile.TemporaryDirectory() as dirpath:
+            path = Path(dirpath, 'bundle.pickle')
+            bundled, refs = bundle_snapshot(build_snapshot(copy.deepcopy(SWAGGER), generation=1))
+            self.assertIsNone(bundled.resolver)
+            dump_bundle(path, bundled, 'packer', refs)
+            snapshot, packer, refs = load_bundle(path)
+        self.assertEqual(packer, 'packer')
+        loaded = restore_snapshot(snapshot, refs)
+        for field in ['swagger_data', 'param_index', 'example_index', 'op_index', 'tag_tree']:
+            self.assertEqual(plain(getattr(loaded, field)), plain(getattr(fresh, field)), field)
+        self.assertEqual(loaded.routes.match('/user/3')[1], {'id': '3'})
+        # 预编译包中的$ref与swagger是同一份对象，加载后直接放入resolver的缓存
+        self.assertEqual(sorted(refs), ['/components/schemas/Id', '/components/schemas/User'])
+        self.assertIs(refs['/components/schemas/User'], loaded.swagger_data['components']['schemas']['User'])
+        self.assertEqual(len(loaded.resolver.fragments), 2)
+        schema = {'$ref': '#/components/schemas/User'}
+        for instance in [{'id': 1}, {'id': 'x'}, {}]:
+            self.assertEqual(loaded.validators.validate(instance, key=('put-user', 'body:application/json'), schema=schema),
+                             fresh.validators.validate(instance, key=('put-user', 'body:application/json'), schema=schema))
+        self.assertEqual(len(loaded.resolver.fragments), 2)  # 没有再次解析
@@ -0,0 +1,45 @@
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from wax.check_util import CheckPolicy, DeferredChecker, parse_policy, sampled
+
+
+class TestCheckUtil(TestCase):
+    def test_parse_policy(self):
+        self.assertEqual(parse_policy('full'), CheckPolicy('full', 100))
+        self.assertEqual(parse_policy('sampled:7'), CheckPolicy('sampled', 7))
+        for value in ['', 'sample', 'sampled:0', 'sampled:x', 'off:3']:
+            with self.assertRaises(ValueError):
+                parse_policy(value)
+
+    def test_sampled(self):
+        self.assertEqual([sampled(('op', 'test'), 3) for _ in range(7)], [True, False, False, True, False, False, True])
+
+    def test_sampled_threads(self):
+        # 多个线程同时第一次用到同一个key时，也只有一个请求被抽中
+        barrier = threading.Barrier(8)
+
+        def first_calls(key):
+            barrier.wait()
+            return sampled(key, 1000)
+
+        with ThreadPoolExecutor(8) as executor:
+            for i in range(50):
+                key = ('op', f'threads-{i}')
+                self.assertEqual(sum(executor.map(first_calls, [key] * 8)), 1)
+            key = ('op', 'threads')
+            self.assertEqual(sum(executor.map(lambda _: sampled(key, 10), range(8000))), 800)
+
+    def test_deferred(self):
+        def fail():
+            raise ValueError('bad response')
+        checker = DeferredChecker()
+        checker.submit(('op1', 'response:200:application/json'), lambda: None)
+        checker.submit(('op2', 'response:200:application/json'), fail)
+        for _ in range(100):
+            if checker.checked == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual([failure['message'] for failure in checker.recent()], ['bad response'])
+        self.assertEqual(checker.recent('op1'), [])
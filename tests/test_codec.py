@@ -0,0 +1,73 @@
+from unittest import TestCase
+import datetime
+import enum
+import json
+from wax.lessweb.bridge import ResponseBridge, make_response_encoder
+from wax.lessweb.codec import StdlibCodec, OrjsonCodec, UjsonCodec, make_codec, orjson, ujson
+
+
+class Color(enum.Enum):
+    RED = 'red'
+
+
+class TestCodec(TestCase):
+    def codecs(self, compact: bool=False):
+        ret = [StdlibCodec(compact=compact)]
+        if orjson is not None:
+            ret.append(OrjsonCodec(compact=compact))
+        if ujson is not None:
+            ret.append(UjsonCodec(compact=compact))
+        return ret
+
+    def test_byte_identical(self):
+        bridge = ResponseBridge([])
+        objs = [
+            {'id': 1, 'name': '张三 "quoted" \\ /path', 'score': 98.5, 'ok': True, 'none': None, 'tags': ['a', 'b']},
+            [{'id': i, 'rate': i / 7, 'nested': {'k': [i, -i, 0.1]}} for i in range(50)],
+            {1: 'int key', 'at': datetime.datetime(2020, 1, 2, 3, 4, 5), 'color': Color.RED, 'raw': b'x'},
+            {'big': 2 ** 70, 'control': '\x00\x1f '},
+            [], {}, '', 0, -0.0,
+        ]
+        encoder = make_response_encoder([])
+        for obj in objs + [1e16, [1.5e-7, 1e300]]:
+            # 默认与之前的json.dumps(cls=ResponseEncoder)逐字节相同
+            expected = json.dumps(obj, ensure_ascii=False, cls=encoder).encode()
+            for codec in self.codecs():
+                self.assertEqual(codec.dumps(obj, bridge), expected, codec.name)
+        for obj in objs:
+            expected = json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=bridge).encode()
+            for codec in self.codecs(compact=True):
+                self.assertEqual(codec.dumps(obj, bridge), expected, codec.name)
+
+    def test_loads(self):
+        for codec in self.codecs():
+            self.assertEqual(codec.loads('{"a": [1, 2.5, "中"]}'.encode()), {'a': [1, 2.5, '中']})
+            self.assertEqual(codec.loads(b'[123456789012345678901234567890]'), [123456789012345678901234567890])
+            self.assertNotEqual(codec.loads(b'NaN'), codec.loads(b'NaN'))  # nan
+            with self.assertRaises(ValueError):
+                codec.loads(b'{')
+
+    def test_make_codec(self):
+        self.assertEqual(make_codec('stdlib').name, 'stdlib')
+        self.assertEqual(make_codec('auto', 'gbk').name, 'stdlib')
+        self.assertEqual(make_codec('auto').name, 'orjson' if orjson else 'ujson' if ujson else 'stdlib')
+        self.assertEqual((make_codec('auto').compact, make_codec('auto', compact=True).compact), (False, True))
+        with self.assertRaises(ValueError):
+            make_codec('simdjson')
+
+    def test_bridge_dispatch(self):
+        calls = []
+
+        def date_bridge(obj):
+            calls.append(obj)
+            return obj.isoformat() if isinstance(obj, datetime.date) else None
+
+        bridge = ResponseBridge([date_bridge])
+        self.assertEqual(bridge(datetime.date(2020, 1, 1)), '2020-01-01')
+        self.assertEqual(bridge(Color.RED), 'red')
+        self.assertIsNone(bridge(object()))
+        calls.clear()
+        self.assertEqual([bridge(Color.RED), bridge(datetime.date(2020, 1, 2))], ['red', '2020-01-02'])
+        self.assertIsNone(bridge(object()))
+        self.assertEqual(len(calls), 1)  # 按类型分派，不再依次尝试
+        self.assertEqual(set(bridge.dispatch), {datetime.date, Color})
@@ -0,0 +1,55 @@
+from unittest import TestCase
+import jsonschema
+from wax.codegen_util import compile_check
+from wax.validator_util import spec_validators
+
+
+SWAGGER = {'paths': {}, 'components': {'schemas': {
+    'Node': {'type': 'object', 'required': ['v'], 'properties': {
+        'v': {'type': 'integer', 'minimum': 0}, 'next': {'$ref': '#/components/schemas/Node'}}},
+    'User': {'type': 'object', 'required': ['id', 'name'], 'additionalProperties': False, 'properties': {
+        'id': {'type': 'integer', 'minimum': 1, 'exclusiveMaximum': 100},
+        'name': {'type': 'string', 'minLength': 1, 'maxLength': 5, 'pattern': '^[a-z]+$'},
+        'email': {'type': 'string', 'format': 'email'},
+        'role': {'enum': ['a', 'b', None]},
+        'tags': {'type': 'array', 'items': {'type': 'string'}, 'maxItems': 2},
+        'score': {'type': ['number', 'null'], 'maximum': 3},
+        'one': {'oneOf': [{'type': 'integer'}, {'type': 'string'}]},
+        'extra': {'type': 'object', 'additionalProperties': {'type': 'boolean'}},
+    }},
+}}}
+
+
+class TestCodegenUtil(TestCase):
+    def test_same_as_jsonschema(self):
+        validators = spec_validators(SWAGGER)
+        cases = [
+            ({'$ref': '#/components/schemas/Node'}, [
+                {'v': 0}, {'v': 0, 'next': {'v': 1, 'next': {'v': 2}}}, {'v': 0, 'next': {'v': -1}}, {'next': {}}, [],
+            ]),
+            ({'type': 'array', 'items': {'$ref': '#/components/schemas/User'}}, [
+                [], [{'id': 1, 'name': 'ab'}], [{'id': 100, 'name': 'ab'}], [{'id': 2.0, 'name': 'ab'}],
+                [{'id': True, 'name': 'ab'}], [{'id': 1, 'name': 'abcdef'}], [{'id': 1, 'name': 'AB'}], [{'id': 1}],
+                [{'id': 1, 'name': 'a', 'email': 'x@y'}], [{'id': 1, 'name': 'a', 'email': 'xy'}],
+                [{'id': 1, 'name': 'a', 'role': None}], [{'id': 1, 'name': 'a', 'role': 'c'}],
+                [{'id': 1, 'name': 'a', 'tags': ['x', 'y', 'z']}], [{'id': 1, 'name': 'a', 'tags': [1]}],
+                [{'id': 1, 'name': 'a', 'score': None}], [{'id': 1, 'name': 'a', 'score': 4}],
+                [{'id': 1, 'name': 'a', 'one': 's'}], [{'id': 1, 'name': 'a', 'one': 1.5}],
+                [{'id': 1, 'name': 'a', 'extra': {'x': True}}], [{'id': 1, 'name': 'a', 'extra': {'x': 1}}],
+                [{'id': 1, 'name': 'a', 'other': 1}], {'id': 1, 'name': 'a'},
+            ]),
+            ({'items': {}, 'minimum': 2, 'type': ['array', 'integer']}, [[], [1], 1, 2, 'x']),
+        ]
+        for schema, instances in cases:
+            check = compile_check(schema, validators.resolver, jsonschema.draft7_format_checker)
+            validator = jsonschema.Draft7Validator(schema, resolver=validators.resolver,
+                                                   format_checker=jsonschema.draft7_format_checker)
+            for instance in instances:
+                self.assertEqual(check(instance), validator.is_valid(instance), instance)
+
+    def test_error_message(self):
+        schema = {'type': 'array', 'items': {'$ref': '#/components/schemas/User'}}
+        key = ('list-user', 'response:200:application/json')
+        for instance in [[{'id': 1, 'name': 'a'}], [{'id': 1, 'name': 'AB'}], [{'id': 0}]]:
+            self.assertEqual(spec_validators(SWAGGER, 'codegen').validate(instance, key=key, schema=schema),
+                             spec_validators(SWAGGER).validate(instance, key=key, schema=schema))
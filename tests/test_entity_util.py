@@ -0,0 +1,84 @@
+from unittest import TestCase
+from pathlib import Path
+import json
+import os
+import tempfile
+from wax.entity_util import EntityStore
+from wax.frozen_util import FrozenDict
+from wax import pql
+
+
+class TestEntityUtil(TestCase):
+    def test_entity_store(self):
+        with tempfile.TemporaryDirectory() as dirpath:
+            store = EntityStore(dirpath)
+            path = Path(dirpath, 'User.json')
+            self.assertEqual(store.get('User'), (None, '数据未创建(User)'))
+            path.write_text(json.dumps([{'id': 1, 'tags': ['a']}]))
+            rows, error = store.get('User')
+            self.assertEqual((rows, error), ([{'id': 1, 'tags': ['a']}], ''))
+            self.assertIs(store.get('User')[0], rows)
+            self.assertEqual(store.loads, 1)
+            with self.assertRaises(TypeError):
+                rows[0]['id'] = 2
+            with self.assertRaises(TypeError):
+                rows[0]['tags'].append('b')
+            path.write_text(json.dumps({'id': 1}))
+            self.assertEqual(store.get('User'), (None, '数据不合法，只支持list[dict]类型(User)'))
+            self.assertEqual(store.get('User')[1], '数据不合法，只支持list[dict]类型(User)')
+            self.assertEqual(store.loads, 2)  # 错误也只解析一次
+            path.write_text(json.dumps([{'id': 3}]))
+            self.assertEqual(store.get('User')[0], [{'id': 3}])
+
+    def test_shared_rows(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as dirpath:
+            os.chdir(dirpath)
+            try:
+                os.mkdir('entity')
+                Path('entity/Person.json').write_text(json.dumps([{'id': 1}, {'id': 2}]))
+                schema = {'__from__': 'Person', 'double': "it['id'] * 2", '__filter__': "it['id'] > 1"}
+                self.assertEqual(pql.apply_schema({}, schema), [{'id': 2, 'double': 4}])
+                self.assertEqual(pql.apply_schema({}, schema), [{'id': 2, 'double': 4}])
+                rows = pql.query_entity('Person')
+                self.assertEqual(rows, [{'id': 1}, {'id': 2}])  # map的结果没有写入共享的rows
+                self.assertIsInstance(rows[0], FrozenDict)
+            finally:
+                os.chdir(cwd)
+
+    def test_join_index(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as dirpath:
+            os.chdir(dirpath)
+            try:
+                os.mkdir('entity')
+                Path('entity/User.json').write_text(json.dumps([{'id': 1}, {'id': 2}, {'id': 3}]))
+                Path('entity/Order.json').write_text(json.dumps(
+                    [{'userId': 1, 'no': 'a'}, {'userId': 2, 'no': 'b'}, {'userId': 1, 'no': 'c'}, {'userId': [1]}]))
+                schema = {'__from__': 'u:User', 'nos': {
+                    '__from__': 'o:Order', '__filter__': "o['userId'] == u['id']", 'no': "o.get('no')",
+                    '__only__': ['no']}}
+                plan = pql.compile_schema(schema)
+                self.assertEqual(plan.entries[0].sources[0].join, pql.JoinRule('userId', "u['id']"))
+                expected = [{'id': 1, 'nos': [{'no': 'a'}, {'no': 'c'}]},
+                            {'id': 2, 'nos': [{'no': 'b'}]}, {'id': 3, 'nos': []}]
+                self.assertEqual(plan.run({}), expected)
+                order = pql.entity_store.entity('Order')
+                self.assertEqual(order.indexes, {'userId': {1: [0, 2], 2: [1]}})
+                # map可能报错时每行都要执行map，不使用索引，报错与逐行执行相同
+                rowwise = pql.compile_schema(dict(schema, nos=dict(schema['nos'], upper="o['no'].upper()")))
+                self.assertIsNone(rowwise.entries[0].sources[0].join)
+                with self.assertRaises(pql.PqlRuntimeError) as cm:
+                    rowwise.run({})
+                self.assertEqual(str(cm.exception),
+                                 "nos/upper: 运行时错误: (AttributeError) 'NoneType' object has no attribute 'upper'")
+                # 文件变化后索引随entity一起失效；缺少字段时逐行扫描，报错与之前相同
+                Path('entity/Order.json').write_text(json.dumps([{'userId': 1, 'no': 'd'}, {'no': 'e'}]))
+                with self.assertRaises(pql.PqlRuntimeError) as cm:
+                    plan.run({})
+                self.assertEqual(str(cm.exception), "nos/__filter__: 运行时错误: (KeyError) 'userId'")
+                self.assertEqual(pql.entity_store.entity('Order').indexes, {'userId': None})
+                self.assertIsNone(pql.compile_schema({'__from__': 'Order', '__filter__': "it['userId'] == 1",
+                                                      'userId': '2'}).join)
+            finally:
+                os.chdir(cwd)
@@ -0,0 +1,41 @@
+from unittest import TestCase
+import pickle
+from wax.example_util import ExampleIndex, FrozenDict, freeze
+
+
+SWAGGER = {'paths': {'/user': {'get': {'operationId': 'get-user', 'responses': {
+    '200': {'content': {
+        'application/json': {'schema': {'type': 'object'}, 'examples': {
+            'ok': {'value': {'id': 1, 'tags': ['a']}}, 'empty': {'value': {}}}},
+        'text/plain': {'schema': {'type': 'string'}},
+    }},
+    '404': {'content': {'application/json': {'schema': {'type': 'object'}, 'examples': {'miss': {'value': {'code': '1'}}}}}},
+}}}}}
+
+
+class TestExampleUtil(TestCase):
+    def test_hit(self):
+        index = ExampleIndex(SWAGGER)
+        hit, _ = index.hit('get-user', '')
+        self.assertEqual((hit.status_code, hit.content_type, hit.key), (200, 'application/json', ('get-user', '200', 'application/json', 'ok')))
+        self.assertEqual(index.examples[hit.key], {'id': 1, 'tags': ['a']})
+        self.assertEqual(index.hit('get-user', '200:application/json:empty')[0].key[-1], 'empty')
+        self.assertIsNone(index.hit('get-user', '200:application/json:nope')[0].key)
+        self.assertIsNone(index.hit('get-user', '200:text/plain:')[0].key)
+        self.assertEqual(index.hit('get-user', '404::')[0].key[-1], 'miss')
+        self.assertEqual(index.hit('get-user', '200:text/html:'), (None, 'response fail to match content-type'))
+        self.assertEqual(index.hit('get-user', '500::'), (None, 'response fail to match status_code'))
+        self.assertEqual(index.hit('del-user', ''), (None, 'responses is empty'))
+        self.assertEqual(index.static_keys, {('get-user', '200', 'application/json', 'empty'),
+                                             ('get-user', '404', 'application/json', 'miss')})
+
+    def test_freeze(self):
+        example = freeze({'rows': [{'id': 1}], 2: None})
+        self.assertEqual(example, {'rows': [{'id': 1}], '2': None})
+        with self.assertRaises(TypeError):
+            example['rows'][0]['id'] = 2
+        with self.assertRaises(TypeError):
+            example['rows'].append({})
+        copied = pickle.loads(pickle.dumps(example))
+        self.assertEqual(copied, example)
+        self.assertIsInstance(copied['rows'][0], FrozenDict)
@@ -1,5 +1,10 @@
 from unittest import TestCase
-from wax.mock_api import json_egg
+from types import SimpleNamespace
+import io
+from wax.lessweb import Application, Context, Request, BadParamError
+from wax.load_swagger import SwaggerData, build_snapshot
+from wax.mock_api import json_egg, body_check, mock_dealer, param_check, json_or_stream, STREAM_MIN_ROWS
+from wax.service import StateServ
 
 
 class TestMockApi(TestCase):
@@ -36,4 +41,91 @@ class TestMockApi(TestCase):
         self.assertEqual(resp_obj, {'$': [{'key': 'name'}, {'key': 'age'}]})
         a = {'$': {'key': ['name', 'age']}, '$[]': -2}
         resp_obj = json_egg(a, array=False)
-        self.assertEqual(resp_obj, {'$': [{'key': 'age'}, {'key': 'name'}]})
\ No newline at end of file
+        self.assertEqual(resp_obj, {'$': [{'key': 'age'}, {'key': 'name'}]})
+    def test_body_check_cache_key(self):
+        def operation(op_id, max_length):
+            schema = {'type': 'object', 'properties': {'avatar': {'type': 'string', 'maxLength': max_length}}}
+            return {'operationId': op_id, 'requestBody': {'content': {'multipart/form-data': {'schema': schema}}}}
+
+        def make_request():
+            body = (b'--xx\r\nContent-Disposition: form-data; name="avatar"; filename="a.png"\r\n'
+                    b'Content-Type: image/png\r\n\r\nhello\r\n--xx--\r\n')
+            request = Request('utf-8')
+            request.load({'REQUEST_METHOD': 'POST', 'PATH_INFO': '/', 'QUERY_STRING': '',
+                          'CONTENT_TYPE': 'multipart/form-data; boundary=xx', 'CONTENT_LENGTH': str(len(body)),
+                          'wsgi.input': io.BytesIO(body)})
+            return request
+
+        snapshot = build_snapshot({'paths': {}}, generation=1)
+        body_check(operation('upload-big', 100), make_request(), snapshot)
+        # 字段名相同、schema不同的operation不能复用上一个operation的validator
+        with self.assertRaises(BadParamError):
+            body_check(operation('upload-small', 4), make_request(), snapshot)
+        self.assertEqual(sorted(key for key in snapshot.validators.validators if key is not None),
+                         [('upload-big', 'body:multipart/form-data'), ('upload-small', 'body:multipart/form-data')])
+
+    def test_head_static_example(self):
+        swagger = {'paths': {'/user': {'get': {
+            'operationId': 'get-user', 'summary': 'get',
+            'responses': {'200': {'description': 'OK', 'content': {'application/json': {
+                'schema': {'type': 'array'}, 'examples': {'ok': {'value': {'id': '1', 'name': "'Tom'"}}}}}}},
+        }}}}
+        snapshot = build_snapshot(swagger, generation=1)
+        example_key = ('get-user', '200', 'application/json', 'ok')
+        plan, runs = snapshot.example_index.plans[example_key], []
+
+        class CountingPlan:
+            def run(self, env):
+                runs.append(env)
+                return plan.run(env)
+
+        snapshot.example_index.plans[example_key] = CountingPlan()
+        state = StateServ()
+        state.redis_serv = SimpleNamespace(redis=SimpleNamespace(get=lambda key: None))
+        app = Application()
+
+        def dealer(method):
+            ctx = Context(app)
+            ctx.request.load({'REQUEST_METHOD': method, 'PATH_INFO': '/wax-api/user', 'QUERY_STRING': '',
+                              'wsgi.input': io.BytesIO(b'')})
+            return mock_dealer(ctx, ctx.request, ctx.response, state), ctx.response.get_header('ETag')
+
+        old_snapshot, SwaggerData.snapshot = SwaggerData.snapshot, snapshot
+        try:
+            head = dealer('HEAD')  # 第一次执行pql并缓存
+            self.assertEqual(len(runs), 1)
+            self.assertEqual([dealer('HEAD'), dealer('GET'), dealer('HEAD')], [head] * 3)
+            self.assertEqual(len(runs), 1)
+        finally:
+            SwaggerData.snapshot = old_snapshot
+        self.assertEqual(head, snapshot.example_index.bodies[example_key])
+
+    def test_param_check_untyped_number(self):
+        schemas = {'e': {'enum': [1, 2]}, 'o': {'oneOf': [{'type': 'integer'}, {'type': 'boolean'}]},
+                   'n': {'type': ['integer', 'null']}}
+        params = [{'name': name, 'in': 'query', 'schema': schema} for name, schema in schemas.items()]
+        swagger = {'paths': {'/a': {'get': {'operationId': 'get-a', 'summary': 'a', 'parameters': params}}}}
+        snapshot = build_snapshot(swagger, generation=1)
+        specs = snapshot.param_index['get-a']
+
+        def check(query):
+            request = Request('utf-8')
+            request.load({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/a', 'QUERY_STRING': query,
+                          'wsgi.input': io.BytesIO()})
+            return param_check(specs, request, {}, snapshot, 'get-a')['query']
+
+        # schema没有单一的type时按数字再校验一次
+        self.assertEqual(check('e=1&o=2&n=3'), {'e': 1, 'o': 2, 'n': 3})
+        for query in ('e=3', 'o=x', 'n=x'):
+            with self.assertRaises(BadParamError):
+                check(query)
+
+    def test_json_or_stream(self):
+        ctx = Context(Application())
+        rows = [{'id': i} for i in range(STREAM_MIN_ROWS)]
+        # 迭代器不足STREAM_MIN_ROWS行时仍按数组返回，否则边生成边编码
+        self.assertEqual(json_or_stream(ctx, iter(rows[:-1])), rows[:-1])
+        chunks = json_or_stream(ctx, iter(rows))
+        self.assertNotIsInstance(chunks, list)
+        self.assertEqual(b''.join(chunks), ctx.app.dump_json(rows))
+        self.assertEqual(b''.join(json_or_stream(ctx, rows)), ctx.app.dump_json(rows))
@@ -0,0 +1,117 @@
+from unittest import TestCase
+from pathlib import Path
+import json
+import os
+import tempfile
+import yaml
+from wax.common_util import sorted_dict
+from wax.pack_util import SpecPacker, PackError, glob_find, packed
+
+
+def make_api(paths, schemas=None):
+    return {
+        'openapi': '3.0.0',
+        'info': {'title': '', 'version': ''},
+        'paths': paths,
+        'components': {'schemas': schemas or {}},
+    }
+
+
+def make_op(op_id, ref=None):
+    schema = {'$ref': f'#/components/schemas/{ref}'} if ref else {'type': 'object'}
+    return {'operationId': op_id, 'summary': op_id,
+            'responses': {'200': {'description': 'OK', 'content': {'application/json': {'schema': schema}}}}}
+
+
+def baseline_packed(ref_path, title, version):
+    """
+    增量打包之前的合并方式(只保留无重复key时的逻辑)，用来对比输出
+    """
+    swagger_data = {}
+    for p in glob_find(ref_path):
+        if p.suffix == '.yaml':
+            cur_api = yaml.full_load(p.open('r', encoding='utf-8'))
+        else:
+            cur_api = json.load(p.open('r', encoding='utf-8'))
+        if not swagger_data:
+            swagger_data.update(cur_api)
+            swagger_data['paths'] = {}
+            swagger_data['components'] = {'schemas': {}}
+        for key, val in cur_api.get('paths', {}).items():
+            swagger_data['paths'][key] = val
+        for key, val in cur_api.get('components', {}).get('schemas', {}).items():
+            swagger_data['components']['schemas'][key] = val
+    swagger_data['info']['title'] = title
+    swagger_data['info']['version'] = version
+    for path in swagger_data['paths']:
+        swagger_data['paths'][path] @= sorted_dict
+    swagger_data['paths'] @= sorted_dict
+    return swagger_data
+
+
+class TestPackUtil(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, data):
+        p = self.dir / name
+        p.write_text(json.dumps(data))
+        stat = p.stat()
+        os.utime(p, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))  # 保证mtime变化
+
+    def test_incremental_pack(self):
+        self.write('a.json', make_api({'/b': {'post': make_op('post-b'), 'get': make_op('get-b', ref='User')}},
+                                      {'User': {'type': 'object'}}))
+        self.write('b.json', make_api({'/a': {'get': make_op('get-a')}}, {'Page': {'$ref': '#/components/schemas/User'}}))
+        packer = SpecPacker(str(self.dir), 'title', '1.0')
+        swagger_data, changed = packer.pack()
+        self.assertIsNone(changed)
+        self.assertEqual(list(swagger_data['paths']), ['/a', '/b'])
+        self.assertEqual(list(swagger_data['paths']['/b']), ['get', 'post'])
+        self.assertEqual(swagger_data['info'], {'title': 'title', 'version': '1.0'})
+        self.assertEqual(packer.pack(), (swagger_data, set()))
+        # 修改一个operation
+        self.write('b.json', make_api({'/a': {'get': make_op('get-a2')}}, {'Page': {'$ref': '#/components/schemas/User'}}))
+        new_data, changed = packer.pack()
+        self.assertEqual(changed, {'get-a', 'get-a2'})
+        self.assertIs(new_data['paths']['/b'], swagger_data['paths']['/b'])
+        # 修改schema，通过$ref影响到get-b
+        self.write('a.json', make_api({'/b': {'post': make_op('post-b'), 'get': make_op('get-b', ref='User')}},
+                                      {'User': {'type': 'string'}}))
+        _, changed = packer.pack()
+        self.assertEqual(changed, {'get-b'})
+
+    def test_duplicated_keys(self):
+        self.write('a.json', make_api({'/a': {'get': make_op('get-a')}}))
+        packer = SpecPacker(str(self.dir), 'title', '1.0')
+        swagger_data, _ = packer.pack()
+        self.write('b.json', make_api({'/a': {'get': make_op('get-a')}}))
+        with self.assertRaises(PackError):
+            packer.pack()
+        self.assertIs(packer.swagger_data, swagger_data)
+        # 重复的key在修复前一直报错，即使改动的是其他文件
+        self.write('c.json', make_api({'/c': {'get': make_op('get-c')}}))
+        with self.assertRaises(PackError):
+            packer.pack()
+        (self.dir / 'b.json').unlink()
+        swagger_data, changed = packer.pack()
+        self.assertEqual(list(swagger_data['paths']), ['/a', '/c'])
+        self.assertEqual(changed, {'get-c'})
+
+    def test_same_as_baseline(self):
+        self.write('a.json', {'openapi': '3.0.0', 'paths': {'/z': {'post': make_op('post-z'), 'get': make_op('get-z')}},
+                              'info': {'title': 'x', 'description': 'd'}, 'tags': [{'name': 't'}],
+                              'components': {'schemas': {'B': {'type': 'object'}}}, 'servers': [{'url': '/'}]})
+        self.write('b.json', {'paths': {'/a': {'get': make_op('get-a', ref='B')}}})
+        self.write('c.yaml', {'components': {'schemas': {'A': {'type': 'string'}}}, 'info': {'title': 'ignored'}})
+        for args in [('title', '1.0'), ('title', '2.0')]:
+            expected = json.dumps(baseline_packed(str(self.dir), *args), ensure_ascii=False, indent=2)
+            self.assertEqual(json.dumps(packed(str(self.dir), *args), ensure_ascii=False, indent=2), expected)
+        # 第一个文件没有paths/components时追加在最后
+        self.write('a.json', {'openapi': '3.0.0', 'info': {'title': 'x'}, 'x-extra': 1})
+        expected = json.dumps(baseline_packed(str(self.dir), 'title', '1.0'))
+        self.assertEqual(json.dumps(packed(str(self.dir), 'title', '1.0')), expected)
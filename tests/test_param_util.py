@@ -0,0 +1,77 @@
+from unittest import TestCase
+import io
+from wax.lessweb import Request
+from wax.param_util import build_param_index, make_param_spec
+
+
+SWAGGER = {
+    'paths': {
+        '/user/{id}': {
+            'parameters': [{'name': 'id', 'in': 'path', 'required': True, 'schema': {'type': 'string'}}],
+            'get': {'operationId': 'get-user', 'parameters': [
+                {'name': 'id', 'in': 'path', 'required': True, 'schema': {'type': 'integer'}},
+                {'$ref': '#/components/parameters/Verbose'},
+            ]},
+            'delete': {'operationId': 'del-user'},
+        },
+    },
+    'components': {
+        'parameters': {'Verbose': {'name': 'verbose', 'in': 'query', 'schema': {'type': 'boolean'}}},
+        'schemas': {'Color': {'type': 'object', 'properties': {'R': {'type': 'integer'}, 'G': {'type': 'integer'}}}},
+    },
+}
+
+
+def make_request(query: str='', headers: dict=None) -> Request:
+    request = Request('utf-8')
+    env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/', 'QUERY_STRING': query, 'wsgi.input': io.BytesIO()}
+    env.update({'HTTP_' + key.upper().replace('-', '_'): val for key, val in (headers or {}).items()})
+    request.load(env)
+    return request
+
+
+def decode(param: dict, request: Request=None, url_params: dict=None):
+    spec = make_param_spec(param, SWAGGER)
+    return spec.decode(spec.fetch(request or make_request(), url_params or {}))
+
+
+class TestParamUtil(TestCase):
+    def test_param_index(self):
+        index = build_param_index(SWAGGER)
+        self.assertEqual([(spec.name, spec.kind) for spec in index['get-user']], [('id', 'integer'), ('verbose', 'boolean')])
+        self.assertEqual([(spec.name, spec.kind) for spec in index['del-user']], [('id', 'string')])
+
+    def test_primitive(self):
+        self.assertEqual(decode({'name': 'n', 'in': 'query', 'schema': {'type': 'integer'}}, make_request('n=3')), 3)
+        self.assertEqual(decode({'name': 'n', 'in': 'query', 'schema': {'type': 'integer'}}, make_request('n=x')), 'x')
+        self.assertEqual(decode({'name': 'n', 'in': 'query', 'schema': {'type': 'number'}}, make_request('n=3')), 3.0)
+        self.assertIs(decode({'name': 'n', 'in': 'query', 'schema': {'type': 'boolean'}}, make_request('n=false')), False)
+        self.assertEqual(decode({'name': 'n', 'in': 'query', 'schema': {'type': 'string'}}, make_request('n=007')), '007')
+        self.assertEqual(decode({'name': 'id', 'in': 'path', 'style': 'matrix', 'schema': {'type': 'integer'}},
+                                url_params={'id': ';id=5'}), 5)
+
+    def test_array(self):
+        schema = {'type': 'array', 'items': {'type': 'integer'}}
+        self.assertEqual(decode({'name': 'id', 'in': 'query', 'schema': schema}, make_request('id=1&id=2')), [1, 2])
+        self.assertEqual(decode({'name': 'id', 'in': 'query', 'explode': False, 'schema': schema},
+                                make_request('id=1,2')), [1, 2])
+        self.assertEqual(decode({'name': 'id', 'in': 'query', 'style': 'pipeDelimited', 'explode': False,
+                                 'schema': schema}, make_request('id=1|2')), [1, 2])
+        self.assertEqual(decode({'name': 'id', 'in': 'path', 'schema': schema}, url_params={'id': '1,2'}), [1, 2])
+        self.assertEqual(decode({'name': 'id', 'in': 'path', 'style': 'label', 'explode': True, 'schema': schema},
+                                url_params={'id': '.1.2'}), [1, 2])
+        self.assertEqual(decode({'name': 'id', 'in': 'path', 'style': 'matrix', 'explode': True, 'schema': schema},
+                                url_params={'id': ';id=1;id=2'}), [1, 2])
+        self.assertEqual(decode({'name': 'X-Ids', 'in': 'header', 'schema': schema},
+                                make_request(headers={'X-Ids': '1,2'})), [1, 2])
+
+    def test_object(self):
+        schema = {'$ref': '#/components/schemas/Color'}
+        self.assertEqual(decode({'name': 'color', 'in': 'query', 'schema': schema}, make_request('R=1&G=2&x=3')),
+                         {'R': 1, 'G': 2})
+        self.assertEqual(decode({'name': 'color', 'in': 'query', 'explode': False, 'schema': schema},
+                                make_request('color=R,1,G,2')), {'R': 1, 'G': 2})
+        self.assertEqual(decode({'name': 'color', 'in': 'query', 'style': 'deepObject', 'schema': schema},
+                                make_request('color[R]=1&color[G]=2')), {'R': 1, 'G': 2})
+        self.assertEqual(decode({'name': 'color', 'in': 'path', 'explode': True, 'schema': schema},
+                                url_params={'color': 'R=1,G=2'}), {'R': 1, 'G': 2})
@@ -1,6 +1,10 @@
 import json
+import os
+import tempfile
+from pathlib import Path
 from unittest import TestCase
-from wax.pql import apply_schema
+from wax.pql import apply_schema, is_static, compile_schema, compile_lambda, apply_lambda, PqlRuntimeError, \
+    item_limit, profile_schema
 
 
 class TestPql(TestCase):
@@ -71,3 +75,208 @@ class TestPql(TestCase):
         }
         ret = apply_schema(env={'query': {'limit': '3', 'page': '1'}}, dict_schema=schema)
         print(json.dumps(ret, ensure_ascii=False, indent=2))
+
+    def test_is_static(self):
+        schema = {'id': '1', 'name': "'Tom'", 'tags': ["['a']", "['b']"], 'kid': {'age': '3', '__item__': [0]},
+                  '__only__': ['id', 'name'], '__item__': [0]}
+        self.assertTrue(is_static(schema))
+        self.assertEqual(apply_schema(env={}, dict_schema=schema), {'id': 1, 'name': 'Tom'})
+        self.assertFalse(is_static({'id': "path['id']"}))
+        self.assertFalse(is_static({'id': '1', 'kid': {'__from__': 'Person'}}))
+        self.assertFalse(is_static({'__filter__': 'True'}))
+        self.assertFalse(is_static({'id': 1}))
+
+    def test_compile_schema(self):
+        schema = {'id': 'q * 2', 'kid': {'name': "'k' + str(q)", '__item__': [0]}, '__rename__': ['no:id'],
+                  '__item__': [0]}
+        plan = compile_schema(schema)
+        self.assertEqual(plan.check(), [])
+        self.assertEqual(plan.run({'q': 1}), {'no': 2, 'kid': {'name': 'k1'}})
+        self.assertEqual(plan.run({'q': 2}), {'no': 4, 'kid': {'name': 'k2'}})
+        # 语法错误在编译时检查出来，执行时仍在原来的阶段抛出
+        plan = compile_schema({'a': '1/0', 'kid': {'b': 'x y', '__item__': 0}, '__only__': 'a', '__filter__': True})
+        errors = plan.check()
+        self.assertEqual(errors[:2], ['__only__: 语法错误，只支持list[str]类型', 'kid/__item__: 语法错误，只支持list[int?]类型'])
+        self.assertTrue(errors[2].startswith('kid/b: 语法错误: invalid syntax'))
+        self.assertEqual(errors[3:], ['__filter__: 语法错误，只支持str类型'])
+        with self.assertRaises(PqlRuntimeError) as cm:
+            plan.run({})
+        self.assertEqual(str(cm.exception), 'a: 运行时错误: (ZeroDivisionError) division by zero')
+        self.assertEqual(compile_schema([]).check(), [': schema必须是dict类型'])
+
+    def test_lambda_cache(self):
+        compile_lambda.cache_clear()
+        plan = compile_schema({'a': 'q + 1', 'b': 'q + 1', '__return__': "[it['a'], it['b'], q]"})
+        self.assertEqual(plan.run({'q': 1}), [2, 2, 1])
+        self.assertEqual(plan.run({'q': 5}), [6, 6, 5])
+        self.assertEqual(compile_lambda.cache_info().currsize, 2)  # 'q + 1'只编译一次
+        self.assertEqual(apply_lambda({'x': 1, 'y': 2}, 'x - y', key='k'), -1)
+        self.assertEqual(apply_lambda({'y': 2, 'x': 1}, 'x - y', key='k'), -1)  # 参数名顺序不同，分别缓存
+        with self.assertRaises(PqlRuntimeError):
+            apply_lambda({}, 'x y', key='k')
+        self.assertEqual(compile_lambda.cache_info().currsize, 4)
+
+    def test_bind_rows(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as dirpath:
+            os.chdir(dirpath)
+            try:
+                os.mkdir('entity')
+                Path('entity/Task.json').write_text(json.dumps([{'id': i} for i in range(3)]))
+                Path('entity/Empty.json').write_text('[]')
+                schema = {'__from__': 't:Task', 'same': 't is it', 'q': 'q + t["id"]', 'sub': {
+                    '__from__': 'Task', '__filter__': "it['id'] < t['id']", 'v': "t['id']", '__only__': ['v']}}
+                self.assertEqual(apply_schema({'q': 10}, schema),
+                                 [{'id': i, 'same': True, 'q': 10 + i, 'sub': [{'v': i}] * i} for i in range(3)])
+                # 没有行时env中没有it，与逐行绑定时相同
+                with self.assertRaises(PqlRuntimeError) as cm:
+                    apply_schema({}, {'__from__': 'Empty', '__return__': 'it'})
+                self.assertEqual(str(cm.exception), "__return__: 运行时错误: (NameError) name 'it' is not defined")
+            finally:
+                os.chdir(cwd)
+
+    def test_lazy_pipeline(self):
+        self.assertEqual([item_limit(item) for item in [(0,), (2,), (-1,), (None, 3), (1, 5, 2), (0, -1), (0, None),
+                                                        (0, 5, 0), (-3, 5)]],
+                         [1, 3, None, 3, 5, None, None, None, None])
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as dirpath:
+            os.chdir(dirpath)
+            try:
+                os.mkdir('entity')
+                Path('entity/Task.json').write_text(json.dumps(
+                    [{'id': i, 'd': 1 if i % 10 < 3 else 0, 'score': i * 7 % 23} for i in range(100)]))
+                # map只读取当前行时只对__item__选中的行执行
+                schema = {'__from__': 'Task', 'x': "it['d'] == 1", '__item__': [0, 3]}
+                plan = compile_schema(schema)
+                self.assertEqual((plan.limit, plan.map_last), (3, True))
+                self.assertEqual([row['id'] for row in plan.run({})], [0, 1, 2])
+                self.assertEqual(compile_schema(dict(schema, __item__=[2])).run({})['id'], 2)
+                self.assertEqual(compile_schema(dict(schema, __sort__="-it['d']", __item__=[3, 6])).run({}),
+                                 [{'id': i, 'd': 1, 'score': i * 7 % 23, 'x': True} for i in [10, 11, 12]])
+                self.assertIsNone(compile_schema(dict(schema, __item__=[0, 3, 0])).run({}))
+                # map可能报错(10 // 0)时每行都要执行，报错与逐行执行相同
+                plan = compile_schema(dict(schema, x="10 // it['d']"))
+                self.assertEqual((plan.limit, plan.map_last), (None, False))
+                with self.assertRaises(PqlRuntimeError) as cm:
+                    plan.run({})
+                self.assertEqual(str(cm.exception), 'x: 运行时错误: (ZeroDivisionError) integer division or modulo by zero')
+                # top-k与完整排序的前k行相同
+                schema = {'__from__': 't:Task', '__filter__': "t['id'] % 4 != 1", '__sort__': "it['score']",
+                          '__reverse__': 'True', 'y': "[it['score'], t['id']]", '__item__': [1, 6]}
+                plan = compile_schema(schema)
+                self.assertTrue(plan.map_last)
+                full = compile_schema(schema)
+                full.limit, full.map_last = None, False
+                self.assertEqual(plan.run({}), full.run({}))
+                self.assertEqual(len(plan.run({})), 5)
+            finally:
+                os.chdir(cwd)
+
+    def test_stream(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as dirpath:
+            os.chdir(dirpath)
+            try:
+                os.mkdir('entity')
+                Path('entity/Task.json').write_text(json.dumps(
+                    [{'id': i, 'd': i % 3, 'name': None if i % 5 else 'n%d' % i} for i in range(50)]))
+                env = {'query': {'d': 1}}
+                # 不排序、不截取并且不会报错的结果逐行生成，与run()相同
+                for schema in [{'__from__': 't:Task', 'x': "[it['id'], it['d'] == 1]", '__filter__': "t['d'] == 1"},
+                               {'__from__': 'Task', '__filter__': "it['d'] == query['d']", '__only__': ['id', 'name']},
+                               {'__from__': 'Task', '__except__': ['d'], '__rename__': ['ident:id']}]:
+                    plan = compile_schema(schema)
+                    rows = plan.stream(dict(env))
+                    self.assertIsNotNone(rows, schema)
+                    self.assertNotIsInstance(rows, list)
+                    self.assertEqual(list(rows), plan.run(dict(env)))
+                # 需要完整的结果或可能报错时返回None
+                for schema in [{'__from__': 'Task', '__sort__': "it['id']"},
+                               {'__from__': 'Task', '__item__': [0, 3]},
+                               {'__from__': 'Task', '__return__': "len(query)"},
+                               {'__from__': 'Task', 'x': "10 // it['d']"},
+                               {'__from__': 'Task', 'x': "it['nope']"},
+                               {'__from__': 'Task', '__filter__': "it['d'] > query['d']"},
+                               {'__from__': 'Nope'},
+                               {'x': "1"}]:
+                    self.assertIsNone(compile_schema(schema).stream(dict(env)), schema)
+            finally:
+                os.chdir(cwd)
+
+    def test_lazy_errors(self):
+        def outcome(plan):
+            try:
+                return plan.run({'q': 4})
+            except PqlRuntimeError as e:
+                return str(e)
+
+        def rowwise(schema):
+            plan = compile_schema(schema)
+            plan.join = plan.vfilter = plan.vsort = None
+            plan.filter_first, plan.map_last, plan.limit = False, False, None
+            return plan
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as dirpath:
+            os.chdir(dirpath)
+            try:
+                os.mkdir('entity')
+                rows = [{'id': i, 'd': 1 if i < 3 else 0, 'v': 'x' if i == 5 else i} for i in range(10)]
+                Path('entity/Task.json').write_text(json.dumps(rows + [{'id': 10}]))
+                # 跳过、推迟或提前结束时没有执行到的表达式会报错，与逐行执行的报错相同
+                for schema in [
+                    {'__from__': 'Task', 'x': "10 // it['d']", '__item__': [0]},
+                    {'__from__': 'Task', 'x': "10 // it['d']", '__sort__': "it['id']", '__item__': [0]},
+                    {'__from__': 'Task', 'x': "10 // it['d']", '__filter__': "it['id'] > 1"},
+                    {'__from__': 'Task', 'x': "10 // it['d']", '__filter__': "it['id'] == q"},
+                    {'__from__': 'Task', '__filter__': "it['v'] < 8", '__item__': [0, 2]},
+                    {'__from__': 'Task', 'x': "it['d']", '__item__': [0]},  # 最后一行没有d
+                ]:
+                    self.assertIsInstance(outcome(compile_schema(schema)), str)
+                    self.assertEqual(outcome(compile_schema(schema)), outcome(rowwise(schema)))
+                # 表达式都不会报错时仍然惰性执行，结果相同
+                schema = {'__from__': 't:Task', 'x': "it.get('d') == 1", '__filter__': "t['id'] != 4",
+                          '__item__': [0, 2]}
+                plan = compile_schema(schema)
+                self.assertEqual((plan.filter_fields, plan.limit, plan.map_last), (frozenset({'id'}), 2, True))
+                self.assertEqual(outcome(plan), outcome(rowwise(schema)))
+                self.assertEqual([row['x'] for row in outcome(plan)], [True, True])
+            finally:
+                os.chdir(cwd)
+
+    def test_profile_schema(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as dirpath:
+            os.chdir(dirpath)
+            try:
+                os.mkdir('entity')
+                Path('entity/User.json').write_text(json.dumps([{'id': i} for i in range(4)]))
+                Path('entity/Order.json').write_text(json.dumps([{'userId': i % 4, 'no': i} for i in range(20)]))
+                schema = {'__from__': 'u:User', '__filter__': "u['id'] < 3", 'orders': {
+                    '__from__': 'o:Order', '__filter__': "o['userId'] == u['id']", 'x': "o['no']",
+                    '__only__': ['x']}, '__sort__': "-it['id']", '__return__': "len(u)"}
+                # __return__可能读取循环结束后的it，每行都执行map
+                result, profile = profile_schema({}, schema)
+                self.assertEqual(result, apply_schema({}, schema))
+                tree = profile['tree']
+                self.assertEqual((tree['runs'], tree['entityLoads']), (1, 1))
+                stages = {stage['stage']: stage for stage in tree['stages']}
+                self.assertEqual([(stage['rowsIn'], stage['rowsOut'], stage['evals']) for stage in stages.values()],
+                                 [(4, 4, 0), (4, 4, 0), (4, 3, 4), (3, 3, 3), (3, 3, 0), (3, 1, 1)])
+                self.assertEqual(list(stages), ['from', 'map', 'filter', 'sort', 'select', 'item'])
+                child = tree['children'][0]
+                self.assertEqual((child['path'], child['runs'], child['plan']['join']), ('orders', 4, 'userId'))
+                child_stages = {stage['stage']: stage for stage in child['stages']}
+                self.assertEqual(child_stages['filter']['strategy'], 'index:userId')
+                self.assertEqual((child_stages['filter']['rowsIn'], child_stages['filter']['rowsOut']), (80, 20))
+                self.assertEqual({expr['func']: expr['calls'] for expr in child['exprs']},
+                                 {"o['userId'] == u['id']": 20, "o['no']": 20})
+                self.assertEqual(len(profile['slowest']), 5)
+                self.assertTrue(all(expr['slow'] for expr in profile['slowest']))
+                self.assertEqual(compile_schema(schema).explain()['children'][0]['plan']['join'], 'userId')
+                result, profile = profile_schema({}, {'__from__': 'Nope'})
+                self.assertEqual(result, {'error': '__from__: 数据未创建(Nope)', 'type': 'PqlRuntimeError'})
+                self.assertEqual(profile['tree']['runs'], 1)
+            finally:
+                os.chdir(cwd)
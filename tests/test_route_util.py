@@ -0,0 +1,46 @@
+from unittest import TestCase
+import re
+from wax.lessweb.utils import re_standardize
+from wax.route_util import RouteTable
+
+
+class TestRouteUtil(TestCase):
+    def test_match(self):
+        paths = {
+            '/user/{id}': {'get': {'operationId': 'get-user'}, 'delete': {'operationId': 'del-user'}, 'parameters': []},
+            '/user/me': {'get': {'operationId': 'get-me'}},
+            '/user/{id}/book/{bookId}': {'put': {'operationId': 'put-book'}},
+            '/file/{name}.json': {'get': {'operationId': 'get-file'}},
+            '/a/{x}/b': {'get': {'operationId': 'get-b'}},
+            '/a/{y}/c': {'get': {'operationId': 'get-c'}},
+            '/': {'get': {'operationId': 'home'}},
+        }
+        routes = RouteTable(paths)
+        route, url_params = routes.match('/user/me')
+        self.assertEqual((route.template, url_params), ('/user/me', {}))
+        route, url_params = routes.match('/user/42')
+        self.assertEqual((route.template, url_params), ('/user/{id}', {'id': '42'}))
+        self.assertEqual(list(route.operations), ['GET', 'DELETE'])
+        route, url_params = routes.match('/user/me/book/7')
+        self.assertEqual((route.template, url_params), ('/user/{id}/book/{bookId}', {'id': 'me', 'bookId': '7'}))
+        route, url_params = routes.match('/file/a.b.json')
+        self.assertEqual((route.template, url_params), ('/file/{name}.json', {'name': 'a.b'}))
+        self.assertEqual(routes.match('/a/1/c')[1], {'y': '1'})
+        self.assertEqual(routes.match('/a/1/b')[1], {'x': '1'})
+        self.assertEqual(routes.match('/')[0].template, '/')
+        for path in ['/user', '/user/', '/user//book/1', '/file/a.txt', '/a/1/d', '']:
+            self.assertIsNone(routes.match(path)[0], path)
+
+    def test_same_as_regex(self):
+        paths = {f'/r{i}/{{id}}/s{j}': {'get': {}} for i in range(5) for j in range(5)}
+        paths.update({f'/r{i}/x/s{j}': {'get': {}} for i in range(3) for j in range(3)})
+        routes = RouteTable(paths)
+        for path in ['/r1/2/s3', '/r2/x/s2', '/r4/x/s4', '/r5/1/s1', '/r1/2/s3/']:
+            expect = [(key, re.search(re_standardize(key), path).groupdict()) for key in sorted(paths)
+                      if key == path or re.search(re_standardize(key), path)]
+            route, url_params = routes.match(path)
+            if not expect:
+                self.assertIsNone(route)
+            else:
+                literal = [key for key, _ in expect if key in paths and '{' not in key]
+                self.assertEqual(route.template, literal[0] if literal else expect[0][0])
@@ -0,0 +1,55 @@
+from unittest import IsolatedAsyncioTestCase
+from pathlib import Path
+import gzip
+import tempfile
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from wax.lessweb import Application, Context
+from wax.lessweb.compression import StaticVariants
+from wax.lessweb.streaming import StreamingWSGIHandler, StaticHandler, STREAM_BUFFER_SIZE
+
+
+class TestStreaming(IsolatedAsyncioTestCase):
+    async def test_handle_request(self):
+        app = Application()
+        rows = [{'id': i, 'name': 'x' * 20} for i in range(20000)]
+
+        def stream_rows(ctx: Context):
+            return ctx.app.stream_json_array(ctx, iter(rows))
+
+        app.add_get_mapping('/rows', stream_rows)
+        app.add_get_mapping('/hello', lambda: 'hello')
+        server = web.Application()
+        server.router.add_route('*', '/{path_info:.*}', StreamingWSGIHandler(app.wsgifunc()))
+        async with TestClient(TestServer(server)) as client:
+            resp = await client.get('/rows', headers={'Accept-Encoding': 'identity'})
+            self.assertEqual(resp.headers.get('Transfer-Encoding'), 'chunked')
+            self.assertEqual(await resp.json(), rows)
+            resp = await client.get('/hello')
+            self.assertEqual(resp.headers['Content-Length'], '5')
+            self.assertEqual(await resp.text(), 'hello')
+        self.assertGreater(len(rows) * 30, STREAM_BUFFER_SIZE)
+
+    async def test_static_handler(self):
+        with tempfile.TemporaryDirectory() as dirpath:
+            Path(dirpath, 'js').mkdir()
+            Path(dirpath, 'js', 'a.js').write_text('var a = 1;' * 200)
+            Path(dirpath, 'b.png').write_bytes(b'x' * 2000)
+            server = web.Application()
+            server.router.add_get('/static/{filename:.+}', StaticHandler(StaticVariants(dirpath, 1024)))
+            async with TestClient(TestServer(server)) as client:
+                resp = await client.get('/static/js/a.js', headers={'Accept-Encoding': 'gzip'}, auto_decompress=False)
+                self.assertEqual((resp.headers['Content-Encoding'], resp.headers['Vary']), ('gzip', 'Accept-Encoding'))
+                self.assertIn('javascript', resp.headers['Content-Type'])
+                self.assertEqual(gzip.decompress(await resp.read()), b'var a = 1;' * 200)
+                resp = await client.get('/static/js/a.js', headers={'Accept-Encoding': 'gzip',
+                                                                    'If-Modified-Since': resp.headers['Last-Modified']})
+                self.assertEqual(resp.status, 304)
+                resp = await client.get('/static/js/a.js', headers={'Accept-Encoding': 'identity'})
+                self.assertNotIn('Content-Encoding', resp.headers)
+                self.assertEqual(await resp.text(), 'var a = 1;' * 200)
+                resp = await client.get('/static/b.png', headers={'Accept-Encoding': 'gzip'})
+                self.assertEqual((resp.headers.get('Content-Encoding'), await resp.read()), (None, b'x' * 2000))
+                for path in ['/static/nope.js', '/static/js', '/static/..%2F..%2Fetc%2Fpasswd']:
+                    self.assertEqual((await client.get(path)).status, 404, path)
+            self.assertEqual(sorted(p.name for p in Path(dirpath).rglob('*')), ['a.js', 'b.png', 'js'])
@@ -0,0 +1,23 @@
+from unittest import TestCase
+import jsonschema
+from wax.validator_util import spec_validators
+
+
+class TestValidatorUtil(TestCase):
+    def test_validate(self):
+        swagger_data = {'paths': {}, 'components': {'schemas': {
+            'User': {'type': 'object', 'properties': {'id': {'type': 'integer'}}, 'required': ['id']},
+        }}}
+        validators = spec_validators(swagger_data)
+        schema = {'type': 'array', 'items': {'$ref': '#/components/schemas/User'}}
+        key = ('list-user', 'response:200:application/json')
+        self.assertEqual(validators.validate([{'id': 1}], key=key, schema=schema), '')
+        self.assertIs(validators.get(key, schema), validators.get(key, {}))
+        for instance in [[{'id': 'x'}], [{}], {'id': 1}]:
+            with self.assertRaises(jsonschema.ValidationError) as cm:
+                jsonschema.validate(instance, schema, cls=jsonschema.Draft7Validator,
+                                    resolver=jsonschema.RefResolver.from_schema(swagger_data))
+            self.assertEqual(validators.validate(instance, key=key, schema=schema), str(cm.exception))
+        self.assertEqual([fragment for _, fragment in validators.resolver.fragments], ['/components/schemas/User'])
+        with self.assertRaises(jsonschema.SchemaError):
+            validators.validate(1, key=None, schema={'type': 'int'})
@@ -0,0 +1,81 @@
+from unittest import TestCase, skipIf
+from pathlib import Path
+import json
+import os
+import tempfile
+from wax.entity_util import Entity
+from wax.frozen_util import freeze
+from wax.vector_util import VectorExpr, build_column, stable_order, numpy
+from wax import pql
+
+
+def make_entity(rows):
+    return Entity((0, 0, 0), freeze(rows), '', {}, {}, {})
+
+
+@skipIf(numpy is None, 'numpy is not installed')
+class TestVectorUtil(TestCase):
+    def test_build_column(self):
+        rows = [{'i': n, 'f': n / 2, 'b': n % 2 == 0, 'm': n if n % 2 else 0.5, 's': str(n), 'big': 2 ** 62}
+                for n in range(1000)]
+        self.assertEqual(build_column(rows, 'i').kind, 'i')
+        self.assertEqual(build_column(rows, 'b').kind, 'i')
+        self.assertEqual(build_column(rows, 'f').kind, 'f')
+        self.assertEqual(build_column(rows, 'm').kind, 'f')
+        self.assertIsNone(build_column(rows, 's'))
+        self.assertIsNone(build_column(rows, 'missing'))
+        self.assertIsNone(build_column(rows[:10], 'i'))  # 行数太少
+        self.assertIsNone(build_column([dict(row, big=0.5) if row['i'] == 0 else row for row in rows], 'big'))
+
+    def test_vector_expr(self):
+        rows = [{'a': n % 7 - 3, 'x': (n * 13 % 10) / 4, 'big': 2 ** 62} for n in range(1000)]
+        entity = make_entity(rows)
+        env = {'query': {'min': 1, 'name': 'x'}}
+        const = lambda func: pql.apply_lambda(env, func, key='k')  # noqa: E731
+        for func, vectorized in [
+            ("it['a'] > query['min'] and it['x'] * 2 <= 3", True),
+            ("not (it['a'] == 0 or -it['x'] > -1)", True),
+            ("0 < it['a'] < it['x']", True),
+            ("it['a'] * it['x'] - 1", True),
+            ("it['big'] * 2 > 0", False),  # 可能溢出int64
+            ("it['big'] > 0.5", False),  # int转为float64有误差
+            ("it['a'] > query['name']", False),
+            ("(it['a'] > 0) + 1", False),
+        ]:
+            expected = [bool(pql.apply_lambda({'it': row, **env}, func, key='k')) for row in rows] \
+                if vectorized else None
+            mask = VectorExpr(func, ('it',)).mask(entity, const)
+            self.assertEqual(None if mask is None else mask.tolist(), expected, func)
+        keys = VectorExpr("it['x'] - it['a']", ('it',)).keys(entity, const)
+        for reverse in (False, True):
+            expected = sorted(range(len(rows)), key=lambda i: rows[i]['x'] - rows[i]['a'], reverse=reverse)
+            self.assertEqual(stable_order(keys, reverse).tolist(), expected)
+        self.assertIsNone(VectorExpr("len(it['a'])", ('it',)).tree)
+        self.assertIsNone(VectorExpr("it['x'] / 2", ('it',)).tree)
+
+    def test_pql(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as dirpath:
+            os.chdir(dirpath)
+            try:
+                os.mkdir('entity')
+                Path('entity/Metric.json').write_text(json.dumps(
+                    [{'id': n, 'score': n * 37 % 100, 'tag': 'a' if n % 3 else 'b'} for n in range(2000)]))
+                schema = {'__from__': 'm:Metric', '__filter__': "m['score'] >= query['min']", '__sort__': "-it['score']",
+                          'top': "it['score'] == 99", '__item__': [0, 5]}
+                plan = pql.compile_schema(schema)
+                self.assertEqual((plan.vfilter.fields, plan.vsort.fields), ({'score'}, {'score'}))
+                rows = plan.run({'query': {'min': 98}})
+                self.assertEqual([row['id'] for row in rows], [27, 127, 227, 327, 427])
+                rowwise = pql.compile_schema(schema)
+                rowwise.vfilter = rowwise.vsort = None
+                self.assertEqual(rowwise.run({'query': {'min': 98}}), rows)
+                columns = pql.entity_store.entity('Metric').columns
+                self.assertEqual((list(columns), columns['score'].kind), (['score'], 'i'))
+                # map改写了filter用到的字段，或者map可能报错(不能跳过)时逐行执行
+                self.assertIsNone(pql.compile_schema(dict(schema, score="it['id']")).vfilter)
+                self.assertIsNone(pql.compile_schema(dict(schema, double="it['score'] * 2")).vfilter)
+                self.assertIsNone(pql.compile_schema(dict(schema, **{'**more': "{}"})).vsort)
+            finally:
+                os.chdir(cwd)
+
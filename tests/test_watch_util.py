@@ -0,0 +1,170 @@
+from unittest import TestCase, mock
+from pathlib import Path
+import json
+import os
+import tempfile
+import threading
+import time
+from wax.load_swagger import SwaggerData, build_snapshot
+from wax.pack_util import SpecPacker
+from wax.watch_util import Inotify, Poller, SpecWatcher, dir_signature
+
+
+def make_api(op_ids):
+    paths = {f'/{op_id}': {'get': {'operationId': op_id, 'summary': op_id, 'responses': {}}} for op_id in op_ids}
+    return {'openapi': '3.0.0', 'info': {'title': '', 'version': ''}, 'paths': paths, 'components': {'schemas': {}}}
+
+
+def write_spec(path: Path, content: str, mtime: int):
+    """
+    mtime递增，避免同一秒内的两次写入被当作没有变化
+    """
+    path.write_text(content)
+    os.utime(path, (mtime, mtime))
+
+
+def wait_until(predicate, timeout: float=5.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+class FakeSource:
+    """
+    按顺序返回预先给定的变化，用完后停止watcher
+    """
+    def __init__(self, watcher: SpecWatcher, events):
+        self.watcher = watcher
+        self.events = list(events)
+        self.timeouts = []
+        self.closed = False
+
+    def wait(self, timeout):
+        self.timeouts.append(timeout)
+        if not self.events:
+            self.watcher.stop()
+            return set()
+        return self.events.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+class TestWatchUtil(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dirpath = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_dir_signature(self):
+        write_spec(self.dirpath / 'a.json', '{}', 1000)
+        (self.dirpath / 'b.txt').write_text('x')
+        self.assertEqual(dir_signature(self.dirpath), {str(self.dirpath / 'a.json'): (1000, 2)})
+
+    def test_poller(self):
+        write_spec(self.dirpath / 'a.json', '{}', 1000)
+        poller = Poller(str(self.dirpath), interval=0.01)
+        self.assertEqual(poller.wait(timeout=1), set())
+        write_spec(self.dirpath / 'a.json', '{"a": 1}', 1001)
+        write_spec(self.dirpath / 'b.yaml', 'a: 1', 1001)
+        self.assertEqual(poller.wait(timeout=1), {str(self.dirpath / 'a.json'), str(self.dirpath / 'b.yaml')})
+        (self.dirpath / 'a.json').unlink()
+        self.assertEqual(poller.wait(timeout=1), {str(self.dirpath / 'a.json')})
+        self.assertEqual(poller.wait(timeout=1), set())
+
+    def test_inotify(self):
+        try:
+            inotify = Inotify(str(self.dirpath))
+        except OSError:
+            self.skipTest('inotify is not supported')
+        try:
+            self.assertEqual(inotify.wait(timeout=0.01), set())
+            (self.dirpath / 'a.json').write_text('{}')
+            (self.dirpath / 'b.txt').write_text('x')  # 不是spec文件
+            changed = set()
+            self.assertTrue(wait_until(lambda: changed.update(inotify.wait(timeout=0.1)) or changed))
+            self.assertEqual(changed, {str(self.dirpath / 'a.json')})
+        finally:
+            inotify.close()
+
+    def test_polling_fallback(self):
+        with mock.patch('wax.watch_util.Inotify', side_effect=OSError('inotify is not supported')):
+            watcher = SpecWatcher(str(self.dirpath), on_change=lambda paths: None)
+        self.assertIsInstance(watcher.source, Poller)
+        self.assertIsInstance(SpecWatcher(str(self.dirpath), lambda paths: None, use_inotify=False).source, Poller)
+
+    def test_debounce(self):
+        calls = []
+        watcher = SpecWatcher(str(self.dirpath), on_change=calls.append, debounce=0.3, use_inotify=False)
+        # 连续的变化合并为一次回调；debounce期间没有新变化后才回调
+        watcher.source = source = FakeSource(watcher, [{'a'}, {'b'}, {'a', 'c'}, set(), set(), {'d'}, set()])
+        watcher.run()
+        self.assertEqual(calls, [{'a', 'b', 'c'}, {'d'}])
+        self.assertEqual(source.timeouts, [1.0, 0.3, 0.3, 0.3, 1.0, 1.0, 0.3, 1.0])
+        self.assertTrue(source.closed)
+
+    def test_callback_error(self):
+        def on_change(paths):
+            raise ValueError('broken')
+
+        watcher = SpecWatcher(str(self.dirpath), on_change=on_change, use_inotify=False)
+        watcher.source = FakeSource(watcher, [{'a'}, set()])
+        watcher.run()  # 回调报错时watcher继续运行，直到stop
+        self.assertTrue(watcher.source.closed)
+
+
+class TestReload(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.spec = Path(self.tmpdir.name, 'api.json')
+        write_spec(self.spec, json.dumps(make_api(['get-a'])), 1000)
+        self.old = SwaggerData.snapshot, SwaggerData.packer
+        SwaggerData.packer = SpecPacker(self.tmpdir.name, 'demo', '1.0')
+        SwaggerData.snapshot = build_snapshot(SwaggerData.packer.pack()[0], generation=1)
+
+    def tearDown(self):
+        SwaggerData.snapshot, SwaggerData.packer = self.old
+        self.tmpdir.cleanup()
+
+    def test_reload(self):
+        write_spec(self.spec, json.dumps(make_api(['get-a', 'get-b'])), 1001)
+        SwaggerData.reload({str(self.spec)})
+        snapshot = SwaggerData.current()
+        self.assertEqual(snapshot.generation, 2)
+        self.assertEqual(sorted(snapshot.op_index), ['get-a', 'get-b'])
+        # 内容没有变化时不生成新的snapshot
+        os.utime(self.spec, (1002, 1002))
+        SwaggerData.reload({str(self.spec)})
+        self.assertIs(SwaggerData.current(), snapshot)
+        # 解析失败时继续使用旧的snapshot
+        write_spec(self.spec, '{"paths": ', 1003)
+        SwaggerData.reload({str(self.spec)})
+        self.assertIs(SwaggerData.current(), snapshot)
+        write_spec(self.spec, json.dumps(make_api(['get-c'])), 1004)
+        SwaggerData.reload({str(self.spec)})
+        self.assertEqual(SwaggerData.current().generation, 3)
+        self.assertEqual(sorted(SwaggerData.current().op_index), ['get-c'])
+
+    def test_watch_reload(self):
+        reloaded = threading.Event()
+
+        def on_change(paths):
+            SwaggerData.reload(paths)
+            reloaded.set()
+
+        watcher = SpecWatcher(self.tmpdir.name, on_change=on_change, debounce=0.05, interval=0.05, use_inotify=False)
+        watcher.start()
+        try:
+            write_spec(self.spec, json.dumps(make_api(['get-a', 'get-b'])), 1001)
+            self.assertTrue(reloaded.wait(timeout=5))
+            self.assertEqual(SwaggerData.current().generation, 2)
+            self.assertIn('get-b', SwaggerData.current().op_index)
+        finally:
+            watcher.stop()
+            watcher.join(timeout=5)
+        self.assertFalse(watcher.is_alive())
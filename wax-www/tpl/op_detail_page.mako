@@ -128,6 +128,16 @@
                 % endfor
             </tbody></table>
         % endfor
+        % if check_failures:
+            <hr style="margin-top: 20px"/>
+            <h5 style="border-left: 3px solid #B71C1C; padding-left: 6px">响应校验失败 <a href="/op/check-failures?opId=${op['operationId'] | u}" style="font-size: 14px">json</a></h5>
+            % for failure in check_failures:
+                <div style="margin-top: 20px; margin-bottom: 10px">
+                    <strong>${failure['checked_at'] | h}</strong> ${failure['location'] | h}
+                </div>
+                <pre>${failure['message'] | h}</pre>
+            % endfor
+        % endif
     </div>
     <!-- Modal Structure -->
     <div id="state-modal" class="modal">
@@ -0,0 +1,59 @@
+"""
+wax compile生成的预编译包：保存打包后的swagger及全部派生索引，以及已解析的$ref，
+wax run时如果json目录的内容没有变化就直接加载，跳过解析和索引构建。
+"""
+from typing import Any, Dict, Optional, Tuple
+from pathlib import Path
+import hashlib
+import pickle
+import sys
+from wax import __version__
+from wax.pack_util import glob_find
+
+
+BUNDLE_VERSION = 8  # 预编译包的格式有变化时+1
+BUNDLE_DIR = Path('.wax')
+
+
+def spec_digest(ref_path, title, version) -> str:
+    """
+    json目录的内容哈希，同时包含wax版本和python版本，任何一项变化都会使预编译包失效
+    """
+    h = hashlib.sha1()
+    h.update(f'{BUNDLE_VERSION}:{__version__}:{sys.version_info[:2]}:{title}:{version}'.encode())
+    for p in glob_find(ref_path):
+        h.update(b'\0' + p.name.encode() + b'\0')
+        h.update(p.read_bytes())
+    return h.hexdigest()
+
+
+def bundle_path(digest: str) -> Path:
+    return BUNDLE_DIR / f'bundle-{digest}.pickle'
+
+
+def dump_bundle(path: Path, snapshot: Any, packer: Any, refs: Dict[str, Any]) -> None:
+    """
+    :param refs: {fragment: 解析结果}，与snapshot在同一个pickle中，加载后仍然引用snapshot中的swagger
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with tmp_path.open('wb') as f:
+        pickle.dump((BUNDLE_VERSION, snapshot, packer, refs), f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path.replace(path)  # 并发启动的wax run不会读到写了一半的文件
+
+
+def load_bundle(path: Path) -> Optional[Tuple[Any, Any, Dict[str, Any]]]:
+    """
+    :return (snapshot, packer, refs)，不存在或无法加载时返回None
+    """
+    if not path.is_file():
+        return None
+    try:
+        with path.open('rb') as f:
+            bundle_version, snapshot, packer, refs = pickle.load(f)
+    except Exception as e:
+        print(f'Ignore bundle {path}: {e}')
+        return None
+    if bundle_version != BUNDLE_VERSION:
+        return None
+    return snapshot, packer, refs
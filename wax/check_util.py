@@ -0,0 +1,110 @@
+"""
+mock接口的响应校验策略，全局为config.json中的response-check，单个接口可以用x-response-check覆盖：
+    full        每次都校验(默认)
+    sampled:N   每N次校验1次，省略N时为100
+    deferred    在后台线程校验，失败记录到日志和接口详情页
+    off         不校验
+"""
+from typing import Dict, List, Callable, NamedTuple
+from collections import deque
+from functools import lru_cache
+import datetime
+import itertools
+import queue
+import threading
+import time
+
+
+CHECK_MODES = ('full', 'sampled', 'deferred', 'off')
+DEFAULT_SAMPLE = 100
+
+
+class CheckPolicy(NamedTuple):
+    mode: str
+    sample: int  # 只在mode为sampled时有意义
+
+
+@lru_cache(maxsize=None)
+def parse_policy(value: str) -> CheckPolicy:
+    """
+    'sampled:10' -> CheckPolicy('sampled', 10)，不合法时抛出ValueError
+    """
+    mode, _, sample = value.partition(':')
+    if mode not in CHECK_MODES or (sample and (mode != 'sampled' or not sample.isdigit() or int(sample) < 1)):
+        raise ValueError(f'invalid response-check: {value}, should be full|sampled[:N]|deferred|off')
+    return CheckPolicy(mode, int(sample) if sample else DEFAULT_SAMPLE)
+
+
+sample_counters: Dict = {}
+sample_lock = threading.Lock()
+
+
+def sampled(key, sample: int) -> bool:
+    """
+    同一个key每sample次返回一次True，第一次总是True。
+    请求在线程池中并发执行：计数器只在加锁后创建一次，next(itertools.count())本身是原子的
+    """
+    counter = sample_counters.get(key)
+    if counter is None:
+        with sample_lock:
+            counter = sample_counters.setdefault(key, itertools.count())
+    return next(counter) % sample == 0
+
+
+class CheckFailure(NamedTuple):
+    checked_at: float
+    operation_id: str
+    location: str  # 例如response:200:application/json
+    message: str
+
+
+class DeferredChecker(threading.Thread):
+    """
+    后台校验线程。队列满时丢弃新的校验任务并计数，不阻塞请求
+    """
+    def __init__(self, maxsize: int=1000, keep: int=100):
+        super().__init__(daemon=True)
+        self.tasks: queue.Queue = queue.Queue(maxsize)
+        self.failures: deque = deque(maxlen=keep)
+        self.checked = 0
+        self.dropped = 0
+        self.start_lock = threading.Lock()
+
+    def submit(self, key, check: Callable[[], None]) -> None:
+        """
+        :param key: (operationId, location)
+        :param check: 校验不通过时抛出异常，异常信息即错误信息
+        """
+        if self.ident is None:  # 第一次用到时才启动
+            with self.start_lock:
+                if self.ident is None:
+                    self.start()
+        try:
+            self.tasks.put_nowait((key, check))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            (operation_id, location), check = self.tasks.get()
+            try:
+                check()
+            except Exception as e:
+                failure = CheckFailure(time.time(), operation_id, location, str(e))
+                self.failures.append(failure)
+                print('[%s] deferred response check failed: %s %s' % (
+                    datetime.datetime.fromtimestamp(int(failure.checked_at)), operation_id, location))
+            finally:
+                self.checked += 1
+
+    def recent(self, operation_id: str='') -> List[Dict]:
+        """
+        :return 最近的校验失败，新的在前
+        """
+        return [{'checked_at': str(datetime.datetime.fromtimestamp(int(failure.checked_at))),
+                 'operation_id': failure.operation_id, 'location': failure.location, 'message': failure.message}
+                for failure in reversed(list(self.failures))
+                if not operation_id or failure.operation_id == operation_id]
+
+
+deferred_checker = DeferredChecker()
@@ -0,0 +1,252 @@
+"""
+把swagger中的jsonschema编译成专用的python校验函数(只判断是否合法，不产生错误信息)。
+
+支持type/required/enum/const/minimum/maximum/exclusiveMinimum/exclusiveMaximum/minLength/maxLength/pattern/format/
+items/minItems/maxItems/properties/additionalProperties/$ref，每个关键字展开成一行判断；
+其他关键字(allOf/oneOf/patternProperties等)所在的子schema交给jsonschema的validator处理。
+编译结果只会比jsonschema更严格(例如enum中1与1.0视为不同)，不会更宽松，所以判断为不合法时由jsonschema给出最终结论和错误信息。
+"""
+from typing import Dict, List, Any, Callable, Optional
+import itertools
+import re
+import jsonschema
+
+
+def is_number(x) -> bool:
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+
+def is_count(x) -> bool:
+    return isinstance(x, int) and not isinstance(x, bool) and x >= 0
+
+
+def is_scalar(x) -> bool:
+    return isinstance(x, (str, int, float, bool, type(None)))
+
+
+def is_subschema(x) -> bool:
+    return isinstance(x, (dict, bool))
+
+
+def is_pattern(x) -> bool:
+    try:
+        re.compile(x)
+        return True
+    except (TypeError, re.error):
+        return False
+
+
+TYPE_TESTS = {
+    'string': 'isinstance({v}, str)',
+    'object': 'isinstance({v}, dict)',
+    'array': 'isinstance({v}, list)',
+    'boolean': 'isinstance({v}, bool)',
+    'null': '{v} is None',
+    'number': '(isinstance({v}, (int, float)) and not isinstance({v}, bool))',
+    'integer': '((isinstance({v}, int) and not isinstance({v}, bool)) or (isinstance({v}, float) and {v}.is_integer()))',
+}
+
+# 关键字 -> 关键字的值是否可以编译
+KEYWORD_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    'type': lambda t: (t in TYPE_TESTS) if isinstance(t, str) else
+                      isinstance(t, list) and all(isinstance(x, str) and x in TYPE_TESTS for x in t),
+    'enum': lambda x: isinstance(x, list) and all(is_scalar(e) for e in x),
+    'const': is_scalar,
+    'minimum': is_number,
+    'maximum': is_number,
+    'exclusiveMinimum': is_number,
+    'exclusiveMaximum': is_number,
+    'minLength': is_count,
+    'maxLength': is_count,
+    'pattern': is_pattern,
+    'format': lambda x: isinstance(x, str),
+    'items': is_subschema,
+    'minItems': is_count,
+    'maxItems': is_count,
+    'required': lambda x: isinstance(x, list) and all(isinstance(e, str) for e in x),
+    'properties': lambda x: isinstance(x, dict) and all(is_subschema(e) for e in x.values()),
+    'additionalProperties': is_subschema,
+}
+
+# 关键字只对某种类型的instance生效
+KEYWORD_KINDS = {
+    'minimum': 'number', 'maximum': 'number', 'exclusiveMinimum': 'number', 'exclusiveMaximum': 'number',
+    'minLength': 'string', 'maxLength': 'string', 'pattern': 'string',
+    'items': 'array', 'minItems': 'array', 'maxItems': 'array',
+    'required': 'object', 'properties': 'object', 'additionalProperties': 'object',
+}
+
+MAX_INLINE_DEPTH = 16  # 超过此深度的子schema编译成单独的函数，避免缩进过深
+
+
+def compilable(schema: Dict) -> bool:
+    if '$id' in schema:  # $id会改变$ref的解析基准，交给jsonschema
+        return False
+    if '$ref' in schema:  # Draft7中$ref的兄弟关键字被忽略
+        return isinstance(schema['$ref'], str) and schema['$ref'].startswith('#')
+    for key, val in schema.items():
+        if key not in jsonschema.Draft7Validator.VALIDATORS:
+            continue  # description/example/nullable等不参与校验
+        if key not in KEYWORD_CHECKS or not KEYWORD_CHECKS[key](val):
+            return False
+    return True
+
+
+class SchemaCompiler:
+    """
+    一次compile生成一组函数：入口函数、每个被引用的$ref一个函数、以及嵌套过深的子schema
+    """
+    def __init__(self, resolver, format_checker):
+        self.resolver = resolver
+        self.format_checker = format_checker
+        self.namespace: Dict[str, Any] = {'FC': format_checker, 'SCALARS': (str, int, float, bool, type(None))}
+        self.functions: List[str] = []
+        self.pending: List[tuple] = []  # [(function_name, schema)]
+        self.ref_names: Dict[str, str] = {}
+        self.counter = itertools.count()
+
+    def compile(self, schema) -> Callable[[Any], bool]:
+        entry = self.add_function(schema)
+        while self.pending:
+            self.emit_function(*self.pending.pop())
+        exec(compile('\n\n'.join(self.functions), '<schema>', 'exec'), self.namespace)
+        return self.namespace[entry]
+
+    def const(self, value, prefix: str='C') -> str:
+        name = f'{prefix}{next(self.counter)}'
+        self.namespace[name] = value
+        return name
+
+    def add_function(self, schema) -> str:
+        name = f'check{next(self.counter)}'
+        self.pending.append((name, schema))
+        return name
+
+    def ref_function(self, ref: str) -> Optional[str]:
+        try:
+            url, resolved = self.resolver.resolve(ref)
+        except jsonschema.RefResolutionError:
+            return None
+        if url not in self.ref_names:
+            self.ref_names[url] = self.add_function(resolved)
+        return self.ref_names[url]
+
+    def emit_function(self, name: str, schema) -> None:
+        lines = [f'def {name}(v0):']
+        self.emit(schema, 'v0', lines, indent=1, depth=0)
+        lines.append('    return True')
+        self.functions.append('\n'.join(lines))
+
+    def emit_fallback(self, schema, var: str, lines: List[str], pad: str) -> None:
+        validator = jsonschema.Draft7Validator(schema, resolver=self.resolver, format_checker=self.format_checker)
+        lines.append(f'{pad}if not {self.const(validator, "V")}.is_valid({var}): return False')
+
+    def emit(self, schema, var: str, lines: List[str], indent: int, depth: int) -> None:
+        pad = '    ' * indent
+        if schema is True:
+            return
+        if schema is False:
+            lines.append(f'{pad}return False')
+            return
+        if not isinstance(schema, dict) or not compilable(schema):
+            self.emit_fallback(schema, var, lines, pad)
+            return
+        if '$ref' in schema:
+            func = self.ref_function(schema['$ref'])
+            if func is None:
+                self.emit_fallback(schema, var, lines, pad)
+            else:
+                lines.append(f'{pad}if not {func}({var}): return False')
+            return
+        if depth >= MAX_INLINE_DEPTH:
+            lines.append(f'{pad}if not {self.add_function(schema)}({var}): return False')
+            return
+        types = schema.get('type')
+        types = [types] if isinstance(types, str) else types
+        if types is not None:
+            test = ' or '.join(TYPE_TESTS[t].format(v=var) for t in types)
+            lines.append(f'{pad}if not ({test}): return False')
+        if 'enum' in schema:
+            keys = self.const(frozenset((type(e), e) for e in schema['enum']))
+            lines.append(f'{pad}if not (type({var}) in SCALARS and (type({var}), {var}) in {keys}): return False')
+        if 'const' in schema:
+            value = schema['const']
+            lines.append(f'{pad}if not (type({var}) is {self.const(type(value))} and {var} == {self.const(value)}): return False')
+        if 'format' in schema:
+            lines.append(f'{pad}if not FC.conforms({var}, {schema["format"]!r}): return False')
+        for kind in ['number', 'string', 'array', 'object']:
+            keywords = [key for key in schema if KEYWORD_KINDS.get(key) == kind]
+            if not keywords:
+                continue
+            kinds = None if types is None else {'number' if t == 'integer' else t for t in types}
+            if kinds is not None and kind not in kinds:
+                continue  # 类型已排除，关键字不会生效
+            emit_kind = getattr(self, f'emit_{kind}')
+            if kinds == {kind}:
+                emit_kind(schema, var, lines, indent, depth)
+            else:
+                self.emit_block([f'{pad}if {TYPE_TESTS[kind].format(v=var)}:'], lines,
+                                lambda: emit_kind(schema, var, lines, indent + 1, depth))
+
+    @staticmethod
+    def emit_block(headers: List[str], lines: List[str], emit_body: Callable[[], None]) -> None:
+        """
+        if/for语句块，语句块为空时连同headers一起去掉
+        """
+        start = len(lines)
+        lines.extend(headers)
+        emit_body()
+        if len(lines) == start + len(headers):
+            del lines[start:]
+
+    def emit_number(self, schema, var, lines, indent, depth) -> None:
+        pad = '    ' * indent
+        for key, op in [('minimum', '<'), ('maximum', '>'), ('exclusiveMinimum', '<='), ('exclusiveMaximum', '>=')]:
+            if key in schema:
+                lines.append(f'{pad}if {var} {op} {self.const(schema[key])}: return False')
+
+    def emit_string(self, schema, var, lines, indent, depth) -> None:
+        pad = '    ' * indent
+        if 'minLength' in schema:
+            lines.append(f'{pad}if len({var}) < {schema["minLength"]}: return False')
+        if 'maxLength' in schema:
+            lines.append(f'{pad}if len({var}) > {schema["maxLength"]}: return False')
+        if 'pattern' in schema:
+            lines.append(f'{pad}if {self.const(re.compile(schema["pattern"]), "P")}.search({var}) is None: return False')
+
+    def emit_array(self, schema, var, lines, indent, depth) -> None:
+        pad = '    ' * indent
+        if 'minItems' in schema:
+            lines.append(f'{pad}if len({var}) < {schema["minItems"]}: return False')
+        if 'maxItems' in schema:
+            lines.append(f'{pad}if len({var}) > {schema["maxItems"]}: return False')
+        if 'items' in schema and schema['items'] is not True:
+            item = f'v{depth + 1}'
+            self.emit_block([f'{pad}for {item} in {var}:'], lines,
+                            lambda: self.emit(schema['items'], item, lines, indent + 1, depth + 1))
+
+    def emit_object(self, schema, var, lines, indent, depth) -> None:
+        pad = '    ' * indent
+        if schema.get('required'):
+            lines.append(f'{pad}if not {var}.keys() >= {self.const(frozenset(schema["required"]))}: return False')
+        properties = schema.get('properties', {})
+        value = f'v{depth + 1}'
+        for name, sub_schema in properties.items():
+            self.emit_block([f'{pad}if {name!r} in {var}:', f'{pad}    {value} = {var}[{name!r}]'], lines,
+                            lambda: self.emit(sub_schema, value, lines, indent + 1, depth + 1))
+        additional = schema.get('additionalProperties', True)
+        if additional is False:
+            lines.append(f'{pad}if not {var}.keys() <= {self.const(frozenset(properties))}: return False')
+        elif additional is not True:
+            key = f'k{depth + 1}'
+            self.emit_block([f'{pad}for {key} in {var}:',
+                             f'{pad}    if {key} not in {self.const(frozenset(properties))}:',
+                             f'{pad}        {value} = {var}[{key}]'], lines,
+                            lambda: self.emit(additional, value, lines, indent + 2, depth + 1))
+
+
+def compile_check(schema, resolver, format_checker) -> Callable[[Any], bool]:
+    """
+    :return check(instance) -> bool，返回False时instance不一定不合法，需要再用jsonschema确认
+    """
+    return SchemaCompiler(resolver, format_checker).compile(schema)
@@ -0,0 +1,111 @@
+"""
+PQL的__from__读取的entity/{name}.json。每个文件只解析、校验一次，文件变化(mtime、大小或inode)后才重新加载；
+返回的rows是冻结的，所有请求共享，需要修改的行由调用者复制。
+等值join用到的哈希索引、向量化用到的列随Entity一起缓存，文件变化后与rows一起失效
+"""
+from typing import Dict, Tuple, Optional, NamedTuple, Any, List, Iterable
+import json
+import os
+import threading
+from wax.frozen_util import FrozenList, freeze
+from wax.vector_util import Column, build_column
+
+
+Stamp = Tuple[int, int, int]  # (st_mtime_ns, st_size, st_ino)
+FieldIndex = Dict[Any, List[int]]  # {字段值: 行号列表}
+
+
+def build_index(rows: FrozenList, field: str) -> Optional[FieldIndex]:
+    """
+    :return 有行缺少field时返回None(逐行执行才能得到同样的KeyError)。
+    list/dict等不可哈希的值不会与可哈希的值相等，不进入索引
+    """
+    index: FieldIndex = {}
+    for i, row in enumerate(rows):
+        if field not in row:
+            return None
+        try:
+            index.setdefault(row[field], []).append(i)
+        except TypeError:
+            pass
+    return index
+
+
+class Entity(NamedTuple):
+    stamp: Stamp
+    rows: Optional[FrozenList]  # list[FrozenDict]，文件不合法时为None
+    error: str
+    indexes: Dict[str, Optional[FieldIndex]]  # {field: 索引}，第一次用到时生成
+    columns: Dict[str, Optional[Column]]  # {field: 列}，第一次用到时生成；没有安装numpy或不是数值字段时为None
+    present: Dict[str, bool]  # {field: 是否每行都有}，第一次用到时生成
+
+    def index(self, field: str) -> Optional[FieldIndex]:
+        if field not in self.indexes:  # 并发时可能重复生成，结果相同
+            self.indexes[field] = build_index(self.rows, field)
+        return self.indexes[field]
+
+    def column(self, field: str) -> Optional[Column]:
+        if field not in self.columns:
+            self.columns[field] = build_column(self.rows, field)
+        return self.columns[field]
+
+    def has_fields(self, fields: Iterable[str]) -> bool:
+        """
+        每行都有这些字段时，it['field']不会报KeyError
+        """
+        for field in fields:
+            if field not in self.present:
+                self.present[field] = all(field in row for row in self.rows)
+            if not self.present[field]:
+                return False
+        return True
+
+
+class EntityStore:
+    def __init__(self, dirpath: str='entity'):
+        self.dirpath = dirpath
+        self.entities: Dict[str, Entity] = {}  # {文件的绝对路径: Entity}，cwd变化后不会读到其他目录的缓存
+        self.lock = threading.Lock()  # 同一个文件只由一个线程解析
+        self.loads = 0  # 实际解析文件的次数
+
+    def get(self, entity_name: str) -> Tuple[Optional[FrozenList], str]:
+        """
+        :return (rows, error_message)
+        """
+        entity = self.entity(entity_name)
+        return entity.rows, entity.error
+
+    def entity(self, entity_name: str) -> Entity:
+        """
+        :return 文件不存在或不合法时Entity.rows为None
+        """
+        path = os.path.abspath(os.path.join(self.dirpath, f'{entity_name}.json'))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return Entity((0, 0, 0), None, f'数据未创建({entity_name})', {}, {}, {})
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        entity = self.entities.get(path)
+        if entity is None or entity.stamp != stamp:
+            with self.lock:
+                entity = self.entities.get(path)
+                if entity is None or entity.stamp != stamp:
+                    entity = self.entities[path] = self.load(path, entity_name, stamp)
+        return entity
+
+    def load(self, path: str, entity_name: str, stamp: Stamp) -> Entity:
+        self.loads += 1
+        try:
+            text = open(path).read()
+        except Exception:
+            return Entity(stamp, None, f'数据未创建({entity_name})', {}, {}, {})
+        try:
+            data = json.loads(text)
+        except Exception:
+            return Entity(stamp, None, f'数据无法解析JSON({entity_name})', {}, {}, {})
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            return Entity(stamp, None, f'数据不合法，只支持list[dict]类型({entity_name})', {}, {}, {})
+        return Entity(stamp, freeze(data), '', {}, {}, {})
+
+
+entity_store = EntityStore()
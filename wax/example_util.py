@@ -0,0 +1,109 @@
+"""
+每一代swagger的example索引：{(operationId, status_code, content_type, example_name): 冻结的example}。
+apply_schema只读取example、不修改也不引用example中的对象，因此请求之间直接共享同一份example，不再需要json往返复制。
+example在加载时编译为PqlPlan，请求时只执行plan；语法错误在加载时输出，不必等到请求时才发现。
+"""
+from typing import Dict, List, Tuple, Any, Optional, NamedTuple, Set
+from wax.lessweb.webapi import http_methods
+from wax.frozen_util import FrozenDict, FrozenList, freeze  # noqa: F401
+from wax.pql import is_static, compile_schema, PqlPlan
+
+
+ExampleKey = Tuple[str, str, str, str]  # (operationId, status_code, content_type, example_name)
+
+
+class ExampleHit(NamedTuple):
+    status_code: int
+    content_type: str
+    schema: Dict
+    key: Optional[ExampleKey]  # None表示没有example，按schema生成默认的json
+
+
+class StaticBody(NamedTuple):
+    body: bytes  # 编码后的响应
+    etag: str  # 强ETag，swagger的generation加body的哈希，与lessweb生成的格式相同
+
+
+class ResponseEntry(NamedTuple):
+    status_code: str
+    content_type: str
+    schema: Dict
+    example_names: Tuple[str, ...]
+
+
+class ExampleIndex:
+    """
+    hit()的结果按(operationId, state.basic)缓存，每个operation只会有少数几种basic
+    """
+    def __init__(self, swagger_data: Dict):
+        self.examples: Dict[ExampleKey, Any] = {}
+        # {operationId: [ResponseEntry]}，顺序与swagger中相同；response没有content时为None
+        self.responses: Dict[str, List[Optional[ResponseEntry]]] = {}
+        self.hits: Dict[Tuple[str, str], Any] = {}  # 值为ExampleHit或错误信息
+        # 结果与请求无关的example，第一次请求时把编码后的响应存入bodies
+        self.static_keys: Set[ExampleKey] = set()
+        self.bodies: Dict[ExampleKey, StaticBody] = {}
+        self.plans: Dict[ExampleKey, PqlPlan] = {}
+        self.pql_errors: Dict[ExampleKey, List[str]] = {}  # 只包含有语法错误的example
+        for endpoint in swagger_data['paths'].values():
+            for op_method, operation in endpoint.items():
+                if op_method.upper() in http_methods and isinstance(operation, dict) and 'operationId' in operation:
+                    self.add(operation)
+
+    def add(self, operation: Dict) -> None:
+        op_id = operation['operationId']
+        entries: List[Optional[ResponseEntry]] = []
+        for status_code, response_val in (operation.get('responses') or {}).items():
+            if 'content' not in response_val:
+                entries.append(None)
+                continue
+            for content_key, content_val in response_val['content'].items():
+                examples = content_val.get('examples', {})
+                for example_name, example_val in examples.items():
+                    example_key = (op_id, status_code, content_key, example_name)
+                    example = self.examples[example_key] = freeze(example_val['value'])
+                    plan = self.plans[example_key] = compile_schema(example)
+                    errors = plan.check()
+                    if errors:
+                        self.pql_errors[example_key] = errors
+                    if is_static(example_val['value']):
+                        self.static_keys.add(example_key)
+                entries.append(ResponseEntry(status_code, content_key, content_val.get('schema'), tuple(examples)))
+        self.responses[op_id] = entries
+
+    def hit(self, op_id: str, state_basic: str) -> Tuple[Optional[ExampleHit], str]:
+        """
+        :param state_basic: 'status_code:content_type:example_name'，任一部分为空时取第一个
+        :return (hit, error_message)
+        """
+        ret = self.hits.get((op_id, state_basic))
+        if ret is None:
+            ret = self.hits[op_id, state_basic] = self.select(op_id, state_basic)
+        return ret
+
+    def select(self, op_id: str, state_basic: str) -> Tuple[Optional[ExampleHit], str]:
+        if state_basic:
+            state_status_code, state_content_type, state_example_name = state_basic.split(':', 2)
+        else:
+            state_status_code = state_content_type = state_example_name = ''
+        entries = self.responses.get(op_id)
+        if not entries:
+            return None, 'responses is empty'
+        matched_status = ''
+        for entry in entries:
+            if entry is None or (matched_status and entry.status_code != matched_status):
+                continue
+            if state_status_code and state_status_code != entry.status_code:
+                continue
+            matched_status = entry.status_code  # 只在第一个匹配的status_code中查找content_type
+            if state_content_type and state_content_type != entry.content_type:
+                continue
+            example_key = None
+            for example_name in entry.example_names:
+                if not state_example_name or state_example_name == example_name:
+                    example_key = (op_id, entry.status_code, entry.content_type, example_name)
+                    break
+            return ExampleHit(int(entry.status_code), entry.content_type, entry.schema, example_key), ''
+        if matched_status:
+            return None, 'response fail to match content-type'
+        return None, 'response fail to match status_code'
@@ -0,0 +1,43 @@
+"""
+只读的dict/list，用于请求之间共享的example和entity数据。json序列化和jsonschema校验与普通的dict/list相同
+"""
+from typing import Any
+import json
+
+
+def readonly(self, *args, **kwargs):
+    raise TypeError(f'{type(self).__name__} is readonly')
+
+
+class FrozenDict(dict):
+    __slots__ = ()
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = readonly  # type: ignore
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+class FrozenList(list):
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = append = extend = insert = pop = remove = clear = \
+        sort = reverse = readonly  # type: ignore
+
+    def __reduce__(self):
+        return FrozenList, (list(self),)
+
+
+def json_key(key: Any) -> Any:
+    """
+    yaml中的非字符串key按json.dumps的规则转为字符串，与之前json往返的结果一致
+    """
+    if isinstance(key, str) or not isinstance(key, (int, float, type(None))):
+        return key
+    return json.dumps(key)
+
+
+def freeze(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return FrozenDict((json_key(key), freeze(val)) for key, val in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return FrozenList(freeze(val) for val in obj)
+    return obj
@@ -1,4 +1,6 @@
-from wax.lessweb import Application, Context
+import re
+from pathlib import Path
+from wax.lessweb import Application, Context, ResourceVersion
 from wax.lessweb.plugin.redisplugin import RedisPlugin
 from wax.load_config import config
 
@@ -8,7 +10,7 @@ def allow_cors(ctx: Context):
     return ctx()
 
 
-app = Application()
+app = Application(json_codec=config.get('json-codec', 'auto'), json_compact=bool(config.get('json-compact')))
 app.add_plugin(RedisPlugin(**config['redis']))
 
 app.add_interceptor('.*', method='*', dealer=allow_cors)
@@ -23,12 +25,43 @@ app.add_get_mapping('/openapi.kt', dealer=make_kotlin_code)
 app.add_get_mapping('/solution.md', dealer=make_solution_list)
 
 from wax.tag_api import operation_list, operation_example, operation_detail, operation_edit_state, compare_swagger
+from wax.tag_api import operation_check_failures
+from wax.load_swagger import SwaggerData
+from wax.check_util import deferred_checker
 app.add_get_mapping('/', operation_list)
 app.add_get_mapping('/tag/{tag}', operation_list)
 app.add_post_mapping('/op/state', operation_edit_state)
 app.add_post_mapping('/op/diff', compare_swagger)
+app.add_get_mapping('/op/check-failures', operation_check_failures)
 app.add_get_mapping('/op/{opId}', operation_detail)
 app.add_get_mapping('/op/{opId}/example', operation_example)
 app.add_post_mapping('/op/pql', pql_playground)
 app.add_post_mapping('/op/mockjs/default', default_json)
 app.add_post_mapping('/op/mockjs/check', check_entities)
+
+# 只由swagger决定内容的页面；/op/{opId}包含deferred模式的校验失败，所以版本中带上已校验的次数
+SPEC_PAGES = re.compile(r'^/(|openapi\.json|openapi\.kt|solution\.md|tag/[^/]+|op/[^/]+)$')
+# 其中由mako模板渲染的页面，版本中还要带上模板的修改时间。config.json只在启动时读取，重启后loaded_at和ETag都会变化
+HTML_PAGES = re.compile(r'^/(|tag/[^/]+|op/[^/]+)$')
+TEMPLATE_DIR = Path('wax-www/tpl')
+
+
+def template_mtime_ns() -> int:
+    return max((path.stat().st_mtime_ns for path in TEMPLATE_DIR.glob('*.mako')), default=0)
+
+
+def spec_version(ctx: Context):
+    snapshot = SwaggerData.current()
+    path = ctx.request.path
+    if path.startswith(wax_api_prefix + '/'):  # mock接口的响应还取决于state，只生成ETag
+        return ResourceVersion(f'g{snapshot.generation}', None, False)
+    if SPEC_PAGES.match(path) and path != '/op/check-failures':
+        tag, last_modified = f'g{snapshot.generation}.{deferred_checker.checked}', snapshot.loaded_at
+        if HTML_PAGES.match(path):
+            mtime_ns = template_mtime_ns()
+            tag, last_modified = f'{tag}.t{mtime_ns:x}', max(last_modified, mtime_ns / 1e9)
+        return ResourceVersion(tag, last_modified, True)
+    return None
+
+
+app.set_version_provider(spec_version)
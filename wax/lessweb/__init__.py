@@ -14,5 +14,5 @@ from .application import interceptor, Application
 from .context import Context, Request, Response
 from .storage import Storage
 from .bridge import uint, ParamStr, MultipartFile, Jsonizable
-from .webapi import BadParamError, NotFoundError, Cookie, HttpStatus, ResponseStatus
+from .webapi import BadParamError, NotFoundError, Cookie, HttpStatus, ResponseStatus, ResourceVersion
 from .utils import _nil, eafp
@@ -3,27 +3,29 @@ Web application
 (from lessweb)
 """
 from datetime import datetime
+import hashlib
 import itertools
-import json
 import logging
 import os
 import re
 import traceback
 from types import GeneratorType
-from typing import List, Any, Callable, Dict, Optional
+from typing import List, Any, Callable, Dict, Optional, Tuple, Iterable, Iterator
 
-from .webapi import BadParamError, NotFoundError, HttpStatus
+from .webapi import BadParamError, NotFoundError, HttpStatus, ResponseStatus, ResourceVersion
 from .webapi import http_methods
 from .context import Context
 from .model import fetch_param
 from .storage import Storage
 from .utils import eafp, re_standardize, makedir
-from .bridge import make_response_encoder, JsonBridgeFunc
+from .bridge import make_response_encoder, JsonBridgeFunc, ResponseBridge
+from .codec import StdlibCodec, make_codec
+from .compression import negotiate, is_compressible, compress, compress_stream, variant_etag, StaticVariants
 from .pluginproto import PluginProto
 
 
 __all__ = [
-    "Interceptor", "Mapping", "interceptor", "Application",
+    "Interceptor", "Mapping", "DispatchTable", "interceptor", "iter_json_array", "Application",
 ]
 
 
@@ -70,8 +72,10 @@ def interceptor(dealer):
     在dealer函数中调用ctx()，就会执行它修饰的controller
     """
     def _1_wrapper(fn):
+        controller = build_controller(fn)
+
         def _1_1_controller(ctx:Context):
-            ctx.app_stack.append(build_controller(fn))
+            ctx.app_stack.append(controller)
             args, params = fetch_param(ctx, dealer)
             result = dealer(*args, **params)
             ctx.app_stack.pop()  # 有多次调用ctx()的可能性，比如批量删除
@@ -82,6 +86,73 @@ def interceptor(dealer):
     return _1_wrapper
 
 
+# Application.fixed_responses: {(path, query, tag, content_coding): (etag, headers)}
+FixedKey = Tuple[str, str, str, str]
+MAX_FIXED_RESPONSES = 4096
+MAX_COMPRESSED_BODIES = 256
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def make_etag(body: bytes, version: Optional[ResourceVersion]) -> str:
+    digest = hashlib.sha1(body).hexdigest()
+    return f'"{version.tag}-{digest}"' if version is not None else f'"{digest}"'
+
+
+def iter_json_array(rows: Iterable, dumps: Callable[[Any], bytes],
+                    chunk_size: int=STREAM_CHUNK_SIZE, separator: bytes=b', ') -> Iterator[bytes]:
+    """
+    逐行编码数组，separator与dumps的元素分隔符相同时结果与dumps(list(rows))逐字节相同，
+    每累积约chunk_size字节产出一块，内存占用与数组长度无关
+    """
+    parts = [b'[']
+    size = 1
+    for i, row in enumerate(rows):
+        data = dumps(row)
+        parts.append(separator + data if i else data)
+        size += len(data) + len(separator)
+        if size >= chunk_size:
+            yield b''.join(parts)
+            parts.clear()
+            size = 0
+    parts.append(b']')
+    yield b''.join(parts)
+
+
+# 匹配任意path的pattern，不需要执行正则
+MATCH_ALL_PATTERNS = (re_standardize('.*'), re_standardize(''), '^.*')
+
+
+class DispatchTable:
+    """
+    由Application.freeze()生成，mapping/interceptor变化后重新生成。
+    每个(mapping, 命中的interceptors)组合的调用链只构建一次，之后每次请求复用
+    """
+    def __init__(self, mapping: List[Mapping], interceptors: List[Interceptor]) -> None:
+        # {method: [(patternobj, mapping)]}，保持add_mapping的顺序
+        self.mapping: Dict[str, List[Any]] = {}
+        # {method: [(interceptor_index, patternobj|None)]}，None表示匹配任意path
+        self.interceptors: Dict[str, List[Any]] = {}
+        self.pipelines: Dict[Any, Callable] = {}
+        for method in http_methods + ('*',):  # '*'一行用于http_methods以外的method
+            self.mapping[method] = [(m.patternobj, m) for m in mapping if m.method == method or m.method == '*']
+            self.interceptors[method] = [
+                (i, None if itr.patternobj.pattern in MATCH_ALL_PATTERNS else itr.patternobj)
+                for i, itr in enumerate(interceptors) if itr.method == method or itr.method == '*']
+        self.all_interceptors = interceptors
+
+    def pipeline(self, mapping: Mapping, method: str, path: str) -> Callable:
+        itr_indices = tuple(i for i, patternobj in self.interceptors.get(method, self.interceptors['*'])
+                            if patternobj is None or patternobj.search(path))
+        key = (id(mapping), itr_indices)
+        f = self.pipelines.get(key)
+        if f is None:
+            f = build_controller(mapping.dealer)
+            for i in itr_indices:
+                f = interceptor(self.all_interceptors[i].dealer)(f)
+            self.pipelines[key] = f
+        return f
+
+
 class Application(object):
     """
     Application to delegate requests based on path.
@@ -94,35 +165,69 @@ class Application(object):
         app.run(port=8080)
 
     """
-    def __init__(self, encoding:str='utf-8') -> None:
+    def __init__(self, encoding:str='utf-8', json_codec:str='auto', json_compact:bool=False) -> None:
         self.mapping: List[Mapping] = []
         self.interceptors: List[Interceptor] = []
         self.response_bridges: List[Callable] = []
-        self.response_encoder: Any = make_response_encoder([])
+        self.response_encoder: Any = make_response_encoder([])  # 供需要JSONEncoder的代码使用
+        self.response_bridge: ResponseBridge = ResponseBridge([])
         self.encoding: str = encoding
+        self.json_codec: StdlibCodec = make_codec(json_codec, encoding, json_compact)
         self.plugins: List[PluginProto] = []
+        self.dispatch_table: Optional[DispatchTable] = None
+        self.version_provider: Optional[Callable[[Context], Optional[ResourceVersion]]] = None
+        # fixed版本的GET响应头，条件请求和HEAD命中时直接返回，不执行dealer
+        self.fixed_responses: Dict[FixedKey, Tuple[str, List[Tuple[str, str]]]] = {}
+        # 不小于此长度的文本响应按Accept-Encoding压缩，None表示不压缩
+        self.compress_min_size: Optional[int] = 1024
+        # {压缩后的ETag: 压缩后的body}，ETag相同的响应只压缩一次
+        self.compressed_bodies: Dict[str, bytes] = {}
+
+    def set_version_provider(self, provider: Callable[[Context], Optional[ResourceVersion]]):
+        """
+        provider(ctx)返回请求的资源版本，返回None表示只按响应内容生成ETag
+
+        Example:
+
+            from lessweb import Application, ResourceVersion
+            app = Application()
+            app.set_version_provider(lambda ctx: ResourceVersion(tag='v1', last_modified=None, fixed=True))
+        """
+        self.version_provider = provider
+        self.fixed_responses.clear()
+
+    def freeze(self) -> DispatchTable:
+        """
+        生成路由分发表。add_mapping/add_interceptor之后会自动失效，下次请求时重新生成
+        """
+        self.dispatch_table = DispatchTable(self.mapping, self.interceptors)
+        return self.dispatch_table
 
     def _handle_with_dealers(self, ctx: Context):
+        table = self.dispatch_table or self.freeze()
+
         def _1_mapping_match():
-            supported_methods = []
-            for mapping in self.mapping:
-                _ = mapping.patternobj.search(ctx.request.path)
+            path, method = ctx.request.path, ctx.request.method
+            for patternobj, mapping in table.mapping.get(method, table.mapping['*']):
+                _ = patternobj.search(path)
                 if _:
-                    if mapping.method == ctx.request.method or mapping.method == '*':
+                    ctx.request.param_input.load_url(_.groupdict())
+                    return table.pipeline(mapping, method, path)
+            if method == 'HEAD':  # 没有HEAD的mapping时按GET处理，wsgifunc不发送body
+                for patternobj, mapping in table.mapping['GET']:
+                    _ = patternobj.search(path)
+                    if _:
                         ctx.request.param_input.load_url(_.groupdict())
-                        return mapping.dealer
-                    elif mapping.method != 'OPTIONS':
-                        supported_methods.append(mapping.method)
-            # end: for
+                        return table.pipeline(mapping, 'GET', path)
+            # 未命中时才计算支持的methods
+            supported_methods = []
+            for mapping in self.mapping:
+                if mapping.method != 'OPTIONS' and mapping.patternobj.search(path):
+                    supported_methods.append(mapping.method)
             raise NotFoundError(methods=supported_methods)
 
         try:
-            f = build_controller(_1_mapping_match())
-            if f is None: return ''
-            for itr in self.interceptors:
-                if itr.patternobj.search(ctx.request.path) and (itr.method == ctx.request.method or itr.method == '*'):
-                    f = interceptor(itr.dealer)(f)
-            return f(ctx)
+            return _1_mapping_match()(ctx)
         except BadParamError as e:
             ctx.response.set_status(HttpStatus.BadRequest)
             return {'message': e.message, 'param': e.param}
@@ -149,10 +254,25 @@ class Application(object):
         assert method == '*' or method in http_methods, 'Method:[{}] should be * or one of {}'.format(method, http_methods)
         patternobj = re.compile(re_standardize(pattern))
         self.interceptors.insert(0, Interceptor(pattern, method, dealer, patternobj))
+        self.dispatch_table = None
 
     def add_json_bridge(self, bridge_func: JsonBridgeFunc):
+        """
+        bridge_func应当只根据对象的类型决定是否处理，不处理时返回None
+        """
         self.response_bridges.append(bridge_func)
         self.response_encoder = make_response_encoder(self.response_bridges)
+        self.response_bridge = ResponseBridge(self.response_bridges)
+
+    def set_json_codec(self, name: str, compact: bool=False):
+        """
+        :param name: auto|orjson|ujson|stdlib，指定的codec没有安装时抛出ValueError
+        :param compact: 响应使用紧凑格式(',', ':')，默认与json.dumps的输出逐字节相同
+        """
+        self.json_codec = make_codec(name, self.encoding, compact)
+
+    def dump_json(self, obj: Any) -> bytes:
+        return self.json_codec.dumps(obj, self.response_bridge)
 
     def add_mapping(self, pattern: str, method: str, dealer: Callable):
         """
@@ -170,6 +290,7 @@ class Application(object):
         assert method == '*' or method in http_methods, 'Method:[{}] should be * or one of {}'.format(method, http_methods)
         patternobj = re.compile(re_standardize(pattern))
         self.mapping.append(Mapping(pattern, method, dealer, '', patternobj))
+        self.dispatch_table = None
 
     # add_*_interceptor / add_*_mapping are generated by code below:
     """
@@ -256,28 +377,52 @@ class Application(object):
 
             ctx = Context(self)
             ctx.request.load(env)
+            method = ctx.request.method
             try:
+                version = self.version_provider(ctx) if self.version_provider is not None else None
+                coding = negotiate(ctx.request.get_header('Accept-Encoding')) \
+                    if self.compress_min_size is not None else ''
+                fixed_key: Optional[FixedKey] = None
+                if version is not None and version.fixed and method in ('GET', 'HEAD'):
+                    fixed_key = (ctx.request.path, ctx.request.query, version.tag, coding)
+                    fixed = self.fixed_responses.get(fixed_key)
+                    if fixed is not None and (method == 'HEAD' or
+                                              ctx.request.is_not_modified(fixed[0], version.last_modified)):
+                        status_core = HttpStatus.OK.value if method == 'HEAD' else HttpStatus.NotModified.value
+                        start_resp(f'{status_core.code} {status_core.reason}', fixed[1])
+                        return [b'']
                 mimekey = 'html'
                 resp = self._handle_with_dealers(ctx)
                 resp_content_type = ctx.response.get_header('Content-Type')
                 if isinstance(resp, GeneratorType):
-                    result = _1_peep(resp)
+                    result = _1_peep(self._compress_stream(ctx, resp, coding))
                 else:
                     if not isinstance(resp, (bytes, str)) and resp is not None:
                         if not resp_content_type or \
                                 (resp_content_type and 'json' in resp_content_type.lower()):
-                            resp = json.dumps(resp, ensure_ascii=False, cls=self.response_encoder)
+                            resp = self.dump_json(resp)
                             mimekey = 'json'
                         else:
                             resp = str(resp)
                     result = (resp,)
                 if not resp_content_type:
                     ctx.response.send_content_type(mimekey=mimekey, encoding=self.encoding)
+                if not isinstance(resp, GeneratorType):
+                    body = resp if isinstance(resp, bytes) else (resp or '').encode(self.encoding, 'replace')
+                    conditional = method in ('GET', 'HEAD') and self._status_core(ctx).code == 200
+                    # 内容由dealer的ETag或fixed版本决定时，压缩结果可以按ETag缓存
+                    cacheable = bool(ctx.response.get_header('ETag')) or (version is not None and version.fixed)
+                    if conditional and not ctx.response.get_header('ETag'):
+                        ctx.response.send_etag(make_etag(body, version))
+                    body = self._compress_body(ctx, body, coding, cacheable)
+                    result = self._conditional_result(ctx, body, version, fixed_key) if conditional else (body,)
             except Exception as e:
                 logging.exception(e)
                 ctx.response.send_content_type(encoding=self.encoding)
                 ctx.response.set_status(HttpStatus.InternalServerError)
                 result = (traceback.format_exc(),)
+            if method == 'HEAD':  # HEAD的响应头与GET相同，但不发送body
+                result = (b'',)
 
             def _2_build_result(result):
                 for r in result:
@@ -291,13 +436,11 @@ class Application(object):
                         yield str(r).encode(self.encoding)
 
             result = _2_build_result(result)
-            status_wrap = ctx.response.get_status()
-            status_core = status_wrap.value if isinstance(status_wrap, HttpStatus) else status_wrap
-            status_text = f'{status_core.code} {status_core.reason}'
             headers = list(ctx.response._headers.items())
             for cookie in ctx.response._cookies.values():
                 headers.append(('Set-Cookie', cookie.dumps()))
-            start_resp(status_text, headers)
+            status_core = self._status_core(ctx)
+            start_resp(f'{status_core.code} {status_core.reason}', headers)
             return itertools.chain(result, (b'',))
 
         for m in middleware:
@@ -305,6 +448,79 @@ class Application(object):
 
         return wsgi
 
+    @staticmethod
+    def _status_core(ctx: Context) -> ResponseStatus:
+        status_wrap = ctx.response.get_status()
+        return status_wrap.value if isinstance(status_wrap, HttpStatus) else status_wrap
+
+    def _compress_body(self, ctx: Context, body: bytes, coding: str, cacheable: bool) -> bytes:
+        """
+        压缩后ETag加上content-coding后缀，cacheable时按新的ETag缓存压缩结果
+        """
+        if self.compress_min_size is None or len(body) < self.compress_min_size or \
+                ctx.response.get_header('Content-Encoding') or \
+                not is_compressible(ctx.response.get_header('Content-Type')):
+            return body
+        ctx.response.set_header('Vary', 'Accept-Encoding')
+        if not coding:
+            return body
+        ctx.response.set_header('Content-Encoding', coding)
+        etag = ctx.response.get_header('ETag')
+        if not etag:
+            return compress(body, coding)
+        etag = variant_etag(etag, coding)
+        ctx.response.send_etag(etag)
+        if not cacheable:
+            return compress(body, coding)
+        compressed = self.compressed_bodies.get(etag)
+        if compressed is None:
+            if len(self.compressed_bodies) >= MAX_COMPRESSED_BODIES:
+                self.compressed_bodies.clear()
+            compressed = self.compressed_bodies[etag] = compress(body, coding)
+        return compressed
+
+    def _compress_stream(self, ctx: Context, chunks: Iterator, coding: str) -> Iterator:
+        if self.compress_min_size is None or ctx.response.get_header('Content-Encoding') or \
+                not is_compressible(ctx.response.get_header('Content-Type')):
+            return chunks
+        ctx.response.set_header('Vary', 'Accept-Encoding')
+        if not coding:
+            return chunks
+        ctx.response.set_header('Content-Encoding', coding)
+        return compress_stream((r.encode(self.encoding, 'replace') if isinstance(r, str) else r for r in chunks),
+                               coding)
+
+    def stream_json_array(self, ctx: Context, rows: Iterable) -> Iterator[bytes]:
+        """
+        用于很大的数组响应：分块编码，由run()以chunked编码边生成边发送
+
+        Example:
+
+            def list_users(ctx: Context):
+                return ctx.app.stream_json_array(ctx, (user for user in iter_users()))
+        """
+        ctx.response.send_content_type(mimekey='json', encoding=self.encoding)
+        return iter_json_array(rows, self.dump_json,
+                               separator=self.json_codec.separators[0].encode(self.encoding))
+
+    def _conditional_result(self, ctx: Context, body: bytes, version: Optional[ResourceVersion],
+                            fixed_key: Optional[FixedKey]) -> tuple:
+        """
+        为GET/HEAD的200响应补充Last-Modified，条件请求命中时改为304
+        """
+        etag = ctx.response.get_header('ETag')
+        last_modified = version.last_modified if version is not None else None
+        if last_modified is not None:
+            ctx.response.send_last_modified(last_modified)
+        if fixed_key is not None and not ctx.response._cookies:
+            if len(self.fixed_responses) >= MAX_FIXED_RESPONSES:
+                self.fixed_responses.clear()
+            self.fixed_responses[fixed_key] = (etag, list(ctx.response._headers.items()))
+        if ctx.request.method == 'GET' and ctx.request.is_not_modified(etag, last_modified):
+            ctx.response.set_status(HttpStatus.NotModified)
+            return (b'',)
+        return (body,)
+
     def run(self, wsgifunc=None, port:int=8080, homepath:str='', staticpath:Optional[str]='static'):
         """
         Example:
@@ -316,7 +532,7 @@ class Application(object):
             app.run(port=80, homepath='/api')
         """
         from aiohttp import web
-        from aiohttp_wsgi import WSGIHandler  # type: ignore
+        from .streaming import StreamingWSGIHandler, StaticHandler
         app = web.Application()
         if wsgifunc is None:
             wsgifunc = self.wsgifunc()
@@ -328,6 +544,11 @@ class Application(object):
 
         if staticpath is not None:
             makedir(staticpath)
-            app.router.add_static(prefix='/static/', path=staticpath)
-        app.router.add_route("*", homepath + "/{path_info:.*}", WSGIHandler(wsgifunc))
+            if self.compress_min_size is None:
+                app.router.add_static(prefix='/static/', path=staticpath)
+            else:  # 压缩结果保存在内存中，不在静态目录中生成.gz/.br文件
+                variants = StaticVariants(staticpath, self.compress_min_size)
+                variants.precompress()
+                app.router.add_get('/static/{filename:.+}', StaticHandler(variants))
+        app.router.add_route("*", homepath + "/{path_info:.*}", StreamingWSGIHandler(wsgifunc))
         web.run_app(app, port=port)
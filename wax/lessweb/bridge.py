@@ -2,12 +2,11 @@
 from enum import Enum
 from datetime import datetime as Datetime
 from json import JSONEncoder
-from itertools import chain
-from typing import Type, List, Callable, Union, Dict, Any
+from typing import Type, List, Callable, Union, Dict, Any, Set
 from .storage import Storage
 
 
-__all__ = ["uint", "Jsonizable", "ParamStr", "MultipartFile", "JsonBridgeFunc"]
+__all__ = ["uint", "Jsonizable", "ParamStr", "MultipartFile", "JsonBridgeFunc", "ResponseBridge"]
 
 
 class uint(int):
@@ -49,19 +48,52 @@ def default_response_bridge(obj: Any) -> Jsonizable:
     return None
 
 
+class ResponseBridge:
+    """
+    把json无法编码的对象转换为Jsonizable，用作JSONEncoder.default或orjson的default。
+    每种类型第一次出现时按顺序尝试全部bridge，记下处理它的bridge，之后同类型的对象直接分派；
+    因此bridge应当只根据类型决定是否处理。分派的bridge返回None时仍会按顺序尝试全部bridge
+    """
+    def __init__(self, bridge_funcs: List[JsonBridgeFunc]) -> None:
+        self.bridge_funcs: List[JsonBridgeFunc] = list(bridge_funcs) + [default_response_bridge]
+        self.dispatch: Dict[type, JsonBridgeFunc] = {}
+        self.unbridged: Set[type] = set()  # 没有bridge能处理的类型，编码为null
+
+    def __call__(self, obj: Any) -> Jsonizable:
+        cls = type(obj)
+        bridge_func = self.dispatch.get(cls)
+        if bridge_func is not None:
+            dest_val = bridge_func(obj)
+            if dest_val is not None:
+                return dest_val
+        elif cls in self.unbridged:
+            return None
+        return self.resolve(obj)
+
+    def resolve(self, obj: Any) -> Jsonizable:
+        if obj is None:
+            return obj
+        cls = type(obj)
+        for bridge_func in self.bridge_funcs:
+            dest_val = bridge_func(obj)
+            if dest_val is not None:
+                self.dispatch.setdefault(cls, bridge_func)
+                return dest_val
+        try:
+            if Storage.type_hints(cls):
+                self.dispatch.setdefault(cls, Storage.of)
+                return Storage.of(obj)
+        except:
+            pass
+        self.unbridged.add(cls)
+        return None
+
+
 def make_response_encoder(bridge_funcs: List[JsonBridgeFunc]):
+    bridge = ResponseBridge(bridge_funcs)
+
     class ResponseEncoder(JSONEncoder):
         def default(self, obj):
-            if obj is None:
-                return obj
-            for bridge_func in chain(bridge_funcs, [default_response_bridge]):
-                dest_val = bridge_func(obj)
-                if dest_val is not None:
-                    return dest_val
-            try:
-                if Storage.type_hints(type(obj)):
-                    return Storage.of(obj)
-            except:
-                pass
+            return bridge(obj)
 
     return ResponseEncoder
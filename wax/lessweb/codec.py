@@ -0,0 +1,116 @@
+"""
+响应编码和请求解析使用的JSON codec。安装了orjson或ujson时优先使用，无法处理时(例如超过64位的整数)回退到标准库。
+默认(compact=False)各codec的响应输出都由标准库生成，与json.dumps(ensure_ascii=False)逐字节相同，ETag不变；
+compact=True时才用orjson/ujson编码并统一使用紧凑分隔符(',', ':')，科学计数法的小数写法不同(1e+16与1e16)但数值相同
+(from lessweb)
+"""
+from typing import Any, Callable, Optional
+import json
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+try:
+    import ujson  # type: ignore
+except ImportError:
+    ujson = None
+
+
+__all__ = ["JSON_CODECS", "StdlibCodec", "OrjsonCodec", "UjsonCodec", "make_codec"]
+
+
+JSON_CODECS = ('auto', 'orjson', 'ujson', 'stdlib')
+SEPARATORS = (', ', ': ')  # 与json.dumps的默认值相同
+COMPACT_SEPARATORS = (',', ':')
+# orjson/ujson把超过64位的整数解析为float或报错，含有这样的数字时交给标准库。
+# 数字映射为'0'、其他字节映射为' '后查找连续19个'0'，比正则快一个数量级
+DIGIT_MASK = bytes(0x30 if 0x30 <= i <= 0x39 else 0x20 for i in range(256))
+LONG_DIGITS = b'0' * 19
+
+DefaultFunc = Optional[Callable[[Any], Any]]
+
+
+def has_long_number(data: bytes) -> bool:
+    return LONG_DIGITS in data.translate(DIGIT_MASK)
+
+
+class StdlibCodec:
+    name = 'stdlib'
+
+    def __init__(self, encoding: str='utf-8', compact: bool=False):
+        self.encoding = encoding
+        self.compact = compact
+        self.separators = COMPACT_SEPARATORS if compact else SEPARATORS
+
+    def dumps(self, obj: Any, default: DefaultFunc=None) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=self.separators, default=default).encode(
+            self.encoding, 'replace')
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data.decode(self.encoding))
+
+
+class OrjsonCodec(StdlibCodec):
+    name = 'orjson'
+
+    def __init__(self, encoding: str='utf-8', compact: bool=False):
+        super().__init__(encoding, compact)
+        # datetime和dataclass交给default，与标准库一样由bridge决定格式
+        self.option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def dumps(self, obj: Any, default: DefaultFunc=None) -> bytes:
+        if not self.compact:  # orjson只能输出紧凑格式
+            return super().dumps(obj, default)
+        try:
+            return orjson.dumps(obj, default=default, option=self.option)
+        except TypeError:
+            return super().dumps(obj, default)
+
+    def loads(self, data: bytes) -> Any:
+        if has_long_number(data):
+            return super().loads(data)
+        try:
+            return orjson.loads(data)
+        except ValueError:  # 例如NaN，标准库可以解析
+            return super().loads(data)
+
+
+class UjsonCodec(StdlibCodec):
+    name = 'ujson'
+
+    def dumps(self, obj: Any, default: DefaultFunc=None) -> bytes:
+        if not self.compact:
+            return super().dumps(obj, default)
+        try:
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, default=default).encode(
+                self.encoding)
+        except (TypeError, ValueError, OverflowError):
+            return super().dumps(obj, default)
+
+    def loads(self, data: bytes) -> Any:
+        if has_long_number(data):
+            return super().loads(data)
+        try:
+            return ujson.loads(data)
+        except ValueError:
+            return super().loads(data)
+
+
+def make_codec(name: str='auto', encoding: str='utf-8', compact: bool=False) -> StdlibCodec:
+    """
+    :param name: auto时按orjson、ujson、stdlib的顺序选择已安装的；指定的codec没有安装时抛出ValueError
+    :param compact: 响应使用紧凑格式，orjson/ujson只在这时用于编码
+    """
+    if name not in JSON_CODECS:
+        raise ValueError(f'invalid json codec: {name}, should be {"|".join(JSON_CODECS)}')
+    if encoding.lower().replace('-', '') != 'utf8':  # orjson/ujson只支持utf-8
+        return StdlibCodec(encoding, compact)
+    if name in ('auto', 'orjson') and orjson is not None:
+        return OrjsonCodec(encoding, compact)
+    if name in ('auto', 'ujson') and ujson is not None:
+        return UjsonCodec(encoding, compact)
+    if name in ('auto', 'stdlib'):
+        return StdlibCodec(encoding, compact)
+    raise ValueError(f'json codec {name} is not installed')
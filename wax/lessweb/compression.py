@@ -0,0 +1,133 @@
+"""
+按Accept-Encoding协商响应压缩。brotli为可选依赖，没有安装时只支持gzip
+"""
+from typing import Dict, Optional, Tuple, Iterable, Iterator
+from pathlib import Path
+import gzip
+import zlib
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+
+__all__ = ["supported_codings", "negotiate", "is_compressible", "compress", "compress_stream", "variant_etag",
+           "StaticVariants"]
+
+
+COMPRESSIBLE_TYPES = ('text/', 'json', 'javascript', 'xml', 'svg')
+COMPRESSIBLE_SUFFIXES = ('.html', '.htm', '.css', '.js', '.json', '.map', '.svg', '.txt', '.md', '.xml')
+
+
+def supported_codings() -> Tuple[str, ...]:
+    """
+    q值相同时按此顺序选择
+    """
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encoding: Optional[str]) -> str:
+    """
+    :return 'br'、'gzip'，不压缩时返回''
+
+    >>> negotiate('deflate, gzip;q=0.8')
+    'gzip'
+    >>> negotiate('gzip;q=0, identity')
+    ''
+    """
+    if not accept_encoding:
+        return ''
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding.strip().lower()] = q
+    best, best_q = '', 0.0
+    for coding in supported_codings():
+        q = weights.get(coding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    content_type = (content_type or '').lower()
+    return any(s in content_type for s in COMPRESSIBLE_TYPES)
+
+
+def compress(body: bytes, coding: str) -> bytes:
+    if coding == 'br':
+        return brotli.compress(body)
+    return gzip.compress(body, compresslevel=6, mtime=0)  # mtime=0使相同的body压缩结果也相同
+
+
+def compress_stream(chunks: Iterable[bytes], coding: str) -> Iterator[bytes]:
+    """
+    逐块压缩流式响应，只在压缩器有输出时产出
+    """
+    if coding == 'br':
+        compressor = brotli.Compressor()
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31即gzip格式
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        out = process(chunk)
+        if out:
+            yield out
+    yield finish()
+
+
+def variant_etag(etag: str, coding: str) -> str:
+    """
+    压缩后是不同的表示，强ETag需要区分
+
+    >>> variant_etag('"g1-abc"', 'gzip')
+    '"g1-abc-gzip"'
+    """
+    if not coding or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{coding}"'
+
+
+class StaticVariants:
+    """
+    静态文件的.gz/.br压缩结果，保存在内存中而不写入静态目录。原文件的mtime或大小变化后重新压缩
+    """
+    def __init__(self, dirpath: str, min_size: int):
+        self.root = Path(dirpath).resolve()
+        self.min_size = min_size
+        self.variants: Dict[Tuple[Path, str], Tuple[int, int, bytes]] = {}  # {(文件, coding): (mtime_ns, size, 压缩结果)}
+
+    def precompress(self) -> int:
+        """
+        启动时压缩全部可压缩的文件
+        :return 压缩结果的个数
+        """
+        return sum(self.get(path, coding) is not None
+                   for path in self.root.rglob('*') for coding in supported_codings())
+
+    def get(self, path: Path, coding: str) -> Optional[bytes]:
+        """
+        :return path按coding压缩的结果，不需要压缩时返回None
+        """
+        if not coding or path.suffix.lower() not in COMPRESSIBLE_SUFFIXES:
+            return None
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        if not path.is_file() or stat.st_size < self.min_size:
+            return None
+        cached = self.variants.get((path, coding))
+        if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+            cached = self.variants[(path, coding)] = (stat.st_mtime_ns, stat.st_size,
+                                                      compress(path.read_bytes(), coding))
+        return cached[2]
@@ -1,5 +1,4 @@
 from typing import Optional, Dict, List, Union, TYPE_CHECKING
-import json
 import os
 
 from requests.structures import CaseInsensitiveDict
@@ -9,6 +8,8 @@ from .webapi import Cookie, HttpStatus, ResponseStatus, ParamInput
 from .bridge import Jsonizable, ParamStr, MultipartFile
 from .webapi import header_name_of_wsgi_key, wsgi_key_of_header_name
 from .webapi import parse_cookie, mimetypes
+from .webapi import http_date, parse_http_date, etag_matches
+from .codec import StdlibCodec
 from .utils import eafp
 
 
@@ -48,12 +49,13 @@ class Request:
 
         lessweb use ctx.path in routing.
     """
-    def __init__(self, encoding: str):
+    def __init__(self, encoding: str, json_codec: Optional[StdlibCodec]=None):
         self._cookies: Dict[str, str] = {}
         self._aliases: Dict[str, str] = {}  # alias {realname: queryname}
         self._params: Dict[str, Union[ParamStr, Jsonizable, None]] = {}
 
         self.encoding: str = encoding
+        self.json_codec: StdlibCodec = json_codec or StdlibCodec(encoding)
         self.environ: Dict = {}
         self.env: Dict = {}
         self.host: str = ''
@@ -105,7 +107,7 @@ class Request:
         # parse form params
         if self.body_data:
             if self.is_json():
-                self.json_input = eafp(lambda: json.loads(self.body_data.decode(encoding)),
+                self.json_input = eafp(lambda: self.json_codec.loads(self.body_data),
                                        {'__error__': 'invalid json received'})
             elif self.is_form():
                 eafp(lambda: self.param_input.load_form(self.body_data, self.env, encoding, self.file_input), None)
@@ -145,6 +147,18 @@ class Request:
     def get_headernames(self) -> List[str]:
         return [s for s in (header_name_of_wsgi_key(k) for k in self.env.keys()) if s]
 
+    def is_not_modified(self, etag: str, last_modified: Optional[float]) -> bool:
+        """
+        同时有If-None-Match和If-Modified-Since时只看If-None-Match
+        """
+        if_none_match = self.get_header('If-None-Match')
+        if if_none_match is not None:
+            return etag_matches(if_none_match, etag)
+        if last_modified is None:
+            return False
+        since = parse_http_date(self.get_header('If-Modified-Since'))
+        return since is not None and int(last_modified) <= since
+
     def get_auth_bearer(self) -> Optional[str]:
         header_val = self.get_header('Authorization')
         if header_val is None:
@@ -231,6 +245,12 @@ class Response:
     def send_allow_methods(self, methods: List[str]):
         self.set_header('Allow', ', '.join(methods))
 
+    def send_etag(self, etag: str) -> None:
+        self.set_header('ETag', etag)
+
+    def send_last_modified(self, timestamp: float) -> None:
+        self.set_header('Last-Modified', http_date(timestamp))
+
     def send_redirect(self, location: str) -> None:
         self.set_header('Location', location)
 
@@ -246,7 +266,7 @@ class Context(object):
     def __init__(self, app: 'Application') -> None:
         self.app_stack: List = []
         self.app: Application = app
-        self.request: Request = Request(app.encoding)
+        self.request: Request = Request(app.encoding, app.json_codec)
         self.response: Response = Response(app.encoding)
         self.box: Dict = {}
 
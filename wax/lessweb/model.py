@@ -9,7 +9,7 @@ from .utils import func_arg_spec
 from .storage import Storage
 
 
-__all__ = ['request_bridge']
+__all__ = ['request_bridge', 'compile_binding', 'compile_service']
 
 
 @lru_cache(maxsize=None)
@@ -31,26 +31,50 @@ def model_or_service(cls: Type) -> int:
         return 0
 
 
-def fetch_service(ctx: Context, service_type: Type):
+def inject_context(ctx: Context) -> Context:
+    return ctx
+
+
+def inject_request(ctx: Context) -> Request:
+    return ctx.request
+
+
+def inject_response(ctx: Context) -> Response:
+    return ctx.response
+
+
+@lru_cache(maxsize=None)
+def compile_service(service_type: Type) -> Callable[[Context], Any]:
     """
-    :return:  cast(service_type, ctx)
+    只在第一次使用时读取service_type的类型注解，返回 ctx -> service_obj 的注入函数
     """
-    params: Dict[str, Any] = {}
+    injectors: List[Tuple[str, Callable]] = []
     for realname, realtype in Storage.type_hints(service_type).items():
         if realtype == Context:
-            params[realname] = ctx
+            injectors.append((realname, inject_context))
         elif realtype == Request:
-            params[realname] = ctx.request
+            injectors.append((realname, inject_request))
         elif realtype == Response:
-            params[realname] = ctx.response
+            injectors.append((realname, inject_response))
         elif model_or_service(realtype) == 2:
-            params[realname] = fetch_service(ctx, realtype)
+            injectors.append((realname, compile_service(realtype)))
         else:
             pass  # 其他类型不注入
-    service_obj = service_type()
-    for key, val in params.items():
-        setattr(service_obj, key, val)
-    return service_obj
+
+    def _1_fetch_service(ctx: Context):
+        service_obj = service_type()
+        for realname, inject in injectors:
+            setattr(service_obj, realname, inject(ctx))
+        return service_obj
+
+    return _1_fetch_service
+
+
+def fetch_service(ctx: Context, service_type: Type):
+    """
+    :return:  cast(service_type, ctx)
+    """
+    return compile_service(service_type)(ctx)
 
 
 def request_bridge(inputval: Any, target_type: Type):
@@ -116,45 +140,96 @@ def fetch_model(ctx: Context, target_type: Type) -> Any:
         return target_obj
 
 
-def fetch_param(ctx: Context, fn: Callable) -> Tuple[List, Dict[str, Any]]:
+def compile_converter(target_type: Type) -> Callable[[Any], Any]:
     """
-    fn: dealer function
-    return: Dict[realname, Context|Request|Response|Model|...]
+    :return: inputval -> cast(target_type, inputval)，对最常见的ParamStr输入走捷径
     """
-    args: List = []
-    kwargs: Dict[str, Any] = {}
-    for realname, (realtype, has_default, positional_only) in func_arg_spec(fn).items():
-        value: Any
-        if realtype == Context:
-            value = ctx
-        elif realtype == Request:
-            value = ctx.request
-        elif realtype == Response:
-            value = ctx.response
-        elif model_or_service(realtype) == 2:
-            value = fetch_service(ctx, realtype)
+    if target_type == Any:
+        return lambda inputval: inputval
+    if isinstance(target_type, type) and issubclass(target_type, int):
+        def _1_int_converter(inputval):
+            if type(inputval) is ParamStr:
+                return target_type(int(inputval))
+            return request_bridge(inputval, target_type)
+        return _1_int_converter
+    if target_type is str:
+        def _1_str_converter(inputval):
+            if type(inputval) is ParamStr:
+                return str(inputval)
+            return request_bridge(inputval, target_type)
+        return _1_str_converter
+    return lambda inputval: request_bridge(inputval, target_type)
+
+
+_SKIP = object()  # 参数有默认值且请求中没有时，不传入dealer
+
+
+def compile_param(realname: str, realtype: Type, has_default: bool, positional_only: bool) -> Callable[[Context], Any]:
+    if realtype == Context:
+        return inject_context
+    elif realtype == Request:
+        return inject_request
+    elif realtype == Response:
+        return inject_response
+    elif model_or_service(realtype) == 2:
+        return compile_service(realtype)
+    _, realtype = optional_core(realtype)
+    if not isinstance(realtype, type) and not is_generic_type(realtype):
+        def _1_unsupported(ctx: Context):
+            raise BadParamError(param=realname, message='Unsupported type %s' % realtype)
+        return _1_unsupported
+    if positional_only:
+        return lambda ctx: fetch_model(ctx, realtype)
+    converter = compile_converter(realtype)
+
+    def _1_fetch_input(ctx: Context):
+        queryname = ctx.request._aliases.get(realname, realname)
+        inputval = ctx.request.get_input(queryname)
+        if inputval is not None:
+            try:
+                return converter(inputval)
+            except Exception as e:
+                raise BadParamError(param=realname, message=str(e))
+        elif not has_default:
+            raise BadParamError(param=realname, message='Missing required param')
         else:
-            _, realtype = optional_core(realtype)
-            if not isinstance(realtype, type) and not is_generic_type(realtype):
-                raise BadParamError(param=realname, message='Unsupported type %s' % realtype)
+            return _SKIP  # 不赋值&不报错
+
+    return _1_fetch_input
+
+
+@lru_cache(maxsize=None)
+def compile_binding(fn: Callable) -> Callable[[Context], Tuple[List, Dict[str, Any]]]:
+    """
+    只在第一次调用时inspect dealer的签名，返回 ctx -> (args, kwargs) 的注入函数
+    """
+    steps = [(realname, positional_only, compile_param(realname, realtype, has_default, positional_only))
+             for realname, (realtype, has_default, positional_only) in func_arg_spec(fn).items()]
+
+    def _1_bind(ctx: Context) -> Tuple[List, Dict[str, Any]]:
+        args: List = []
+        kwargs: Dict[str, Any] = {}
+        for realname, positional_only, fetch in steps:
+            value = fetch(ctx)
+            if value is _SKIP:
+                continue
+            # 将value追加到args或kwargs
             if positional_only:
-                value = fetch_model(ctx, realtype)
+                args.append(value)
             else:
-                queryname = ctx.request._aliases.get(realname, realname)
-                inputval = ctx.request.get_input(queryname)
-                if inputval is not None:
-                    try:
-                        value = request_bridge(inputval, realtype)
-                    except Exception as e:
-                        raise BadParamError(param=realname, message=str(e))
-                elif not has_default:
-                    raise BadParamError(param=realname, message='Missing required param')
-                else:
-                    continue  # 不赋值&不报错
-        # 将value追加到args或kwargs
-        if positional_only:
-            args.append(value)
-        else:
-            kwargs[realname] = value
+                kwargs[realname] = value
+        return args, kwargs
 
-    return args, kwargs
+    return _1_bind
+
+
+def fetch_param(ctx: Context, fn: Callable) -> Tuple[List, Dict[str, Any]]:
+    """
+    fn: dealer function
+    return: Dict[realname, Context|Request|Response|Model|...]
+    """
+    try:
+        bind = compile_binding(fn)
+    except TypeError:  # unhashable的callable无法缓存
+        bind = compile_binding.__wrapped__(fn)
+    return bind(ctx)
@@ -0,0 +1,117 @@
+"""
+aiohttp_wsgi的WSGIHandler把整个响应拼接后才发送。
+StreamingWSGIHandler在线程池中逐块迭代响应：响应较小时与WSGIHandler相同，超过STREAM_BUFFER_SIZE时改用chunked编码边生成边发送。
+StaticHandler发送静态文件，可压缩的文件使用内存中的压缩结果
+(from lessweb)
+"""
+from typing import List, Optional, Tuple
+import asyncio
+import mimetypes
+
+from aiohttp.web import Request, Response, StreamResponse, FileResponse, HTTPRequestEntityTooLarge, HTTPNotFound, \
+    HTTPNotModified
+from aiohttp.web_response import CIMultiDict
+from aiohttp_wsgi import WSGIHandler  # type: ignore
+from .compression import StaticVariants, negotiate
+
+
+__all__ = ["StreamingWSGIHandler", "StaticHandler"]
+
+
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+class StreamingWSGIHandler(WSGIHandler):
+    async def handle_request(self, request: Request) -> StreamResponse:
+        if request.content_length is not None and request.content_length > self._max_request_body_size:
+            raise HTTPRequestEntityTooLarge(max_size=self._max_request_body_size,
+                                            actual_size=request.content_length)
+        content_length = 0
+        with self._body_io() as body:
+            while True:
+                block = await request.content.readany()
+                if not block:
+                    break
+                content_length += len(block)
+                if content_length > self._max_request_body_size:
+                    raise HTTPRequestEntityTooLarge(max_size=self._max_request_body_size,
+                                                    actual_size=content_length)
+                body.write(block)
+            body.seek(0)
+            environ = self._get_environ(request, body, content_length)
+            return await self._respond(request, environ)
+
+    __call__ = handle_request
+
+    async def _respond(self, request: Request, environ) -> StreamResponse:
+        loop = asyncio.get_event_loop()
+        started: List[Tuple[str, list]] = []
+        buffered: List[bytes] = []
+
+        def start_response(status: str, headers: list, exc_info=None):
+            started[:] = [(status, headers)]
+            return buffered.append
+
+        body_iterable = await loop.run_in_executor(self._executor, self._application, environ, start_response)
+        iterator = iter(body_iterable)
+        try:
+            size = 0
+            finished = False
+            while size < STREAM_BUFFER_SIZE:  # 先在内存中缓冲，响应较小时一次发送
+                chunk: Optional[bytes] = await loop.run_in_executor(self._executor, next, iterator, None)
+                if chunk is None:
+                    finished = True
+                    break
+                buffered.append(chunk)
+                size += len(chunk)
+            assert started, "application did not call start_response()"
+            status, headers = started[0]
+            status_code, reason = status.split(None, 1)
+            if finished:
+                return Response(status=int(status_code), reason=reason, headers=CIMultiDict(headers),
+                                body=b''.join(buffered))
+            response = StreamResponse(status=int(status_code), reason=reason, headers=CIMultiDict(headers))
+            response.enable_chunked_encoding()
+            await response.prepare(request)
+            await response.write(b''.join(buffered))
+            buffered.clear()
+            while True:
+                chunk = await loop.run_in_executor(self._executor, next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await response.write(chunk)
+            await response.write_eof()
+            return response
+        finally:
+            if hasattr(body_iterable, 'close'):
+                body_iterable.close()
+
+
+class StaticHandler:
+    """
+    代替router.add_static，路由中的{filename}为静态目录中的相对路径。
+    可压缩的文件按Accept-Encoding发送StaticVariants中的压缩结果，不在静态目录中生成.gz/.br文件；其余的交给FileResponse
+    """
+    def __init__(self, variants: StaticVariants):
+        self.variants = variants
+
+    async def __call__(self, request: Request) -> StreamResponse:
+        root = self.variants.root
+        try:
+            path = root.joinpath(request.match_info['filename']).resolve()
+        except (ValueError, OSError):
+            raise HTTPNotFound()
+        if root not in path.parents or not path.is_file():
+            raise HTTPNotFound()
+        coding = negotiate(request.headers.get('Accept-Encoding'))
+        data = self.variants.get(path, coding)
+        if data is None:
+            return FileResponse(path)
+        mtime = int(path.stat().st_mtime)
+        if request.if_modified_since is not None and request.if_modified_since.timestamp() >= mtime:
+            raise HTTPNotModified()
+        response = Response(body=data, content_type=mimetypes.guess_type(path.name)[0] or 'application/octet-stream',
+                            headers={'Content-Encoding': coding, 'Vary': 'Accept-Encoding'})
+        response.last_modified = mtime
+        return response
@@ -3,13 +3,15 @@ import cgi
 from io import BytesIO
 from http.cookies import Morsel, SimpleCookie, CookieError
 from urllib.parse import parse_qs, unquote
+from email.utils import formatdate, parsedate_to_datetime
 from enum import Enum
 from typing import NamedTuple
 from .bridge import ParamStr, MultipartFile
 
 
 __all__ = ["mimetypes", "hop_by_hop_headers", "http_methods", "ParamInput", "ResponseStatus", "HttpStatus",
-           "Cookie", "parse_cookie", "BadParamError", "NotFoundError"]
+           "Cookie", "parse_cookie", "BadParamError", "NotFoundError", "ResourceVersion", "http_date",
+           "parse_http_date", "etag_matches"]
 
 
 mimetypes = {
@@ -149,6 +151,53 @@ def parse_cookie(http_cookie: str)->Dict[str, str]:
     return cookies
 
 
+class ResourceVersion(NamedTuple):
+    """
+    由Application.version_provider按请求给出，用于生成ETag和Last-Modified
+    """
+    tag: str  # 数据的版本，作为ETag的前缀
+    last_modified: Optional[float]  # 时间戳，None表示不发送Last-Modified
+    fixed: bool  # True表示响应只由path、query和tag决定，条件请求命中时不再执行dealer
+
+
+def http_date(timestamp: float) -> str:
+    """
+    >>> http_date(0)
+    'Thu, 01 Jan 1970 00:00:00 GMT'
+    """
+    return formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value: Optional[str]) -> Optional[int]:
+    """
+    >>> parse_http_date('Thu, 01 Jan 1970 00:00:10 GMT')
+    10
+    """
+    if not value:
+        return None
+    try:
+        return int(parsedate_to_datetime(value).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    If-None-Match使用弱比较，W/前缀不影响结果
+
+    >>> etag_matches('W/"a", "b"', '"a"')
+    True
+    """
+    if if_none_match.strip() == '*':
+        return True
+    etag = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith('W/') else candidate) == etag:
+            return True
+    return False
+
+
 class BadParamError(Exception):
     def __init__(self, message: str, param: str=''):
         self.param: str = param
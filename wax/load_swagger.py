@@ -1,23 +1,95 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional, NamedTuple, FrozenSet, Tuple
 import json
-import jsonschema
 import itertools
 import datetime
+import time
 from pathlib import Path
 from wax.load_config import config
-from wax.pack_util import packed, dir_mtime
+from wax.pack_util import SpecPacker, PackError
+from wax.watch_util import SpecWatcher
+from wax.bundle_util import spec_digest, bundle_path, dump_bundle, load_bundle
 from wax.jsonschema_util import jsonschema_to_rows
+from wax.route_util import RouteTable
+from wax.param_util import OperationParams, build_param_index
+from wax.example_util import ExampleIndex
+from wax.tag_util import TagTree, OpIndex, build_tag_tree
+from wax.validator_util import ValidatorCache, VALIDATOR_BACKENDS, spec_validators
+from wax.check_util import parse_policy
+from wax.lessweb.codec import make_codec
+
+
+class SpecSnapshot(NamedTuple):
+    """
+    某一代swagger及其派生的全部索引。创建后不再修改，重新加载时整体替换
+    """
+    generation: int
+    loaded_at: float
+    swagger_data: Dict
+    resolver: Any
+    validators: ValidatorCache  # 预编译的jsonschema validator，与resolver一样不进入预编译包
+    routes: RouteTable
+    param_index: Dict[str, OperationParams]  # {operationId: 合并了endpoint参数的解码规则}
+    example_index: ExampleIndex
+    tag_tree: TagTree
+    op_index: OpIndex
+    changed_ops: Optional[FrozenSet[str]]  # 相对上一代有变化的operationId，None表示全部
+
+
+def build_snapshot(swagger_data: Dict, generation: int, changed_ops: Optional[FrozenSet[str]]=None) -> SpecSnapshot:
+    tag_tree, op_index = build_tag_tree(swagger_data)
+    validators = spec_validators(swagger_data, config.get('validator', 'jsonschema'))
+    return SpecSnapshot(
+        generation=generation,
+        loaded_at=time.time(),
+        swagger_data=swagger_data,
+        resolver=validators.resolver,
+        validators=validators,
+        routes=RouteTable(swagger_data['paths']),
+        param_index=build_param_index(swagger_data),
+        example_index=ExampleIndex(swagger_data),
+        tag_tree=tag_tree,
+        op_index=op_index,
+        changed_ops=changed_ops,
+    )
+
+
+def bundle_snapshot(snapshot: SpecSnapshot) -> Tuple[SpecSnapshot, Dict[str, Any]]:
+    """
+    resolver和validator无法序列化：预编译包中保存去掉它们的snapshot和已解析的$ref
+    :return (snapshot, refs)
+    """
+    return snapshot._replace(resolver=None, validators=None), snapshot.resolver.resolve_local_refs()
+
+
+def restore_snapshot(snapshot: SpecSnapshot, refs: Dict[str, Any]) -> SpecSnapshot:
+    """
+    用预编译包中的$ref重建resolver，validator仍在第一次用到时创建
+    """
+    validators = spec_validators(snapshot.swagger_data, config.get('validator', 'jsonschema'), refs)
+    # loaded_at用作Last-Modified，必须晚于之前进程可能发出的时间
+    return snapshot._replace(loaded_at=time.time(), resolver=validators.resolver, validators=validators)
+
+
+def report_pql_errors(snapshot: SpecSnapshot) -> None:
+    """
+    重新加载时只输出有变化的operation中的错误
+    """
+    for (op_id, status_code, content_type, example_name), errors in snapshot.example_index.pql_errors.items():
+        if snapshot.changed_ops is not None and op_id not in snapshot.changed_ops:
+            continue
+        for error in errors:
+            print(f'PQL error in {op_id} {status_code} {content_type} example "{example_name}": {error}')
 
 
 class SwaggerData:
     json_path = ''
     redis_prefix = 'waxapi::'
-    swagger_data: Dict = {}
-    resolver = None
-    last_modify = 0
+    snapshot: SpecSnapshot = build_snapshot({'paths': {}, 'components': {'schemas': {}}}, generation=0)
+    watcher: Optional[SpecWatcher] = None
+    packer: Optional[SpecPacker] = None
 
     @classmethod
-    def init(cls, json_path):
+    def check_config(cls, json_path):
         title, version = config['title'], config['version']
         if not title:
             print('Title cannot be empty, please edit config.json!')
@@ -25,24 +97,93 @@ class SwaggerData:
         if not version:
             print('Version cannot be empty, please edit config.json!')
             exit(1)
+        if config.get('validator', 'jsonschema') not in VALIDATOR_BACKENDS:
+            print('validator must be one of %s, please edit config.json!' % '|'.join(VALIDATOR_BACKENDS))
+            exit(1)
+        try:
+            parse_policy(config.get('response-check', 'full'))
+            make_codec(config.get('json-codec', 'auto'))
+        except ValueError as e:
+            print('%s, please edit config.json!' % e)
+            exit(1)
         if not Path(json_path).is_dir():
             print(f'{json_path} is not exist or is not directory!')
+        return title, version
+
+    @classmethod
+    def init(cls, json_path, jobs: int=1):
+        title, version = cls.check_config(json_path)
         cls.json_path = json_path
-        cls.last_modify = dir_mtime(json_path)
-        cls.swagger_data = packed(json_path, title, version)
-        cls.resolver = jsonschema.RefResolver.from_schema(cls.swagger_data)
+        bundle = load_bundle(bundle_path(spec_digest(json_path, title, version)))
+        if bundle:
+            snapshot, cls.packer, refs = bundle
+            cls.snapshot = restore_snapshot(snapshot, refs)
+            print('Loaded compiled bundle.')
+        else:
+            cls.packer = SpecPacker(json_path, title, version)
+            try:
+                swagger_data, _ = cls.packer.pack(jobs)
+                cls.snapshot = build_snapshot(swagger_data, generation=1)
+            except PackError as e:
+                print(e)
+                exit(1)
+        report_pql_errors(cls.snapshot)
         cls.redis_prefix = 'waxapi::' + title + '::' + version + '::'
+        cls.watcher = SpecWatcher(json_path, on_change=cls.reload)
+        cls.watcher.start()
+
+    @classmethod
+    def compile(cls, json_path, jobs: int=1) -> Path:
+        """
+        生成预编译包，wax run时如果json目录的内容没有变化则直接加载
+        """
+        title, version = cls.check_config(json_path)
+        digest = spec_digest(json_path, title, version)
+        packer = SpecPacker(json_path, title, version)
+        try:
+            swagger_data, _ = packer.pack(jobs)
+        except PackError as e:
+            print(e)
+            exit(1)
+        snapshot = build_snapshot(swagger_data, generation=1)
+        report_pql_errors(snapshot)
+        path = bundle_path(digest)
+        bundled, refs = bundle_snapshot(snapshot)
+        dump_bundle(path, bundled, packer, refs)
+        return path
+
+    @classmethod
+    def reload(cls, changed_paths=()):
+        """
+        在watcher线程中生成新的snapshot，期间请求继续使用旧的snapshot；解析失败时保留旧的snapshot
+        """
+        generation = cls.snapshot.generation
+        try:
+            swagger_data, changed_ops = cls.packer.pack()
+            if changed_ops is not None and not changed_ops and swagger_data is cls.snapshot.swagger_data:
+                return  # 文件被touch但内容没有变化
+            snapshot = build_snapshot(swagger_data, generation=generation + 1,
+                                      changed_ops=None if changed_ops is None else frozenset(changed_ops))
+        except Exception as e:
+            print(e)
+            print('Keep serving generation %d.' % generation)
+            return
+        cls.snapshot = snapshot  # 单次引用替换，请求线程看到的要么是旧的要么是新的
+        report_pql_errors(snapshot)
+        print('Reloaded at %s (%s operations changed).' % (
+            datetime.datetime.fromtimestamp(int(snapshot.loaded_at)),
+            'all' if changed_ops is None else len(changed_ops)))
+
+    @classmethod
+    def current(cls) -> SpecSnapshot:
+        """
+        一次请求应只调用一次，之后都使用同一个snapshot
+        """
+        return cls.snapshot
 
     @classmethod
     def get(cls) -> Dict:
-        last_modify = dir_mtime(cls.json_path)
-        if last_modify != cls.last_modify:
-            title, version = config['title'], config['version']
-            cls.swagger_data = packed(cls.json_path, title, version)
-            cls.resolver = jsonschema.RefResolver.from_schema(cls.swagger_data)
-            cls.last_modify = last_modify
-            print('Reloaded at %s.' % datetime.datetime.fromtimestamp(int(last_modify)))
-        return cls.swagger_data
+        return cls.snapshot.swagger_data
 
 
 def parse_operation(swagger_data, endpoint:Dict, method:str) -> Dict:
@@ -34,12 +34,45 @@ def print_help():
     help_text = """wax-mock: 使用OpenAPI3 JSON文件创建mock server
 Usage:
     wax run [json目录]      启动mock server
+        --jobs N              启动时用N个进程并行解析json/yaml
+    wax compile [json目录]  生成预编译包(.wax目录)，json目录没有变化时wax run直接加载
     wax -v                    查看当前版本
     
     """
     print(help_text)
 
 
+def pop_option(argv, name, default):
+    """
+    从argv中取出"name value"形式的选项
+    """
+    if name not in argv:
+        return default
+    i = argv.index(name)
+    if i + 1 >= len(argv):
+        print(f'{name}缺少参数值')
+        exit(1)
+    value = argv[i + 1]
+    del argv[i:i + 2]
+    return value
+
+
+def parse_spec_args():
+    """
+    wax run|compile [json目录] [--jobs N]
+    :return (json_path, jobs)
+    """
+    argv = sys.argv[2:]
+    jobs = pop_option(argv, '--jobs', '1')
+    if not jobs.isdigit() or int(jobs) < 1:
+        print('--jobs必须是正整数')
+        exit(1)
+    if not argv:
+        print_help()
+        exit(0)
+    return argv[0], int(jobs)
+
+
 def entrypoint():
     if not sys.version_info[:3] >= (3, 6, 0):
         print('wax-mock已不支持低版本python，请安装python3.6.0+')
@@ -50,14 +83,22 @@ def entrypoint():
     if sys.argv[1] == '-v':
         print_version()
         exit(0)
-    if len(sys.argv) <= 2 or sys.argv[1] not in ['run', 'pack', 'unpack']:
+    if len(sys.argv) <= 2 or sys.argv[1] not in ['run', 'compile', 'pack', 'unpack']:
         print_help()
         exit(0)
+    if sys.argv[1] == 'compile':
+        if not Path('config.json').exists():
+            print('config.json不存在，请先执行wax run')
+            exit(1)
+        from wax.load_swagger import SwaggerData
+        json_path, jobs = parse_spec_args()
+        print('Compiled to %s' % SwaggerData.compile(json_path=json_path, jobs=jobs))
     if sys.argv[1] == 'run':
         if Path('config.json').exists():
             from wax.load_swagger import SwaggerData
             from wax.load_config import config
-            SwaggerData.init(json_path=sys.argv[2])
+            json_path, jobs = parse_spec_args()
+            SwaggerData.init(json_path=json_path, jobs=jobs)
             from wax.index import app
             app.run(port=config['port'], staticpath='wax-www/static')
         else:
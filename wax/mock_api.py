@@ -1,17 +1,39 @@
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional, Iterator
+from itertools import chain, islice
 import json
-import jsonschema
+import hashlib
 import base64
-import re
-from wax.lessweb import Request, Response, BadParamError
-from wax.lessweb.utils import re_standardize, eafp
-from wax.lessweb.webapi import http_methods, NotFoundError, HttpStatus
+from wax.lessweb import Context, Request, Response, BadParamError
+from wax.lessweb.utils import eafp
+from wax.lessweb.webapi import NotFoundError, HttpStatus
 from wax.load_config import config
-from wax.load_swagger import SwaggerData
+from wax.load_swagger import SwaggerData, SpecSnapshot
+from wax.route_util import Route
+from wax.param_util import OperationParams
+from wax.example_util import ExampleHit, ExampleKey, StaticBody
+from wax.validator_util import ValidatorKey
+from wax.check_util import CheckPolicy, parse_policy, sampled, deferred_checker
 from wax.load_func import eval_func, default_func, is_evalable, deep_eval
 from wax.service import StateServ
 from wax.jsonschema_util import jsonschema_to_json
-from wax.pql import apply_schema, PqlRuntimeError
+from wax.pql import compile_schema, profile_schema, PqlRuntimeError
+
+
+STREAM_MIN_ROWS = 1000  # 不少于此行数的数组响应分块编码发送，不再拼接成一个完整的字符串
+
+
+def json_or_stream(ctx: Context, resp_obj):
+    """
+    :param resp_obj: 可以是PqlPlan.stream()返回的迭代器，先取STREAM_MIN_ROWS行，不足时仍按数组返回
+    """
+    if isinstance(resp_obj, Iterator):
+        head = list(islice(resp_obj, STREAM_MIN_ROWS))
+        if len(head) < STREAM_MIN_ROWS:
+            return head
+        return ctx.app.stream_json_array(ctx, chain(head, resp_obj))
+    if isinstance(resp_obj, list) and len(resp_obj) >= STREAM_MIN_ROWS:
+        return ctx.app.stream_json_array(ctx, resp_obj)
+    return resp_obj
 
 
 def base64ed(buf: bytes) -> str:
@@ -41,100 +63,66 @@ def opt_number(n):
             return n
 
 
-def validate(instance, *, schema) -> str:
-    try:
-        jsonschema.validate(instance=instance, schema=schema, resolver=SwaggerData.resolver, format_checker=jsonschema.draft7_format_checker)
-        return ''
-    except jsonschema.ValidationError as e:
-        return str(e)
+def validate(instance, *, schema, snapshot: SpecSnapshot, key: Optional[ValidatorKey]=None) -> str:
+    """
+    :param key: schema在swagger中的位置，用来复用snapshot中预编译的validator
+    """
+    return snapshot.validators.validate(instance, key=key, schema=schema)
 
 
 class InternalError(Exception):
     pass
 
 
-def hit_endpoint(realpath: str) -> Tuple[Dict, Dict]:
+def hit_endpoint(realpath: str, snapshot: SpecSnapshot) -> Tuple[Route, Dict]:
     """
-    :return (endpoint, url_params)
+    :return (route, url_params)
     """
     path = realpath[len(config['mockapi-prefix']):]
-    swagger_data = SwaggerData.get()
-    for endpoint_path, endpoint in swagger_data['paths'].items():
-        if endpoint_path == path:
-            return endpoint, {}
-    for endpoint_path, endpoint in swagger_data['paths'].items():
-        search_ret = re.compile(re_standardize(endpoint_path)).search(path)
-        if search_ret:
-            return endpoint, search_ret.groupdict()
-    raise NotFoundError(methods=[])
-
-
-def hit_operation(endpoint: Dict, method: str) -> Dict:
-    supported_methods = []
-    for op_method, operation in endpoint.items():
-        op_method = op_method.upper()
-        if op_method not in http_methods:
-            continue
-        supported_methods.append(op_method)
-        if op_method == method.upper():
-            return operation
-    raise NotFoundError(methods=supported_methods)
+    route, url_params = snapshot.routes.match(path)
+    if route is None:
+        raise NotFoundError(methods=[])
+    return route, url_params
 
 
-def check_param_str(param_name, *, param_value, schema) -> None:
-    """
-    检查通过则return，不通过则返回BadParamError
-    """
-    error_message = validate(param_value, schema=schema)
-    if error_message:
-        param_value = opt_number(param_value)
-        if validate(param_value, schema=schema):
-            raise BadParamError(param=param_name, message=error_message)
+def hit_operation(route: Route, method: str) -> Dict:
+    operation = route.operations.get(method.upper())
+    if operation is None and method.upper() == 'HEAD':  # 没有定义HEAD时按GET处理，lessweb不发送body
+        operation = route.operations.get('GET')
+    if operation is None:
+        raise NotFoundError(methods=list(route.operations))
+    return operation
 
 
-def param_check(params: List[Dict], request: Request, url_params: Dict) -> None:
+def param_check(specs: OperationParams, request: Request, url_params: Dict, snapshot: SpecSnapshot,
+                operation_id: str) -> Dict[str, Dict]:
     """
-    检查通过则return，不通过则返回BadParamError
+    检查通过则返回解码后的参数{'path': {...}, 'query': {...}, 'header': {...}, 'cookie': {...}}，不通过则返回BadParamError
     """
-    for param_dict in params:
-        param_name = param_dict['name']
-        param_in = param_dict.get('in', 'query')
-        param_required = param_dict.get('required', False)
-        if param_in == 'header':
-            if not request.contains_header(param_name):
-                if param_required:
-                    raise BadParamError(param=param_name, message='header param is required')
-                else:
-                    continue
-            param_value = request.get_header(param_name)
-        elif param_in == 'cookie':
-            if not request.contains_cookie(param_name):
-                if param_required:
-                    raise BadParamError(param=param_name, message='cookie param is required')
-                else:
-                    continue
-            param_value = request.get_cookie(param_name)
-        elif param_in == 'path':
-            if param_name not in url_params:
-                if param_required:
-                    raise BadParamError(param=param_name, message='path param is required')
-                else:
-                    continue
-            param_value = url_params[param_name]
-        else:
-            query_params = request.param_input.query_input
-            if param_name not in query_params:
-                if param_required:
-                    raise BadParamError(param=param_name, message='query param is required')
-                else:
-                    continue
-            param_value = query_params[param_name][0]
-        if not param_dict.get('allowEmptyValue', True) and not param_value:
-            raise BadParamError(param=param_name, message='allowEmptyValue is true but param is empty')
-        check_param_str(param_name, param_value=param_value, schema=param_dict['schema'])
-
-
-def body_check(operation: Dict, request: Request) -> None:
+    decoded: Dict[str, Dict] = {'path': {}, 'query': {}, 'header': {}, 'cookie': {}}
+    for spec in specs:
+        raw = spec.fetch(request, url_params)
+        if raw is None:
+            if spec.required:
+                raise BadParamError(param=spec.name, message=f'{spec.location} param is required')
+            continue
+        if not spec.allow_empty and not spec.first(raw):
+            raise BadParamError(param=spec.name, message='allowEmptyValue is true but param is empty')
+        value = spec.decode(raw)
+        key = (operation_id, f'param:{spec.location}:{spec.name}')
+        error_message = validate(value, schema=spec.schema, snapshot=snapshot, key=key)
+        if error_message and not spec.kind and isinstance(value, str):
+            # schema没有单一的type(例如enum、oneOf、type列表)时无法预先转换，与之前一样按数字再校验一次
+            number = opt_number(value)
+            if number is not value and not validate(number, schema=spec.schema, snapshot=snapshot, key=key):
+                value, error_message = number, ''
+        if error_message:
+            raise BadParamError(param=spec.name, message=error_message)
+        decoded.setdefault(spec.location, {})[spec.name] = value
+    return decoded
+
+
+def body_check(operation: Dict, request: Request, snapshot: SpecSnapshot) -> None:
     """
     检查通过则return，不通过则返回BadParamError
     """
@@ -143,19 +131,21 @@ def body_check(operation: Dict, request: Request) -> None:
     for content_key, content_val in content_dict.items():
         if content_key.lower() in real_content_type:
             schema = content_val['schema']
+            key = (operation['operationId'], f'body:{content_key}')
             if request.is_json():
-                error_message = validate(request.json_input, schema=schema)
+                error_message = validate(request.json_input, schema=schema, snapshot=snapshot, key=key)
             elif request.is_form():
-                form_dict = {key: val[0] for key, val in request.param_input.form_input.items()}
-                for key, val in request.file_input.items():
-                    form_dict = base64ed(val[0].value)
-                error_message = validate(form_dict, schema=schema)
+                # 字段名不能用key，key是validator的缓存key
+                form_dict = {name: val[0] for name, val in request.param_input.form_input.items()}
+                for name, val in request.file_input.items():
+                    form_dict[name] = base64ed(val[0].value)
+                error_message = validate(form_dict, schema=schema, snapshot=snapshot, key=key)
                 if not error_message:
                     return
                 error_message = validate(
-                    {key: opt_number(val) for key, val in form_dict.items()}, schema=schema)
+                    {name: opt_number(val) for name, val in form_dict.items()}, schema=schema, snapshot=snapshot, key=key)
             else:
-                error_message = validate(base64ed(request.body_data or b''), schema=schema)
+                error_message = validate(base64ed(request.body_data or b''), schema=schema, snapshot=snapshot, key=key)
             if error_message:
                 raise BadParamError(message=error_message, param='requestBody')
             else:
@@ -163,30 +153,14 @@ def body_check(operation: Dict, request: Request) -> None:
     raise BadParamError(message='unsupported request content-type', param=real_content_type)
 
 
-def hit_example(operation: Dict, state) -> Tuple[int, Dict, str]:
+def hit_example(operation: Dict, state, snapshot: SpecSnapshot) -> ExampleHit:
     """
-    :return (status_code, schema, example_json)
+    按state.basic选择status_code、content_type和example
     """
-    state_basic = state.basic.get()
-    if state_basic:
-        state_status_code, state_content_type, state_example_name = state_basic.split(':', 2)
-    else:
-        state_status_code = state_content_type = state_example_name = ''
-    if not operation.get('responses'):
-        raise InternalError('responses is empty')
-    for status_code, response_val in operation['responses'].items():
-        if not state_status_code or state_status_code == status_code:
-            for content_key, content_val in response_val['content'].items():
-                if not state_content_type or state_content_type == content_key:
-                    for example_name, example_val in content_val.get('examples', {}).items():
-                        if not state_example_name or state_example_name == example_name:
-                            return int(status_code), content_val['schema'], json.dumps(example_val['value'])
-                    else:
-                        return int(status_code), content_val['schema'], ''
-            else:
-                raise InternalError('response fail to match content-type')
-    else:
-        raise InternalError('response fail to match status_code')
+    hit, error_message = snapshot.example_index.hit(operation['operationId'], state.basic.get())
+    if hit is None:
+        raise InternalError(error_message)
+    return hit
 
 
 def rotate_fetch(arr: List):
@@ -279,11 +253,11 @@ def chain_filter(func_chain: List[str], resp_obj, request, response, state):
     return resp_obj
 
 
-def response_check(schema, resp_obj) -> None:
+def response_check(schema, resp_obj, snapshot: SpecSnapshot, key: Optional[ValidatorKey]=None) -> None:
     """
     检查通过则return，不通过则返回InternalError
     """
-    error_message = validate(resp_obj, schema=schema)
+    error_message = validate(resp_obj, schema=schema, snapshot=snapshot, key=key)
     if error_message:
         error_message += '\n\n-----------------\nresponse:\n'
         try:
@@ -293,31 +267,93 @@ def response_check(schema, resp_obj) -> None:
         raise InternalError(error_message)
 
 
-def mock_dealer(request: Request, response: Response, state: StateServ):
+def response_policy(operation: Dict) -> CheckPolicy:
+    try:
+        return parse_policy(operation.get('x-response-check') or config.get('response-check', 'full'))
+    except ValueError as e:
+        raise InternalError(str(e))
+
+
+def skips_response_check(operation: Dict) -> bool:
+    """
+    响应不做校验时结果可以边生成边发送；response-check不合法时由policy_response_check报错
+    """
+    try:
+        return response_policy(operation).mode == 'off'
+    except InternalError:
+        return False
+
+
+def policy_response_check(operation: Dict, status_code: int, content_type: str, schema, resp_obj,
+                          snapshot: SpecSnapshot) -> None:
+    """
+    按x-response-check或config.json中的response-check决定校验方式，不通过时返回InternalError(deferred除外)
+    """
+    policy = response_policy(operation)
+    key = (operation['operationId'], f'response:{status_code}:{content_type}')
+    if policy.mode == 'off' or (policy.mode == 'sampled' and not sampled(key, policy.sample)):
+        return
+    if policy.mode == 'deferred':  # resp_obj返回后不再被修改，可以在后台线程中读取
+        deferred_checker.submit(key, lambda: response_check(schema, resp_obj, snapshot, key))
+        return
+    response_check(schema, resp_obj, snapshot, key)
+
+
+def cache_static_body(ctx: Context, example_key: ExampleKey, operation: Dict, content_type: str, schema, resp_obj,
+                      snapshot: SpecSnapshot) -> Optional[StaticBody]:
+    """
+    静态example每次的结果都相同，校验通过后缓存编码后的响应；校验不通过时不缓存，每次按原流程处理
+    """
+    if not isinstance(resp_obj, (dict, list)):
+        return None
+    if response_policy(operation).mode != 'off' and validate(
+            resp_obj, schema=schema, snapshot=snapshot,
+            key=(operation['operationId'], f'response:{example_key[1]}:{content_type}')):
+        return None
+    body = ctx.app.dump_json(resp_obj)
+    static_body = StaticBody(body, '"g%d-%s"' % (snapshot.generation, hashlib.sha1(body).hexdigest()))
+    return snapshot.example_index.bodies.setdefault(example_key, static_body)
+
+
+def send_static_body(response: Response, status_code: int, static_body: StaticBody) -> bytes:
+    if status_code != 200:
+        response.set_status(HttpStatus.of(status_code))
+    response.send_content_type(mimekey='json', encoding=response.encoding)
+    response.set_header('ETag', static_body.etag)
+    return static_body.body
+
+
+def mock_dealer(ctx: Context, request: Request, response: Response, state: StateServ):
+    """
+    HEAD按GET处理：静态example的响应在第一次请求后缓存，之后的HEAD直接用缓存的ETag，不执行pql；
+    动态example的ETag和状态码取决于pql的结果，HEAD仍然完整执行一次，只是lessweb不发送body
+    """
+    snapshot = SwaggerData.current()
     try:
-        endpoint, url_params = hit_endpoint(request.path)
+        route, url_params = hit_endpoint(request.path, snapshot=snapshot)
         request.param_input.url_input.update(url_params)
-        if 'parameters' in endpoint:
-            param_check(endpoint['parameters'], request=request, url_params=url_params)
-        operation = hit_operation(endpoint, method=request.method)
-        params = operation.get('parameters', [])
-        param_check(params, request=request, url_params=url_params)
+        operation = hit_operation(route, method=request.method)
+        params = param_check(snapshot.param_index.get(operation['operationId'], ()), request=request,
+                             url_params=url_params, snapshot=snapshot, operation_id=operation['operationId'])
         if operation.get('requestBody'):
-            body_check(operation, request=request)
+            body_check(operation, request=request, snapshot=snapshot)
         state.operation_id = operation['operationId']
-        status_code, schema, example_json = hit_example(operation, state=state)
-        if example_json == '':  # 没有example时产生默认的json
+        status_code, content_type, schema, example_key = hit_example(operation, state=state, snapshot=snapshot)
+        if example_key is None:  # 没有example时产生默认的json
             if status_code != 200:
                 response.set_status(HttpStatus.of(status_code))
-            return jsonschema_to_json('$', schema, SwaggerData.get())
-        example = json.loads(example_json)
+            return jsonschema_to_json('$', schema, snapshot.swagger_data)
+        static_body = snapshot.example_index.bodies.get(example_key)
+        if static_body is not None:  # 静态example，不需要pql和校验
+            return send_static_body(response, status_code, static_body)
+        plan = snapshot.example_index.plans[example_key]  # 加载时编译，所有请求共享
         # 准备pql的上下文环境
         if request.is_json():
             req_body = request.json_input
         elif request.is_form():
             req_body = {}
             try:
-                property_dict = operation['requestBody']['content'].popitem()[-1]['schema']['properties']
+                property_dict = list(operation['requestBody']['content'].values())[-1]['schema']['properties']
                 for param_name, param_prop in property_dict.items():
                     if param_name in request.param_input.form_input:
                         req_body[param_name] = cast_param(request.param_input.form_input[param_name], param_prop.get('type', ''))
@@ -325,51 +361,54 @@ def mock_dealer(request: Request, response: Response, state: StateServ):
                 pass
         else:
             req_body = request.body_data
-        req_query, req_path, req_header = {}, {}, {}
-        for param in endpoint.get('parameters', []) + params:
-            param_name = param.get('name')
-            if not param_name:
-                continue
-            param_type = eafp(lambda: param['schema']['type'], '')
-            if param.get('in') == 'path':
-                if param_name in request.param_input.url_input:
-                    req_path[param_name] = cast_param([request.param_input.url_input[param_name]], param_type)
-            elif param.get('in') == 'header':
-                header_value = request.get_header(param_name)
-                if header_value is not None:
-                    req_header[param_name] = cast_param([header_value], param_type)
-            else:
-                if param_name in request.param_input.query_input:
-                    req_query[param_name] = cast_param(request.param_input.query_input[param_name], param_type)
         env = {
             'body': req_body,
-            'query': req_query,
-            'path': req_path,
-            'header': req_header,
+            'query': params['query'],
+            'path': params['path'],
+            'header': params['header'],
         }
-        resp_obj = apply_schema(env, dict_schema=example)
-        response_check(schema=schema, resp_obj=resp_obj)
+        # 静态example要缓存完整的body，响应要校验时需要完整的结果，都不能逐行生成
+        rows = plan.stream(env) if example_key not in snapshot.example_index.static_keys \
+            and skips_response_check(operation) else None
+        resp_obj = plan.run(env) if rows is None else rows
+        if example_key in snapshot.example_index.static_keys:
+            static_body = cache_static_body(ctx, example_key, operation, content_type, schema, resp_obj, snapshot)
+            if static_body is not None:
+                return send_static_body(response, status_code, static_body)
+        policy_response_check(operation, status_code, content_type, schema, resp_obj, snapshot)
         if status_code != 200:
             response.set_status(HttpStatus.of(status_code))
-        return resp_obj
+        return json_or_stream(ctx, resp_obj)
     except (InternalError, PqlRuntimeError) as e:
         response.send_content_type(mimekey='txt', encoding='utf-8')
         response.set_status(HttpStatus.InternalServerError)
         return str(e)
 
 
-def pql_playground(query: dict, path: dict, header: dict, body: dict, schema: dict):
+def pql_playground(ctx: Context, query: dict, path: dict, header: dict, body: dict, schema: dict,
+                   explain: bool=False, profile: bool=False):
+    """
+    :param explain: 只返回编译后的plan树，不执行
+    :param profile: 执行并返回{'result': ..., 'profile': 每个schema节点各阶段的行数、lambda执行次数、耗时}
+    """
     env = {
         "query": query,
         "path": path,
         "header": header,
         "body": body,
     }
+    if explain:
+        return {'plan': compile_schema(schema).explain()}
+    if profile:
+        resp_obj, pql_profile = profile_schema(env, schema)
+        return {'result': resp_obj, 'profile': pql_profile}
     try:
-        resp_obj = apply_schema(env, dict_schema=schema)
+        plan = compile_schema(schema)
+        rows = plan.stream(env)
+        resp_obj = plan.run(env) if rows is None else rows
     except Exception as e:
         resp_obj = {'error': str(e), 'type': type(e).__name__}
-    return resp_obj
+    return json_or_stream(ctx, resp_obj)
 
 
 def default_json(schema: dict):
@@ -379,9 +418,10 @@ def default_json(schema: dict):
 def check_entities(request: Request):
     schema = request.json_input['schema']
     entities = request.json_input['entities']
+    snapshot = SwaggerData.current()
     for entity in entities:
         try:
-            response_check(schema, resp_obj=entity)
+            response_check(schema, resp_obj=entity, snapshot=snapshot)
         except InternalError as e:
             return {'code': 1, 'message': str(e)}
     return {'code': 0}
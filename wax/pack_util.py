@@ -1,66 +1,290 @@
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import hashlib
 import yaml
 import json
 from wax.common_util import sorted_dict
 
 
+SPEC_SUFFIXES = ('.json', '.yaml')
+YamlLoader = getattr(yaml, 'CFullLoader', yaml.FullLoader)  # 有libyaml时使用C实现
+
+
+class PackError(Exception):
+    pass
+
+
 def glob_find(ref_path):
-    yield from Path(ref_path).glob('*.json')
-    yield from Path(ref_path).glob('*.yaml')
+    """
+    按文件名排序，保证合并结果与文件系统的遍历顺序无关
+    """
+    for suffix in SPEC_SUFFIXES:
+        yield from sorted(Path(ref_path).glob('*' + suffix))
 
 
 def dir_mtime(ref_path):
     return max(p.stat().st_mtime for p in glob_find(ref_path))
 
 
-def packed(ref_path, title, version):
+class SpecFile(NamedTuple):
     """
-    ref_path -> packed_swagger_data
+    单个json/yaml文件的解析缓存，(mtime, size)不变时不再读取，digest不变时不再解析
+    """
+    mtime: float
+    size: int
+    digest: str
+    paths: Dict[str, Dict]  # {path: sorted endpoint}
+    schemas: Dict[str, Dict]
+    path_refs: Dict[str, Set[str]]  # {path: 直接引用的schema名}
+    schema_refs: Dict[str, Set[str]]
+    base: Dict  # 除paths和components外的顶层字段
+    keys: Tuple[str, ...]  # 全部顶层字段的顺序，合并结果的key顺序与第一个文件相同
+
+
+def collect_refs(obj, refs: Set[str]) -> Set[str]:
+    if isinstance(obj, dict):
+        ref = obj.get('$ref')
+        if isinstance(ref, str) and ref.startswith('#/components/schemas/'):
+            refs.add(ref[len('#/components/schemas/'):])
+        for val in obj.values():
+            collect_refs(val, refs)
+    elif isinstance(obj, list):
+        for val in obj:
+            collect_refs(val, refs)
+    return refs
+
+
+def load_spec_file(p: Path, raw: bytes):
+    text = raw.decode('utf-8')
+    if p.suffix == '.yaml':
+        return yaml.load(text, Loader=YamlLoader)
+    else:
+        return json.loads(text)
+
+
+def make_spec_file(stat, digest: str, cur_api) -> SpecFile:
+    cur_api = cur_api or {}
+    paths = {key: val @ sorted_dict if isinstance(val, dict) else val
+             for key, val in cur_api.get('paths', {}).items()}
+    schemas = dict(cur_api.get('components', {}).get('schemas', {}))
+    return SpecFile(
+        mtime=stat.st_mtime,
+        size=stat.st_size,
+        digest=digest,
+        paths=paths,
+        schemas=schemas,
+        path_refs={key: collect_refs(val, set()) for key, val in paths.items()},
+        schema_refs={key: collect_refs(val, set()) for key, val in schemas.items()},
+        base={key: val for key, val in cur_api.items() if key not in ('paths', 'components')},
+        keys=tuple(cur_api),
+    )
+
+
+def parse_spec_file(path: str, stat, digest: str, raw: bytes) -> SpecFile:
+    """
+    可以在子进程中执行
+    """
+    p = Path(path)
+    try:
+        cur_api = load_spec_file(p, raw)
+    except Exception as e:
+        raise PackError(f'{p}: {e}')
+    return make_spec_file(stat, digest, cur_api)
+
+
+def endpoint_op_ids(endpoint) -> Set[str]:
+    if not isinstance(endpoint, dict):
+        return set()
+    return {op['operationId'] for op in endpoint.values() if isinstance(op, dict) and 'operationId' in op}
+
+
+def changed_endpoint_op_ids(old_endpoint, new_endpoint) -> Set[str]:
+    """
+    endpoint级别的parameters变化时，其下所有operation都算变化
+    """
+    old_endpoint = old_endpoint if isinstance(old_endpoint, dict) else {}
+    new_endpoint = new_endpoint if isinstance(new_endpoint, dict) else {}
+    if old_endpoint.get('parameters') != new_endpoint.get('parameters'):
+        return endpoint_op_ids(old_endpoint) | endpoint_op_ids(new_endpoint)
+    ret = set()
+    for method in old_endpoint.keys() | new_endpoint.keys():
+        if old_endpoint.get(method) != new_endpoint.get(method):
+            ret |= endpoint_op_ids({method: old_endpoint.get(method)}) | endpoint_op_ids({method: new_endpoint.get(method)})
+    return ret
+
+
+class SpecPacker:
+    """
+    增量打包：只重新解析有变化的文件，只对涉及到的key检查重复，并报告有变化的operationId
     """
-    dup_path_keys = set()
-    dup_component_keys = set()
-    swagger_data = {}
-    for p in glob_find(ref_path):
-        if p.suffix == '.yaml':
-            cur_api = yaml.full_load(p.open('r', encoding='utf-8'))
+    def __init__(self, ref_path, title, version):
+        self.ref_path = ref_path
+        self.title = title
+        self.version = version
+        self.files: Dict[str, SpecFile] = {}
+        self.path_owners: Dict[str, List[str]] = {}  # {path: [file]}
+        self.schema_owners: Dict[str, List[str]] = {}
+        self.dup_path_keys: Set[str] = set()
+        self.dup_component_keys: Set[str] = set()
+        self.swagger_data: Optional[Dict] = None  # 最近一次打包成功的结果
+        self.pending_paths: Set[str] = set()  # 上次打包成功后涉及到的key
+        self.pending_schemas: Set[str] = set()
+
+    def scan(self, jobs: int=1) -> Tuple[List[str], Dict[str, SpecFile]]:
+        """
+        :return (文件顺序, {file: 新的SpecFile})，只包含内容有变化的文件
+        jobs>1时用进程池并行解析
+        """
+        order, to_parse = [], []
+        for p in glob_find(self.ref_path):
+            key = str(p)
+            order.append(key)
+            stat = p.stat()
+            cached = self.files.get(key)
+            if cached and (cached.mtime, cached.size) == (stat.st_mtime, stat.st_size):
+                continue
+            raw = p.read_bytes()
+            digest = hashlib.sha1(raw).hexdigest()
+            if cached and cached.digest == digest:
+                self.files[key] = cached._replace(mtime=stat.st_mtime, size=stat.st_size)
+                continue
+            to_parse.append((key, stat, digest, raw))
+        if jobs > 1 and len(to_parse) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                parsed = list(executor.map(parse_spec_file, *zip(*to_parse), chunksize=max(1, len(to_parse) // (jobs * 4))))
         else:
-            cur_api = json.load(p.open('r', encoding='utf-8'))
-        if not swagger_data:
-            swagger_data.update(cur_api)
-            swagger_data['paths'] = {}
-            swagger_data['components'] = {'schemas': {}}
-        for key, val in cur_api.get('paths', {}).items():
-            if key in swagger_data['paths']:
-                dup_path_keys.add(key)
-            else:
-                swagger_data['paths'][key] = val
+            parsed = [parse_spec_file(*args) for args in to_parse]
+        return order, {args[0]: spec_file for args, spec_file in zip(to_parse, parsed)}
 
-        for key, val in cur_api.get('components', {}).get('schemas', {}).items():
-            if key in swagger_data['components']['schemas']:
-                dup_component_keys.add(key)
+    def pack(self, jobs: int=1) -> Tuple[Dict, Optional[Set[str]]]:
+        """
+        :return (swagger_data, changed_op_ids)，changed_op_ids为None表示全部重新生成
+        目录为空或有重复的key时抛出PackError
+        """
+        order, changed = self.scan(jobs)
+        removed = self.files.keys() - set(order)
+        touched = changed.keys() | removed
+        # 更新文件缓存和key的归属
+        involved_paths: Set[str] = set()
+        involved_schemas: Set[str] = set()
+        for key in touched:
+            if key in self.files:
+                for path in self.files[key].paths:
+                    self.path_owners[path].remove(key)
+                    involved_paths.add(path)
+                for name in self.files[key].schemas:
+                    self.schema_owners[name].remove(key)
+                    involved_schemas.add(name)
+                del self.files[key]
+            if key in changed:
+                self.files[key] = changed[key]
+                for path in changed[key].paths:
+                    self.path_owners.setdefault(path, []).append(key)
+                    involved_paths.add(path)
+                for name in changed[key].schemas:
+                    self.schema_owners.setdefault(name, []).append(key)
+                    involved_schemas.add(name)
+        # 只对涉及到的key重新检查重复
+        for path in involved_paths:
+            owners = self.path_owners[path]
+            if len(owners) > 1:
+                self.dup_path_keys.add(path)
+            else:
+                self.dup_path_keys.discard(path)
+                if not owners:
+                    del self.path_owners[path]
+        for name in involved_schemas:
+            owners = self.schema_owners[name]
+            if len(owners) > 1:
+                self.dup_component_keys.add(name)
             else:
-                swagger_data['components']['schemas'][key] = val
-    if not swagger_data:
-        print('Empty reference directory!')
-        exit(1)
-
-    if dup_path_keys or dup_component_keys:
-        if dup_path_keys:
-            print('Duplicated paths keys:')
-            for key in dup_path_keys:
-                print('    ' + key)
-        if dup_component_keys:
-            print('Duplicated components keys:')
-            for key in dup_component_keys:
-                print('    ' + key)
-        print('\nLoad swagger failed!')
-        exit(1)
-
-    swagger_data['info']['title'] = title
-    swagger_data['info']['version'] = version
-    for path in swagger_data['paths']:
-        swagger_data['paths'][path] @= sorted_dict
-    swagger_data['paths'] @= sorted_dict
+                self.dup_component_keys.discard(name)
+                if not owners:
+                    del self.schema_owners[name]
+        self.pending_paths |= involved_paths
+        self.pending_schemas |= involved_schemas
+        base_files = [key for key in order if self.files[key].keys]
+        if not base_files:
+            raise PackError('Empty reference directory!')
+        if self.dup_path_keys or self.dup_component_keys:
+            lines = []
+            if self.dup_path_keys:
+                lines.append('Duplicated paths keys:')
+                for key in self.dup_path_keys:
+                    lines.append('    ' + key)
+            if self.dup_component_keys:
+                lines.append('Duplicated components keys:')
+                for key in self.dup_component_keys:
+                    lines.append('    ' + key)
+            lines.append('\nLoad swagger failed!')
+            raise PackError('\n'.join(lines))
+        if not touched and self.swagger_data is not None:
+            return self.swagger_data, set()
+        # 合并：未变化的文件直接复用缓存中已排序的endpoint，不再解析
+        first = self.files[base_files[0]]
+        merged = {
+            'info': dict(first.base.get('info') or {}, title=self.title, version=self.version),
+            'paths': {path: self.files[self.path_owners[path][0]].paths[path] for path in sorted(self.path_owners)},
+            'components': {'schemas': {}},
+        }
+        for key in order:
+            merged['components']['schemas'].update(self.files[key].schemas)
+        # key顺序与第一个文件相同，第一个文件没有的paths/components追加在最后
+        swagger_data = {key: merged[key] if key in merged else first.base[key] for key in first.keys}
+        for key in ('paths', 'components', 'info'):
+            swagger_data.setdefault(key, merged[key])
+        changed_op_ids = self.changed_op_ids(swagger_data)
+        if self.swagger_data is None or self.swagger_data.keys() != swagger_data.keys() or any(
+                self.swagger_data[key] != val for key, val in swagger_data.items() if key not in ('paths', 'components')):
+            changed_op_ids = None  # 顶层字段变化，下游缓存全部失效
+        self.swagger_data = swagger_data
+        self.pending_paths, self.pending_schemas = set(), set()
+        return swagger_data, changed_op_ids
+
+    def changed_op_ids(self, swagger_data: Dict) -> Set[str]:
+        """
+        与上次打包成功的结果相比，只比较涉及到的key
+        """
+        old_data = self.swagger_data or {'paths': {}, 'components': {'schemas': {}}}
+        old_paths, old_schemas = old_data['paths'], old_data['components']['schemas']
+        new_paths, new_schemas = swagger_data['paths'], swagger_data['components']['schemas']
+        ret = set()
+        for path in self.pending_paths:
+            ret |= changed_endpoint_op_ids(old_paths.get(path), new_paths.get(path))
+        changed_schemas = {name for name in self.pending_schemas if old_schemas.get(name) != new_schemas.get(name)}
+        if not changed_schemas:
+            return ret
+        # 沿着$ref反向传播：引用了变化schema的schema也算变化
+        schema_refs: Dict[str, Set[str]] = {}
+        path_refs: Dict[str, Set[str]] = {}
+        for spec_file in self.files.values():
+            schema_refs.update(spec_file.schema_refs)
+            path_refs.update(spec_file.path_refs)
+        while True:
+            more = {name for name, refs in schema_refs.items() if name not in changed_schemas and refs & changed_schemas}
+            if not more:
+                break
+            changed_schemas |= more
+        for path, refs in path_refs.items():
+            if not refs & changed_schemas:
+                continue
+            endpoint = new_paths.get(path)
+            if collect_refs(endpoint.get('parameters'), set()) & changed_schemas:
+                ret |= endpoint_op_ids(endpoint)
+                continue
+            for method, operation in endpoint.items():
+                if collect_refs(operation, set()) & changed_schemas:
+                    ret |= endpoint_op_ids({method: operation})
+        return ret
+
+
+def packed(ref_path, title, version, jobs: int=1):
+    """
+    ref_path -> packed_swagger_data
+    目录为空或有重复的key时抛出PackError
+    """
+    swagger_data, _ = SpecPacker(ref_path, title, version).pack(jobs)
     return swagger_data
 
 
@@ -0,0 +1,199 @@
+"""
+按参数的schema和OpenAPI的style/explode预先生成每个operation的参数解码规则：
+字符串只转换一次，转换后的值既用于jsonschema校验，也作为pql的query/path/header。
+"""
+from typing import Dict, List, Tuple, Any, Optional, NamedTuple, Union
+import itertools
+from wax.lessweb.webapi import http_methods
+from wax.jsonschema_util import jsonschema_from_ref
+
+
+RawValue = Union[str, List[str], Dict[str, str]]
+
+DEFAULT_STYLES = {'path': 'simple', 'header': 'simple', 'query': 'form', 'cookie': 'form'}
+STYLE_DELIMITERS = {'spaceDelimited': ' ', 'pipeDelimited': '|'}
+
+
+def deref(schema: Dict, swagger_data: Dict) -> Dict:
+    for _ in range(40):  # 防止循环引用
+        if not isinstance(schema, dict) or '$ref' not in schema:
+            break
+        schema = jsonschema_from_ref(schema['$ref'], swagger_data)
+    return schema if isinstance(schema, dict) else {}
+
+
+def schema_kind(schema: Dict) -> str:
+    kind = schema.get('type', '')
+    return kind if isinstance(kind, str) else ''
+
+
+def coerce(value: str, kind: str) -> Any:
+    """
+    按schema的type转换字符串，无法转换时保留原字符串，由jsonschema报告类型错误
+    """
+    if kind == 'integer':
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                return float(value)  # '1.5'交给jsonschema报告不是integer
+            except ValueError:
+                return value
+    elif kind == 'number':
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    elif kind == 'boolean':
+        lower = value.lower()
+        if lower in ('true', 'false'):
+            return lower == 'true'
+        return bool(int(value)) if value.isdigit() else value
+    return value
+
+
+def strip_prefix(raw: str, style: str, name: str) -> str:
+    """
+    label: '.3' -> '3'，matrix: ';id=3' -> '3'
+    """
+    if style == 'label' and raw.startswith('.'):
+        return raw[1:]
+    if style == 'matrix' and raw.startswith(f';{name}='):
+        return raw[len(name) + 2:]
+    return raw
+
+
+def pairs_to_dict(values: List[str]) -> Dict[str, str]:
+    """
+    ['R', '100', 'G', '200'] -> {'R': '100', 'G': '200'}
+    """
+    return dict(zip(values[::2], values[1::2]))
+
+
+class ParamSpec(NamedTuple):
+    name: str
+    location: str  # path/query/header/cookie
+    required: bool
+    allow_empty: bool
+    schema: Dict  # 原始schema，校验时使用
+    kind: str  # 解引用后的type
+    item_kind: str  # array中元素的type
+    property_kinds: Dict[str, str]  # object中每个属性的type
+    style: str
+    explode: bool
+
+    def fetch(self, request, url_params: Dict) -> Optional[RawValue]:
+        """
+        :return 原始值，参数不存在时返回None
+        """
+        if self.location == 'header':
+            return request.get_header(self.name) if request.contains_header(self.name) else None
+        elif self.location == 'cookie':
+            return request.get_cookie(self.name) if request.contains_cookie(self.name) else None
+        elif self.location == 'path':
+            return url_params.get(self.name)
+        query_params = request.param_input.query_input
+        if self.kind == 'object' and self.style == 'deepObject':
+            prefix = self.name + '['
+            ret = {key[len(prefix):-1]: val[0] for key, val in query_params.items()
+                   if key.startswith(prefix) and key.endswith(']')}
+            return ret or None
+        if self.kind == 'object' and self.style == 'form' and self.explode:  # 每个属性都是一个query参数
+            ret = {key: query_params[key][0] for key in self.property_kinds if key in query_params}
+            return ret or None
+        if self.name not in query_params:
+            return None
+        return query_params[self.name] if self.kind == 'array' else query_params[self.name][0]
+
+    @staticmethod
+    def first(raw: RawValue) -> str:
+        if isinstance(raw, list):
+            return raw[0] if raw else ''
+        if isinstance(raw, dict):
+            return next(iter(raw.values()), '')
+        return raw
+
+    def split(self, raw: RawValue) -> List[str]:
+        if isinstance(raw, list):  # query参数form+explode，?id=1&id=2
+            if self.explode or self.style not in ('form', *STYLE_DELIMITERS):
+                return raw
+            return list(itertools.chain.from_iterable(self.split(val) for val in raw))
+        if self.style == 'matrix' and self.explode:  # ;id=1;id=2
+            return [part.split('=', 1)[-1] for part in raw.split(';') if part]
+        raw = strip_prefix(raw, self.style, self.name)
+        if self.style == 'label' and self.explode:  # .1.2
+            return raw.split('.')
+        return raw.split(STYLE_DELIMITERS.get(self.style, ','))
+
+    def decode(self, raw: RawValue) -> Any:
+        if self.kind == 'array':
+            return [coerce(val, self.item_kind) for val in self.split(raw)]
+        if self.kind == 'object':
+            if isinstance(raw, dict):
+                values = raw
+            elif self.explode:  # R=100,G=200 | .R=100.G=200 | ;R=100;G=200
+                if self.style == 'matrix':
+                    parts = raw.split(';')
+                elif self.style == 'label':
+                    parts = raw[1:].split('.') if raw.startswith('.') else raw.split('.')
+                else:
+                    parts = raw.split(',')
+                values = dict(part.split('=', 1) for part in parts if '=' in part)
+            else:  # R,100,G,200
+                values = pairs_to_dict(self.split(self.first(raw)))
+            return {key: coerce(val, self.property_kinds.get(key, '')) for key, val in values.items()}
+        value = self.first(raw)
+        if self.location == 'path':
+            value = strip_prefix(value, self.style, self.name)
+        return coerce(value, self.kind)
+
+
+def make_param_spec(param: Dict, swagger_data: Dict) -> Optional[ParamSpec]:
+    param = deref(param, swagger_data)
+    if not param.get('name'):
+        return None
+    location = param.get('in', 'query')
+    style = param.get('style') or DEFAULT_STYLES.get(location, 'form')
+    schema = param.get('schema', {})
+    resolved = deref(schema, swagger_data)
+    properties = resolved.get('properties', {})
+    return ParamSpec(
+        name=param['name'],
+        location=location,
+        required=param.get('required', False),
+        allow_empty=param.get('allowEmptyValue', True),
+        schema=schema,
+        kind=schema_kind(resolved),
+        item_kind=schema_kind(deref(resolved.get('items', {}), swagger_data)),
+        property_kinds={key: schema_kind(deref(val, swagger_data)) for key, val in properties.items()}
+        if isinstance(properties, dict) else {},
+        style=style,
+        explode=param.get('explode', style == 'form'),
+    )
+
+
+OperationParams = Tuple[ParamSpec, ...]
+
+
+def operation_params(endpoint: Dict, operation: Dict, swagger_data: Dict) -> OperationParams:
+    """
+    合并endpoint和operation的参数，operation中同名同位置的参数覆盖endpoint中的参数
+    """
+    specs: Dict[Tuple[str, str], ParamSpec] = {}
+    for param in itertools.chain(endpoint.get('parameters', []), operation.get('parameters', [])):
+        spec = make_param_spec(param, swagger_data)
+        if spec is not None:
+            specs[spec.name, spec.location] = spec
+    return tuple(specs.values())
+
+
+def build_param_index(swagger_data: Dict) -> Dict[str, OperationParams]:
+    """
+    :return {operationId: (ParamSpec, ...)}
+    """
+    ret = {}
+    for endpoint in swagger_data['paths'].values():
+        for op_method, operation in endpoint.items():
+            if op_method.upper() in http_methods and isinstance(operation, dict) and 'operationId' in operation:
+                ret[operation['operationId']] = operation_params(endpoint, operation, swagger_data)
+    return ret
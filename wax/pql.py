@@ -19,10 +19,19 @@
   - `operation('get-file-accessToken').example('ok')`
   - `operation('get-file-accessToken').example()`
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, FrozenSet, NamedTuple, Callable, Iterable, Iterator, Set
+from functools import lru_cache
+from itertools import islice
+import ast
+import heapq
+import keyword
 import json
 import re
+from time import perf_counter
 from wax.load_func import lib
+from wax.entity_util import entity_store, Entity
+from wax.vector_util import VectorExpr, row_field, is_row_free, row_reads, safe_reads, stable_order
+from wax.profile_util import PlanProfile
 
 
 KEYWORDS = [
@@ -39,6 +48,9 @@ KEYWORDS = [
     '__return__',
 ]
 
+# 只对rows做确定性变换的关键词，不读取entity/helper，也不执行lambda
+STATIC_KEYWORDS = {'__item__', '__only__', '__except__', '__rename__'}
+
 
 class PqlRuntimeError(Exception):
     def __init__(self, path, reason):
@@ -65,17 +77,13 @@ def match_name_pair(text: str) -> Any:
 
 
 def query_entity(entity_name) -> List:
-    try:
-        text = open(f'entity/{entity_name}.json').read()
-    except:
-        raise PqlRuntimeError('', f'数据未创建({entity_name})')
-    try:
-        data = json.loads(text)
-    except:
-        raise PqlRuntimeError('', f'数据无法解析JSON({entity_name})')
-    if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
-        raise PqlRuntimeError('', f'数据不合法，只支持list[dict]类型({entity_name})')
-    return data
+    """
+    :return 冻结的rows，所有请求共享，不能修改
+    """
+    rows, error = entity_store.get(entity_name)
+    if rows is None:
+        raise PqlRuntimeError('', error)
+    return rows
 
 
 def helper_schema(helper_name, dict_schema: Dict) -> Dict:
@@ -96,163 +104,781 @@ def helper_schema(helper_name, dict_schema: Dict) -> Dict:
     return helper_schema
 
 
-def apply_schema(env, dict_schema) -> Any:
+def is_static(dict_schema) -> bool:
     """
-    把dict类型的schema实例化为数组类型的rows，或__return__指定的值
+    schema中的字符串都是字面量(例如"'Tom'"、"[1, 2]")且没有用到entity/helper/lambda时，apply_schema的结果与env无关
     """
     if not isinstance(dict_schema, dict):
-        raise PqlRuntimeError('', 'schema必须是dict类型')
-    # 处理helper类型的schema
-    if '__helper__' in dict_schema:
-        filled_schema = helper_schema(helper_name=dict_schema['__helper__'], dict_schema=dict_schema)
-        return apply_schema(env, dict_schema=filled_schema)
-    filterd_rows = []
-    renamed_rows = []
-    outer_name, cur_rows = None, [{}]
-    # 第一阶段：name|from
-    if '__name__' in dict_schema and '__from__' in dict_schema:
-        raise PqlRuntimeError('__name__', '__name__和__from__不能同时定义')
-    if '__name__' in dict_schema:
-        if not is_var_name(dict_schema['__name__']):
-            raise PqlRuntimeError('__name__', '语法错误')
-        outer_name = dict_schema['__name__']
-    elif '__from__' in dict_schema:
-        outer_name, inner_name = match_name_pair(dict_schema['__from__'])
-        if not inner_name:
-            raise PqlRuntimeError('__from__', '语法错误')
+        return False
+    for key, func_or_schemas in dict_schema.items():
+        if key in KEYWORDS:
+            if key not in STATIC_KEYWORDS:
+                return False
+            continue
+        if not isinstance(func_or_schemas, list):
+            func_or_schemas = [func_or_schemas]
+        for func_or_schema in func_or_schemas:
+            if isinstance(func_or_schema, str):
+                try:
+                    ast.literal_eval(func_or_schema)
+                except Exception:
+                    return False
+            elif not is_static(func_or_schema):
+                return False
+    return True
+
+
+def raise_error(error: Exception):
+    """
+    每次抛出新的异常对象，避免同一个异常对象的traceback不断增长
+    """
+    raise type(error)(*error.args)
+
+
+def error_message(error: Exception) -> str:
+    if isinstance(error, PqlRuntimeError):
+        return str(error)
+    return f'({type(error).__name__}) {error}'
+
+
+def check_lambda(func: Any) -> str:
+    """
+    :return 与apply_lambda相同的语法错误信息，没有错误时返回''
+    """
+    if not isinstance(func, str):
+        return '语法错误，只支持str类型'
+    if not func:
+        return '语法错误，不支持空字符串'
+    try:
+        compile('lambda: (%s)' % func, '<string>', 'eval')
+    except SyntaxError as e:
+        return '语法错误: ' + str(e)
+    return ''
+
+
+class ItemsRule(NamedTuple):
+    """
+    map结果的key的解析结果，见apply_items
+    """
+    key: str
+    valid: bool
+    spread: bool  # **name
+    prefix: str
+
+    def apply(self, rows: Any) -> Dict:
+        if not self.valid:
+            raise PqlRuntimeError('', 'key语法错误')
+        if not self.spread:
+            return {self.key: rows}
+        if isinstance(rows, list):
+            if not rows:
+                return {}
+            row = rows[0]
+        else:
+            row = rows
+        if row is None:  # {"__item__": [0]}可能返回None
+            return {}
+        if not isinstance(row, dict):
+            raise PqlRuntimeError('', '运行时错误，只支持dict?|list[dict?]类型')
+        key_prefix = self.prefix
+        return {
+            (key_prefix + sub_key if key_prefix[-1] == '_' else key_prefix + sub_key[0].upper() + sub_key[1:]): value
+            for sub_key, value in row.items()
+        }
+
+
+def parse_items_key(key: str) -> ItemsRule:
+    match_ret = re.match(r'^(\*\*)?(\w+)$', key)
+    if not match_ret:
+        return ItemsRule(key, False, False, '')
+    return ItemsRule(key, True, key.startswith('**'), match_ret.groups()[1])
+
+
+class JoinRule(NamedTuple):
+    """
+    形如it['userId'] == u['id']的__filter__：用entity的哈希索引找出可能满足的行，不再逐行扫描
+    """
+    field: str
+    probe: str  # 与当前行无关的一侧
+
+    def match(self, entity: Entity, env: Dict) -> Optional[List[int]]:
+        """
+        :return 字段值等于probe的行号，顺序与entity相同；无法使用索引时返回None，由调用者逐行扫描
+        """
+        index = entity.index(self.field)
+        if index is None:
+            return None
         try:
-            cur_rows = query_entity(inner_name)
-        except PqlRuntimeError as e:
-            raise PqlRuntimeError('__from__', e.reason)
-    for cur_row in cur_rows:
+            value = call_lambda(self.probe, tuple(env), env.values(), key='__filter__')
+            # 只用json的标量查索引，被排除的行逐行比较时==一定不报错；NaN与任何值都不相等
+            if type(value) not in (str, int, float, bool, type(None)) or value != value:
+                return None
+            positions = index.get(value, ())
+        except Exception:  # 报错的情况交给逐行扫描，错误信息与之前相同
+            return None
+        return list(positions)
+
+
+def parse_join(func: Any, row_names: Tuple[str, ...]) -> Optional[JoinRule]:
+    if not isinstance(func, str) or check_lambda(func):
+        return None
+    try:
+        tree = ast.parse(func.strip(), mode='eval').body
+    except Exception:
+        return None
+    if not isinstance(tree, ast.Compare) or len(tree.ops) != 1 or not isinstance(tree.ops[0], ast.Eq):
+        return None
+    for row_side, probe_side in ((tree.left, tree.comparators[0]), (tree.comparators[0], tree.left)):
+        field = row_field(row_side, row_names)
+        if field is not None and is_row_free(probe_side, row_names):
+            return JoinRule(field, ast.get_source_segment(func.strip(), probe_side))
+    return None
+
+
+def item_limit(item: Tuple[Optional[int], ...]) -> Optional[int]:
+    """
+    __item__只用到排序后的前limit行时返回limit，用到负数下标时返回None
+    """
+    if len(item) == 1:
+        return item[0] + 1 if item[0] >= 0 else None
+    start, end = item[0], item[1]
+    step = item[2] if len(item) == 3 else None
+    if end is None or end < 0 or (start is not None and start < 0) or (step is not None and step <= 0):
+        return None
+    return end
+
+
+def is_lambda_args(names: Iterable[str]) -> bool:
+    return all(name.isidentifier() and not keyword.iskeyword(name) for name in names)
+
+
+def select_item(rows: List, item: Tuple[Optional[int], ...]) -> Any:
+    if len(item) == 1:
+        return rows[item[0]]
+    return rows[slice(*item)]
+
+
+def is_total_order(keys: List) -> bool:
+    """
+    key都是数值(不含NaN)或都是str时，比较不会报错，heapq的top-k与完整排序的前k个相同
+    """
+    types = set(map(type, keys))
+    if types <= {int, bool, float}:
+        return not any(key != key for key in keys)
+    return types == {str}
+
+
+def row_binder(env: Dict, outer_name: Optional[str]) -> Callable[[Dict], Tuple[Tuple[str, ...], List]]:
+    """
+    执行__from__期间env只有it和outer_name随行变化(嵌套的schema使用env的副本)，
+    参数名和其他参数在第一行时确定，之后每行只替换这两个位置
+    """
+    names: Tuple[str, ...] = ()
+    values: List = []
+    row_slots: List[int] = []
+
+    def bind(cur_row: Dict) -> Tuple[Tuple[str, ...], List]:
+        nonlocal names
         env['it'] = cur_row
         if outer_name:
             env[outer_name] = cur_row
-        # 第二阶段：根据key/value依次执行map
+        if not row_slots:
+            names = tuple(env)
+            values.extend(env.values())
+            row_slots.append(names.index('it'))
+            if outer_name:
+                row_slots.append(names.index(outer_name))
+        for slot in row_slots:
+            values[slot] = cur_row
+        return names, values
+
+    return bind
+
+
+class MapEntry(NamedTuple):
+    key: str
+    sources: Tuple[Any, ...]  # str为lambda，PqlPlan为嵌套的schema，其他类型在执行到时报语法错误
+    items: ItemsRule
+
+
+class PqlPlan:
+    """
+    编译后的dict schema：关键词冲突、__name__/__from__/__only__/__except__/__rename__/__item__的语法只检查一次，
+    嵌套的schema编译为子plan。语法错误保存下来，执行到原来报错的阶段时再抛出，因此结果和报错顺序都与逐行解释时相同
+    """
+    def __init__(self, dict_schema: Any):
+        self.schema = dict_schema
+        self.schema_error: Optional[Exception] = None
+        self.helper: Optional[str] = None
+        # 第一阶段：name|from
+        self.from_error: Optional[Exception] = None
+        self.outer_name: Optional[str] = None
+        self.entity: Optional[str] = None
+        # 第二、三阶段：map、filter
+        self.entries: List[MapEntry] = []
+        self.has_filter = False
+        self.filter: Any = None
+        # 第四阶段：sort,reverse
+        self.has_reverse = False
+        self.reverse: Any = None
+        self.has_sort = False
+        self.sort: Any = None
+        # 第五阶段：only|(except,rename)
+        self.select_error: Optional[Exception] = None
+        self.only_names: Optional[FrozenSet[str]] = None
+        self.except_names: Optional[FrozenSet[str]] = None
+        self.rename_rules: Dict[str, str] = {}
+        # 第二、三阶段可以用entity的索引代替逐行扫描时不为None
+        self.join: Optional[JoinRule] = None
+        # 第三、四阶段可以整列计算时不为None，见vector_util
+        self.vfilter: Optional[VectorExpr] = None
+        self.vsort: Optional[VectorExpr] = None
+        # 惰性执行：filter不依赖map的结果时先filter再map；__item__只需要前limit行时提前结束，排序时只取top-k；
+        # map_last时map只对__item__选中的行执行
+        self.map_fields: Optional[FrozenSet[str]] = None  # map可以跳过或推迟执行时，map读取的字段
+        self.filter_fields: Optional[FrozenSet[str]] = None  # __filter__不会报错时，__filter__读取的字段
+        self.filter_first = False
+        self.limit: Optional[int] = None
+        self.map_last = False
+        # 第六阶段：item|return
+        self.item_error: Optional[Exception] = None
+        self.item: Optional[Tuple[Optional[int], ...]] = None
+        self.has_return = False
+        self.return_func: Any = None
+        if not isinstance(dict_schema, dict):
+            self.schema_error = PqlRuntimeError('', 'schema必须是dict类型')
+        elif '__helper__' in dict_schema:  # helper文件在执行时读取，合并后再编译
+            self.helper = dict_schema['__helper__']
+        else:
+            self.compile(dict_schema)
+
+    def compile(self, dict_schema: Dict) -> None:
+        try:
+            self.compile_from(dict_schema)
+        except Exception as e:
+            self.from_error = e
         for key, func_or_schemas in dict_schema.items():
             if key in KEYWORDS:
                 continue
-            value = None
             if not isinstance(func_or_schemas, list):
                 func_or_schemas = [func_or_schemas]
-            for func_or_schema in func_or_schemas:
-                if isinstance(func_or_schema, str):
-                    value = apply_lambda(env, func=func_or_schema, key=key)
-                elif isinstance(func_or_schema, dict):
+            sources = tuple(PqlPlan(source) if isinstance(source, dict) else source for source in func_or_schemas)
+            self.entries.append(MapEntry(key, sources, parse_items_key(key)))
+        self.has_filter, self.filter = '__filter__' in dict_schema, dict_schema.get('__filter__')
+        self.has_reverse, self.reverse = '__reverse__' in dict_schema, dict_schema.get('__reverse__')
+        self.has_sort, self.sort = '__sort__' in dict_schema, dict_schema.get('__sort__')
+        try:
+            self.compile_select(dict_schema)
+        except Exception as e:
+            self.select_error = e
+        try:
+            self.compile_item(dict_schema)
+        except Exception as e:
+            self.item_error = e
+        self.map_fields = self.compile_safe()
+        self.join = self.compile_join()
+        self.vfilter, self.vsort = self.compile_vector()
+        self.compile_lazy()
+
+    def compile_join(self) -> Optional[JoinRule]:
+        """
+        __filter__形如it['field'] == <与当前行无关的表达式>时，用entity的哈希索引找出满足的行
+        """
+        if self.entity is None or not self.has_filter or not self.can_skip_rows():
+            return None
+        join = parse_join(self.filter, ('it', self.outer_name) if self.outer_name else ('it',))
+        if join is None or not self.map_keeps({join.field}):
+            return None
+        return join
+
+    def compile_vector(self) -> Tuple[Optional[VectorExpr], Optional[VectorExpr]]:
+        if self.entity is None:
+            return None, None
+        vfilter = vsort = None
+        if self.has_filter and isinstance(self.filter, str) and not check_lambda(self.filter) \
+                and self.can_skip_rows():
+            vfilter = VectorExpr(self.filter, ('it', self.outer_name) if self.outer_name else ('it',))
+            if vfilter.tree is None or not self.map_keeps(vfilter.fields):
+                vfilter = None
+        if self.has_sort and isinstance(self.sort, str) and not check_lambda(self.sort):
+            vsort = VectorExpr(self.sort, ('it',))  # 排序时outer_name已经是renamed_rows
+            if vsort.tree is None or not self.map_keeps(vsort.fields):
+                vsort = None
+        return vfilter, vsort
+
+    def compile_lazy(self) -> None:
+        if self.entity is None or not self.can_skip_rows():
+            return
+        row_names = ('it', self.outer_name) if self.outer_name else ('it',)
+        filter_reads = row_reads(self.filter, row_names) if self.has_filter else frozenset()
+        self.filter_first = filter_reads is not None and self.map_keeps(filter_reads)
+        if self.has_filter:  # map写入的key在执行__filter__时一定存在
+            filter_fields = safe_reads(self.filter, row_names) if not check_lambda(self.filter) else None
+            self.filter_fields = None if filter_fields is None else \
+                filter_fields - {entry.key for entry in self.entries}
+        else:
+            self.filter_fields = frozenset()
+        if self.item is None:
+            return
+        self.limit = item_limit(self.item)
+        if self.has_sort:
+            sort_reads = row_reads(self.sort, ('it',))
+            sort_first = sort_reads is not None and self.map_keeps(sort_reads)
+        else:
+            sort_first = True
+        self.map_last = self.filter_first and sort_first
+
+    def compile_safe(self) -> Optional[FrozenSet[str]]:
+        """
+        :return map_fields，见vector_util.safe_reads。前面的map写入的key不计入，之后的map读取时一定存在
+        """
+        row_names = ('it', self.outer_name) if self.outer_name else ('it',)
+        keys: Set[str] = set()
+        map_fields: Set[str] = set()
+        for entry in self.entries:
+            if not entry.items.valid or entry.items.spread:
+                return None
+            for source in entry.sources:
+                fields = safe_reads(source, row_names) if isinstance(source, str) and not check_lambda(source) \
+                    else None
+                if fields is None:
+                    return None
+                map_fields |= fields - keys
+            keys.add(entry.key)
+        return frozenset(map_fields)
+
+    def can_skip_rows(self) -> bool:
+        """
+        跳过一些行或调整执行顺序不能改变结果和报错：被跳过、推迟的map只能读取当前行，不会报错也没有副作用；
+        __return__可能读取循环结束后的it，也不能跳过。执行时还要确认map读取的字段每行都有
+        """
+        return not self.has_return and self.from_error is None and self.map_fields is not None
+
+    def map_keeps(self, fields: Set[str]) -> bool:
+        """
+        map不会改写这些字段，filter/sort读到的值与entity中的相同
+        """
+        return all(not entry.items.spread and entry.key not in fields for entry in self.entries)
+
+    def compile_from(self, dict_schema: Dict) -> None:
+        if '__name__' in dict_schema and '__from__' in dict_schema:
+            raise PqlRuntimeError('__name__', '__name__和__from__不能同时定义')
+        if '__name__' in dict_schema:
+            if not is_var_name(dict_schema['__name__']):
+                raise PqlRuntimeError('__name__', '语法错误')
+            self.outer_name = dict_schema['__name__']
+        elif '__from__' in dict_schema:
+            outer_name, inner_name = match_name_pair(dict_schema['__from__'])
+            if not inner_name:
+                raise PqlRuntimeError('__from__', '语法错误')
+            self.outer_name, self.entity = outer_name, inner_name
+
+    def compile_select(self, dict_schema: Dict) -> None:
+        if '__only__' in dict_schema:
+            if '__except__' in dict_schema:
+                raise PqlRuntimeError('__only__', '__only__和__except__不能同时定义')
+            if '__rename__' in dict_schema:
+                raise PqlRuntimeError('__only__', '__only__和__rename__不能同时定义')
+            rename_pairs = dict_schema['__only__']
+            if not isinstance(rename_pairs, list) or not all(isinstance(name, str) for name in rename_pairs):
+                raise PqlRuntimeError('__only__', '语法错误，只支持list[str]类型')
+            only_names = []
+            for name_pair in rename_pairs:
+                outer_name, inner_name = match_name_pair(name_pair)
+                if not inner_name:
+                    raise PqlRuntimeError('__only__', '语法错误')
+                only_names.append(inner_name)
+                if outer_name:
+                    self.rename_rules[inner_name] = outer_name
+            self.only_names = frozenset(only_names)
+        elif '__except__' in dict_schema:
+            except_names: List = []
+            except_names.extend(dict_schema['__except__'])
+            if not all(isinstance(name, str) for name in except_names):
+                raise PqlRuntimeError('__except__', '语法错误，只支持list[str]类型')
+            if not all(is_var_name(name) for name in except_names):
+                raise PqlRuntimeError('__except__', '语法错误')
+            self.except_names = frozenset(except_names)
+        if '__rename__' in dict_schema:
+            rename_pairs = dict_schema['__rename__']
+            if not isinstance(rename_pairs, list) or not all(isinstance(name, str) for name in rename_pairs):
+                raise PqlRuntimeError('__rename__', '语法错误，只支持list[str]类型')
+            for name_pair in rename_pairs:
+                outer_name, inner_name = match_name_pair(name_pair)
+                if not inner_name or not outer_name:
+                    raise PqlRuntimeError('__rename__', '语法错误')
+                self.rename_rules[inner_name] = outer_name
+
+    def compile_item(self, dict_schema: Dict) -> None:
+        if '__item__' in dict_schema:
+            if '__return__' in dict_schema:
+                raise PqlRuntimeError('__item__', '__item__和__return__不能同时定义')
+            item_indices = dict_schema['__item__']
+            if not isinstance(item_indices, list) or not all(
+                    indice is None or isinstance(indice, int) for indice in item_indices):
+                raise PqlRuntimeError('__item__', '语法错误，只支持list[int?]类型')
+            if not 1 <= len(item_indices) <= 3:
+                raise PqlRuntimeError('__item__', '语法错误，长度应该在1~3范围内')
+            if len(item_indices) == 1 and item_indices[0] is None:
+                raise PqlRuntimeError('__item__', '语法错误，单个下标不能为null')
+            self.item = tuple(item_indices)
+        elif '__return__' in dict_schema:
+            self.has_return, self.return_func = True, dict_schema['__return__']
+
+    def check(self) -> List[str]:
+        """
+        不执行schema，只检查语法。entity和helper文件在执行时才读取，不在检查范围内
+        :return 错误信息列表，格式与PqlRuntimeError相同
+        """
+        if self.schema_error is not None:
+            return [str(self.schema_error)]
+        if self.helper is not None:
+            return []
+        errors = [error_message(error) for error in (self.from_error, self.select_error, self.item_error)
+                  if error is not None]
+        for entry in self.entries:
+            if not entry.items.valid:
+                errors.append(f'{entry.key}: key语法错误')
+            for source in entry.sources:
+                if isinstance(source, PqlPlan):
+                    errors.extend(f'{entry.key}/{error}' for error in source.check())
+                elif isinstance(source, str):
+                    reason = check_lambda(source)
+                    if reason:
+                        errors.append(f'{entry.key}: {reason}')
+                else:
+                    errors.append(f'{entry.key}: 语法错误，只支持dict或str类型')
+        for key, has_func, func in [('__filter__', self.has_filter, self.filter),
+                                    ('__reverse__', self.has_reverse, self.reverse),
+                                    ('__sort__', self.has_sort, self.sort),
+                                    ('__return__', self.has_return, self.return_func)]:
+            reason = check_lambda(func) if has_func else ''
+            if reason:
+                errors.append(f'{key}: {reason}')
+        return errors
+
+    def explain(self, recursive: bool=True) -> Dict:
+        """
+        编译结果：用到的entity、是否使用索引/向量化/惰性执行，以及静态检查出的错误
+        """
+        if self.schema_error is not None or self.helper is not None:
+            return {'helper': self.helper, 'errors': self.check()}
+        result: Dict[str, Any] = {
+            'from': self.schema.get('__from__', self.schema.get('__name__')),
+            'entity': self.entity,
+            'join': self.join.field if self.join is not None else None,
+            'vectorFilter': self.vfilter is not None,
+            'vectorSort': self.vsort is not None,
+            'filterFirst': self.filter_first,
+            'limit': self.limit,
+            'mapLast': self.map_last,
+            'errors': self.check(),
+        }
+        if recursive:
+            result['children'] = [{'key': entry.key, 'index': index, 'plan': source.explain()}
+                                  for entry in self.entries for index, source in enumerate(entry.sources)
+                                  if isinstance(source, PqlPlan)]
+        return result
+
+    def map_row(self, env: Dict, cur_row: Dict, names: Tuple[str, ...], values: List,
+                profile: Optional[PlanProfile]=None) -> None:
+        call = call_lambda if profile is None else profile.call
+        for entry in self.entries:
+            value = None
+            for index, source in enumerate(entry.sources):
+                if isinstance(source, str):
+                    value = call(source, names, values, key=entry.key)
+                elif isinstance(source, PqlPlan):
+                    child = None if profile is None else profile.child(entry.key, index, source)
                     try:
-                        value = apply_schema(dict(env), dict_schema=func_or_schema)
+                        value = source.run(dict(env), child)
                     except PqlRuntimeError as e:
-                        raise PqlRuntimeError(f'{key}/{e.path}', e.reason)
+                        raise PqlRuntimeError(f'{entry.key}/{e.path}', e.reason)
                 else:
-                    raise PqlRuntimeError(key, '语法错误，只支持dict或str类型')
+                    raise PqlRuntimeError(entry.key, '语法错误，只支持dict或str类型')
             try:
-                cur_row.update(apply_items(key, rows=value))
+                cur_row.update(entry.items.apply(value))
             except PqlRuntimeError as e:
-                raise PqlRuntimeError(f'{key}', e.reason)
-        # 第三阶段：filter
-        is_chosen = True
-        if '__filter__' in dict_schema:
-            func = dict_schema['__filter__']
-            is_chosen = apply_lambda(env, func, key='__filter__')
-        if is_chosen:
+                raise PqlRuntimeError(f'{entry.key}', e.reason)
+
+    def sort_rows(self, env: Dict, entity: Optional[Entity], positions: List[int], rows: List[Dict],
+                  reverse: bool, limit: Optional[int], profile: Optional[PlanProfile]=None) -> List[Dict]:
+        """
+        与rows.sort(key, reverse)的结果相同。__item__只用到前limit行时用heapq取top-k，其余的行不再排序
+        """
+        keys = self.vsort.keys(entity, lambda func: apply_lambda(env, func, key='__sort__')) \
+            if self.vsort is not None and entity is not None and rows and is_lambda_args(env) else None
+        if keys is not None:
+            if profile is not None:
+                profile.stages['sort'].strategy = 'vector'
+            order = stable_order(keys[positions], reverse=reverse)
+            return [rows[i] for i in order[:limit]]
+        call = call_lambda if profile is None else profile.call
+        sort_env = dict(env, it=None)
+        sort_names, sort_values = tuple(sort_env), list(sort_env.values())
+        it_index = sort_names.index('it')
+        row_keys = []
+        for it in rows:
+            sort_values[it_index] = it
+            row_keys.append(call(self.sort, sort_names, sort_values, key='__sort__'))
+        if limit is not None and limit < len(rows) and is_total_order(row_keys):
+            if profile is not None:
+                profile.stages['sort'].strategy = 'top-k'
+            select = heapq.nlargest if reverse else heapq.nsmallest
+            return [rows[i] for i in select(limit, range(len(rows)), key=row_keys.__getitem__)]
+        return [rows[i] for i in sorted(range(len(rows)), key=row_keys.__getitem__, reverse=reverse)]
+
+    def match_rows(self, entity: Entity, env: Dict) -> Tuple[Optional[List[int]], bool]:
+        """
+        :return (用哈希索引或向量化的__filter__找出的行号, 是否还需要逐行执行__filter__)；
+        都不能使用时行号为None，逐行执行__filter__
+        """
+        if self.join is not None:
+            positions = self.join.match(entity, env)
+            if positions is not None:
+                return positions, True  # 索引找出的行很少，再执行一次__filter__
+        if self.vfilter is not None:
+            mask = self.vfilter.mask(entity, lambda func: apply_lambda(env, func, key='__filter__'))
+            if mask is not None:
+                return mask.nonzero()[0].tolist(), False
+        return None, self.has_filter
+
+    def scan_rows(self, env: Dict, bind: Callable, rows: Iterable[Tuple[int, Dict]], need_filter: bool,
+                  filter_first: bool, map_last: bool, profile: Optional[PlanProfile]) -> Iterator[Tuple[int, Dict]]:
+        """
+        第二、三阶段：逐行执行map和__filter__。filter_first时先filter再map，map_last时不执行map
+        """
+        call = call_lambda if profile is None else profile.call
+
+        def scan(rows: Iterable[Tuple[int, Dict]], do_map: bool, do_filter: bool) -> Iterator[Tuple[int, Dict]]:
+            for position, cur_row in rows:
+                names, values = bind(cur_row)
+                # 第二阶段：根据key/value依次执行map
+                if do_map:
+                    if profile is None:
+                        self.map_row(env, cur_row, names, values)
+                    else:
+                        start = perf_counter()
+                        self.map_row(env, cur_row, names, values, profile)
+                        profile.add('map', start, 1, 1)
+                # 第三阶段：filter
+                if do_filter:
+                    if profile is None:
+                        keep = call_lambda(self.filter, names, values, key='__filter__')
+                    else:
+                        start = perf_counter()
+                        keep = call(self.filter, names, values, key='__filter__')
+                        profile.add('filter', start, 1, 1 if keep else 0)
+                    if not keep:
+                        continue
+                yield position, cur_row
+
+        if not filter_first:
+            return scan(rows, do_map=True, do_filter=need_filter)
+        if need_filter:
+            rows = scan(rows, do_map=False, do_filter=True)
+        return rows if map_last else scan(rows, do_map=True, do_filter=False)
+
+    def select_row(self, cur_row: Dict) -> Dict:
+        """
+        第五阶段：only|(except,rename)，并排除None值
+        """
+        if self.only_names is not None:
+            cur_row = {key: value for (key, value) in cur_row.items() if key in self.only_names}
+        elif self.except_names is not None:
+            cur_row = {key: value for (key, value) in cur_row.items() if key not in self.except_names}
+        # 处理rename，rename后可能有重名的key，因此先rename再排除None值
+        if self.rename_rules:
+            cur_row = {self.rename_rules.get(key, key): value for (key, value) in cur_row.items()}
+        return {key: value for (key, value) in cur_row.items() if key and value is not None}
+
+    def stream(self, env: Dict) -> Optional[Iterator[Dict]]:
+        """
+        结果是不排序、不截取的数组，并且逐行执行时不会报错时，返回逐行生成结果的迭代器，不需要先在内存中生成全部的行；
+        否则返回None，应当使用run()。迭代器生成的行与run()的结果相同，只是结束后env[outer_name]不会指向结果
+        """
+        if self.schema_error is not None or self.helper is not None or self.entity is None \
+                or self.select_error is not None or self.item_error is not None or self.item is not None \
+                or self.has_sort or self.has_reverse or not self.can_skip_rows():
+            return None
+        if not is_lambda_args(env) or (self.outer_name and not is_lambda_args([self.outer_name])):
+            return None
+        entity = entity_store.entity(self.entity)
+        if entity.rows is None or not entity.has_fields(self.map_fields):
+            return None
+        # 第一行之后才能发现的错误已经无法改为报错的响应，__filter__不能报错
+        filter_safe = not self.has_filter or (self.filter_fields is not None and entity.has_fields(self.filter_fields))
+        if not filter_safe and self.join is None and self.vfilter is None:
+            return None
+        matched, need_filter = self.match_rows(entity, env)
+        if need_filter and matched is None and not filter_safe:
+            return None
+        positions = range(len(entity.rows)) if matched is None else matched
+        rows = ((i, dict(entity.rows[i])) for i in positions)
+        rows = self.scan_rows(env, row_binder(env, self.outer_name), rows, need_filter, self.filter_first, False, None)
+        return (self.select_row(cur_row) for _, cur_row in rows)
+
+    def run(self, env: Dict, profile: Optional[PlanProfile]=None) -> Any:
+        """
+        把schema实例化为数组类型的rows，或__return__指定的值。env会被修改，与apply_schema相同
+        :param profile: 不为None时记录每个阶段的行数、lambda执行次数和耗时，见profile_util
+        """
+        if profile is None:
+            return self.execute(env, None)
+        profile.runs += 1
+        start = perf_counter()
+        try:
+            return self.execute(env, profile)
+        finally:
+            profile.seconds += perf_counter() - start
+
+    def execute(self, env: Dict, profile: Optional[PlanProfile]) -> Any:
+        if self.schema_error is not None:
+            raise_error(self.schema_error)
+        if self.helper is not None:
+            filled_plan = PqlPlan(helper_schema(helper_name=self.helper, dict_schema=self.schema))
+            if profile is not None:
+                profile.plan = filled_plan
+            return filled_plan.execute(env, profile)
+        call = call_lambda if profile is None else profile.call
+        renamed_rows: List[Dict] = []
+        # 第一阶段：name|from
+        if self.from_error is not None:
+            raise_error(self.from_error)
+        outer_name = self.outer_name
+        need_filter = self.has_filter
+        entity, positions, matched = None, range(1), None
+        if self.entity is not None:
+            start, loads = perf_counter(), entity_store.loads
+            entity = entity_store.entity(self.entity)
+            if profile is not None:
+                profile.entity_loads += entity_store.loads - loads
+                profile.add('from', start, len(entity.rows or ()))
+            if entity.rows is None:
+                raise PqlRuntimeError('__from__', entity.error)
+            # env的key都能作为参数名时，lambda的语法错误都已在编译时发现；map读取的字段每行都有时map不会报错，
+            # 跳过一些行或调整执行顺序不会改变结果和报错
+            lazy = is_lambda_args(env) and (not outer_name or is_lambda_args([outer_name])) \
+                and self.can_skip_rows() and entity.has_fields(self.map_fields)
+            if lazy:
+                start = perf_counter()
+                matched, need_filter = self.match_rows(entity, env)
+                positions = range(len(entity.rows)) if matched is None else matched
+                if profile is not None and matched is not None:
+                    # 索引/向量化排除的行计入filter的输入行数，索引找出的行还要逐行执行一次__filter__
+                    rows_in = len(entity.rows) - len(matched) if need_filter else len(entity.rows)
+                    profile.add('filter', start, rows_in, 0 if need_filter else len(matched))
+                    profile.stages['filter'].strategy = f'index:{self.join.field}' if need_filter else 'vector'
+            else:
+                positions = range(len(entity.rows))
+        else:
+            lazy = False
+            if profile is not None:
+                profile.stages['from'].rows_in += 1
+        filter_first, map_last, limit = (self.filter_first, self.map_last, self.limit) if lazy else (False, False, None)
+        bind = row_binder(env, outer_name)
+        # 每行带着在entity中的位置，用于向量化排序；map的结果写入每行的副本
+        rows: Iterable[Tuple[int, Dict]] = ((i, dict(entity.rows[i]) if entity is not None else {}) for i in positions)
+        if profile is not None:
+            rows = profile.count('from', rows)
+        rows = self.scan_rows(env, bind, rows, need_filter, filter_first, map_last, profile)
+        if limit is not None and not self.has_sort and not self.has_reverse:
+            # 取够__item__需要的行后不再执行后面的行，因此逐行执行的__filter__不能报错；
+            # 索引找出的行再执行一次__filter__，结果都是True
+            if not need_filter or matched is not None or \
+                    (self.filter_fields is not None and entity.has_fields(self.filter_fields)):
+                rows = islice(rows, limit)
+        filterd_positions, filterd_rows = [], []
+        for position, cur_row in rows:
+            filterd_positions.append(position)
             filterd_rows.append(cur_row)
-    # 循环结束后outer_name代表renamed_rows，而不再是cur_row
-    if outer_name:
-        env[outer_name] = renamed_rows
-    # 第四阶段：sort,reverse
-    need_reverse, need_sort = False, False
-    if '__reverse__' in dict_schema:
-        rev_func = dict_schema['__reverse__']
-        rev_env = {k: v for (k, v) in env.items() if k != 'it'}  # 排除it
-        need_reverse = bool(apply_lambda(rev_env, func=rev_func, key='__reverse__'))
-    if '__sort__' in dict_schema:
-        sort_func = dict_schema['__sort__']
-        need_sort = True
-    if need_sort:
-        filterd_rows.sort(key=lambda it: apply_lambda(dict(env, it=it), sort_func, key='__sort__'), reverse=need_reverse)
-    elif need_reverse:
-        filterd_rows.reverse()
-    # 第五阶段：only|(except,rename)
-    # 本阶段的产出是renamed_rows
-    only_names, except_names = [], []
-    rename_rules = {}
-    if '__only__' in dict_schema:
-        if '__except__' in dict_schema:
-            raise PqlRuntimeError('__only__', '__only__和__except__不能同时定义')
-        if '__rename__' in dict_schema:
-            raise PqlRuntimeError('__only__', '__only__和__rename__不能同时定义')
-        rename_pairs = dict_schema['__only__']
-        if not isinstance(rename_pairs, list) or not all(isinstance(name, str) for name in rename_pairs):
-            raise PqlRuntimeError('__only__', '语法错误，只支持list[str]类型')
-        for name_pair in rename_pairs:
-            outer_name, inner_name = match_name_pair(name_pair)
-            if not inner_name:
-                raise PqlRuntimeError('__only__', '语法错误')
-            only_names.append(inner_name)
+        # 循环结束后outer_name代表renamed_rows，而不再是cur_row
+        if outer_name:
+            env[outer_name] = renamed_rows
+        # 第四阶段：sort,reverse
+        start, rows_in = perf_counter(), len(filterd_rows)
+        need_reverse = False
+        if self.has_reverse:
+            rev_env = {k: v for (k, v) in env.items() if k != 'it'}  # 排除it
+            need_reverse = bool(call(self.reverse, tuple(rev_env), rev_env.values(), key='__reverse__'))
+        if self.has_sort:
+            filterd_rows = self.sort_rows(env, entity, filterd_positions, filterd_rows, need_reverse, limit, profile)
+        elif need_reverse:
+            filterd_rows.reverse()
+        if profile is not None and (self.has_sort or self.has_reverse):
+            profile.add('sort', start, rows_in, len(filterd_rows))
+        # __item__只用到部分行时，只对这些行执行(推迟的)map和only|except|rename
+        selected = filterd_rows
+        if self.item is not None:
+            start = perf_counter()
+            try:
+                selected = [select_item(filterd_rows, self.item)] if len(self.item) == 1 else \
+                    select_item(filterd_rows, self.item)
+            except Exception:
+                # 此处故意不抛异常，理解为None是rows[0]的默认值
+                selected = None
+            if profile is not None:
+                profile.add('item', start, len(filterd_rows), len(selected or ()))
+        if map_last:
+            for cur_row in selected or ():
+                start = perf_counter()
+                self.map_row(env, cur_row, *bind(cur_row), profile)
+                if profile is not None:
+                    profile.add('map', start, 1, 1)
             if outer_name:
-                rename_rules[inner_name] = outer_name
-    elif '__except__' in dict_schema:
-        except_names.extend(dict_schema['__except__'])
-        if not isinstance(except_names, list) or not all(isinstance(name, str) for name in except_names):
-            raise PqlRuntimeError('__except__', '语法错误，只支持list[str]类型')
-        if not all(is_var_name(name) for name in except_names):
-            raise PqlRuntimeError('__except__', '语法错误')
-    if '__rename__' in dict_schema:
-        rename_pairs = dict_schema['__rename__']
-        if not isinstance(rename_pairs, list) or not all(isinstance(name, str) for name in rename_pairs):
-            raise PqlRuntimeError('__rename__', '语法错误，只支持list[str]类型')
-        for name_pair in rename_pairs:
-            outer_name, inner_name = match_name_pair(name_pair)
-            if not inner_name or not outer_name:
-                raise PqlRuntimeError('__rename__', '语法错误')
-            rename_rules[inner_name] = outer_name
-    for cur_row in filterd_rows:
-        if isinstance(cur_row, dict):
-            # 处理only|except
-            if '__only__' in dict_schema:  # 重要，不可省略！
-                cur_row = {key: value for (key, value) in cur_row.items() if key in only_names}
-            elif '__except__' in dict_schema:
-                cur_row = {key: value for (key, value) in cur_row.items() if key not in except_names}
-            # 处理rename
-            renamed_row = {}
-            for key, value in cur_row.items():
-                if key in rename_rules:
-                    renamed_row[rename_rules[key]] = value
-                else:
-                    renamed_row[key] = value
-            # 排除结果中的None值
-            renamed_row = {key: value for (key, value) in renamed_row.items()
-                           if key and value is not None}
-            renamed_rows.append(renamed_row)
-    # 第六阶段：item|return
-    if '__item__' in dict_schema:
-        if '__return__' in dict_schema:
-            raise PqlRuntimeError('__item__', '__item__和__return__不能同时定义')
-        item_indices = dict_schema['__item__']
-        if not isinstance(item_indices, list) or not all(
-                indice is None or isinstance(indice, int) for indice in item_indices):
-            raise PqlRuntimeError('__item__', '语法错误，只支持list[int?]类型')
-        if not 1 <= len(item_indices) <= 3:
-            raise PqlRuntimeError('__item__', '语法错误，长度应该在1~3范围内')
-        if len(item_indices) == 1 and item_indices[0] is None:
-            raise PqlRuntimeError('__item__', '语法错误，单个下标不能为null')
-        try:
-            if len(item_indices) == 1:
-                return renamed_rows[item_indices[0]]
-            elif len(item_indices) == 2:
-                start, end = item_indices
-                return renamed_rows[start:end]
-            elif len(item_indices) == 3:
-                start, end, step = item_indices
-                return renamed_rows[start:end:step]
-        except:
-            # 此处故意不抛异常，理解为None是rows[0]的默认值
-            return None
-    elif '__return__' in dict_schema:
-        func = dict_schema['__return__']
-        return apply_lambda(env, func, key='__return__')
-    else:
-        return renamed_rows
+                env[outer_name] = renamed_rows
+        # 第五阶段：only|(except,rename)
+        if self.select_error is not None:
+            raise_error(self.select_error)
+        start = perf_counter()
+        for cur_row in selected or ():
+            if isinstance(cur_row, dict):
+                renamed_rows.append(self.select_row(cur_row))
+        if profile is not None:
+            profile.add('select', start, len(selected or ()), len(renamed_rows))
+        # 第六阶段：item|return
+        if self.item_error is not None:
+            raise_error(self.item_error)
+        if self.item is not None:
+            if selected is None:
+                return None
+            return renamed_rows[0] if len(self.item) == 1 else renamed_rows
+        elif self.has_return:
+            start = perf_counter()
+            try:
+                return call(self.return_func, tuple(env), env.values(), key='__return__')
+            finally:
+                if profile is not None:
+                    profile.add('item', start, len(renamed_rows), 1)
+        else:
+            return renamed_rows
+
+
+def compile_schema(dict_schema: Any) -> PqlPlan:
+    return PqlPlan(dict_schema)
+
+
+def profile_schema(env, dict_schema) -> Tuple[Any, Dict]:
+    """
+    执行schema并记录profile
+    :return (结果或{'error': ..., 'type': ...}, profile)
+    """
+    plan = compile_schema(dict_schema)
+    profile = PlanProfile(plan, call_lambda)
+    try:
+        result = plan.run(env, profile)
+    except Exception as e:
+        result = {'error': str(e), 'type': type(e).__name__}
+    slowest = profile.slowest()
+    return result, {'tree': profile.to_dict(), 'slowest': slowest}
+
+
+def apply_schema(env, dict_schema) -> Any:
+    """
+    把dict类型的schema实例化为数组类型的rows，或__return__指定的值。
+    每次调用都重新编译，反复执行同一个schema时应使用compile_schema的结果
+    """
+    return compile_schema(dict_schema).run(env)
 
 
 def apply_items(key: str, rows: Any) -> Dict:
@@ -264,37 +890,35 @@ def apply_items(key: str, rows: Any) -> Dict:
     {'**name': rows} => {**rows[0]}
     {'**name[0]': rows} => {}  # error!
     """
-    match_ret = re.match(r'^(\*\*)?(\w+)$', key)
-    if not match_ret:
-        raise PqlRuntimeError('', 'key语法错误')
-    if key.startswith('**'):
-        if isinstance(rows, list):
-            if not rows:
-                return {}
-            row = rows[0]
-        else:
-            row = rows
-        if row is None:  # {"__item__": [0]}可能返回None
-            return {}
-        if not isinstance(row, dict):
-            raise PqlRuntimeError('', '运行时错误，只支持dict?|list[dict?]类型')
-        key_prefix = match_ret.groups()[1]
-        return {
-            (key_prefix + sub_key if key_prefix[-1] == '_' else key_prefix + sub_key[0].upper() + sub_key[1:]): value
-            for sub_key, value in row.items()
-        }
-    else:
-        return {key: rows}
+    return parse_items_key(key).apply(rows)
 
 
-def apply_lambda(env: Dict, func: str, key: str) -> Any:
+LAMBDA_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=LAMBDA_CACHE_SIZE)
+def compile_lambda(func: str, names: Tuple[str, ...]) -> Callable:
+    """
+    同一个表达式在每行、每次请求中反复执行，按(表达式, 参数名)缓存编译结果。语法错误不缓存
+    """
+    return eval('lambda %s: (%s)' % (','.join(names), func))
+
+
+def call_lambda(func: str, names: Tuple[str, ...], values: Iterable, key: str) -> Any:
+    """
+    按位置传参，不必为每行构造kwargs
+    """
     if not isinstance(func, str):
         raise PqlRuntimeError(key, '语法错误，只支持str类型')
     if not func:
         raise PqlRuntimeError(key, '语法错误，不支持空字符串')
     try:
-        return eval('lambda %s: (%s)' % (','.join(env), func))(**env)
+        return compile_lambda(func, names)(*values)
     except SyntaxError as e:
         raise PqlRuntimeError(key, '语法错误: ' + str(e))
     except Exception as e:
         raise PqlRuntimeError(key, f'运行时错误: ({type(e).__name__}) {e}')
+
+
+def apply_lambda(env: Dict, func: str, key: str) -> Any:
+    return call_lambda(func, tuple(env), env.values(), key)
@@ -0,0 +1,128 @@
+"""
+/op/pql的profile：按schema的嵌套结构，统计每个阶段处理的行数、lambda执行次数、entity加载次数和耗时。
+嵌套的schema在外层的每一行执行一次，同一个子schema的多次执行累加到同一个节点
+"""
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+from time import perf_counter
+
+
+STAGES = ['from', 'map', 'filter', 'sort', 'select', 'item']
+KEY_STAGES = {'__filter__': 'filter', '__sort__': 'sort', '__reverse__': 'sort', '__return__': 'item'}
+SLOWEST_EXPRS = 5  # 高亮耗时最多的表达式个数
+
+
+class StageStat:
+    def __init__(self):
+        self.rows_in = 0
+        self.rows_out = 0
+        self.evals = 0  # lambda执行次数
+        self.seconds = 0.0
+        self.strategy = ''  # 例如index:userId、vector、top-k
+
+    def ran(self) -> bool:
+        return bool(self.rows_in or self.rows_out or self.evals or self.seconds)
+
+    def to_dict(self, stage: str) -> Dict:
+        return {'stage': stage, 'rowsIn': self.rows_in, 'rowsOut': self.rows_out, 'evals': self.evals,
+                'ms': round(self.seconds * 1e3, 3), 'strategy': self.strategy}
+
+
+class ExprStat:
+    def __init__(self, key: str, func: str):
+        self.key = key
+        self.func = func
+        self.calls = 0
+        self.seconds = 0.0
+        self.slow = False
+
+    def to_dict(self) -> Dict:
+        return {'key': self.key, 'func': self.func, 'calls': self.calls, 'ms': round(self.seconds * 1e3, 3),
+                'slow': self.slow}
+
+
+class PlanProfile:
+    def __init__(self, plan: Any, call_lambda: Callable, path: str=''):
+        """
+        :param plan: PqlPlan，输出时用plan.explain()描述编译结果
+        :param call_lambda: pql.call_lambda，profile时由self.call代替
+        """
+        self.plan = plan
+        self.call_lambda = call_lambda
+        self.path = path
+        self.runs = 0
+        self.seconds = 0.0  # 包括嵌套的schema
+        self.entity_loads = 0
+        self.stages = {stage: StageStat() for stage in STAGES}
+        self.exprs: Dict[Tuple[str, str], ExprStat] = {}
+        self.children: Dict[Tuple[str, int], 'PlanProfile'] = {}
+        self.call = self.wrap(call_lambda)
+
+    def child(self, key: str, index: int, plan: Any) -> 'PlanProfile':
+        """
+        :param index: map的value是list时，嵌套schema在list中的下标
+        """
+        child = self.children.get((key, index))
+        if child is None:
+            path = f'{self.path}/{key}' if self.path else key
+            child = self.children[(key, index)] = PlanProfile(plan, self.call_lambda, path)
+        return child
+
+    def add(self, stage: str, start: float, rows_in: int=0, rows_out: int=0) -> None:
+        stat = self.stages[stage]
+        stat.seconds += perf_counter() - start
+        stat.rows_in += rows_in
+        stat.rows_out += rows_out
+
+    def count(self, stage: str, rows: Iterable) -> Iterator:
+        stat = self.stages[stage]
+        for row in rows:
+            stat.rows_out += 1
+            yield row
+
+    def wrap(self, call_lambda: Callable) -> Callable:
+        """
+        :return 与call_lambda参数相同的函数，按(key, 表达式)记录执行次数和耗时
+        """
+        def call(func: Any, names: Tuple[str, ...], values: Iterable, key: str) -> Any:
+            start = perf_counter()
+            try:
+                return call_lambda(func, names, values, key)
+            finally:
+                expr = self.exprs.get((key, str(func)))
+                if expr is None:
+                    expr = self.exprs[(key, str(func))] = ExprStat(key, str(func))
+                expr.calls += 1
+                expr.seconds += perf_counter() - start
+                self.stages[KEY_STAGES.get(key, 'map')].evals += 1
+        return call
+
+    def walk(self) -> Iterator['PlanProfile']:
+        yield self
+        for child in self.children.values():
+            yield from child.walk()
+
+    def slowest(self) -> List[Dict]:
+        """
+        标记并返回所有节点中总耗时最多的表达式
+        """
+        exprs = [(node.path, expr) for node in self.walk() for expr in node.exprs.values()]
+        exprs.sort(key=lambda pair: pair[1].seconds, reverse=True)
+        for _, expr in exprs:
+            expr.slow = False
+        result = []
+        for path, expr in exprs[:SLOWEST_EXPRS]:
+            expr.slow = True
+            result.append({'path': path, **expr.to_dict()})
+        return result
+
+    def to_dict(self) -> Dict:
+        return {
+            'path': self.path,
+            'plan': self.plan.explain(recursive=False),
+            'runs': self.runs,
+            'ms': round(self.seconds * 1e3, 3),
+            'entityLoads': self.entity_loads,
+            'stages': [stat.to_dict(stage) for stage, stat in self.stages.items() if stat.ran()],
+            'exprs': [expr.to_dict() for expr in sorted(self.exprs.values(), key=lambda expr: -expr.seconds)],
+            'children': [child.to_dict() for child in self.children.values()],
+        }
@@ -0,0 +1,113 @@
+from typing import Dict, List, Tuple, Any, Optional, NamedTuple
+import re
+from wax.lessweb.webapi import http_methods
+
+
+class Route(NamedTuple):
+    template: str  # swagger中的path，例如/user/{id}
+    endpoint: Dict
+    operations: Dict[str, Dict]  # {METHOD: operation}，同时是Allow header的来源
+
+
+class RouteNode:
+    """
+    按'/'分段的前缀树节点。匹配优先级：字面量 > 含参数的片段(如{id}.json) > 纯参数({id})
+    """
+    __slots__ = ('literals', 'patterns', 'param_name', 'param', 'route')
+
+    def __init__(self):
+        self.literals: Dict[str, RouteNode] = {}
+        self.patterns: List[Tuple[Any, RouteNode]] = []  # [(patternobj, node)]
+        self.param_name: Optional[str] = None
+        self.param: Optional[RouteNode] = None
+        self.route: Optional[Route] = None
+
+
+PARAM_RE = re.compile(r'\{([^0-9].*?)\}')
+
+
+def segment_pattern(segment: str) -> Any:
+    """
+    'file-{name}.json' -> re.compile('^file\\-(?P<name>[^/]+)\\.json$')
+    """
+    ret, pos = [], 0
+    for match_ret in PARAM_RE.finditer(segment):
+        ret.append(re.escape(segment[pos:match_ret.start()]))
+        ret.append('(?P<%s>[^/]+)' % match_ret.group(1))
+        pos = match_ret.end()
+    ret.append(re.escape(segment[pos:]))
+    return re.compile('^' + ''.join(ret) + '$')
+
+
+class RouteTable:
+    """
+    swagger paths的路由表，随swagger一起生成。查找的代价只与path的深度有关，与接口数量无关
+    """
+    def __init__(self, paths: Dict[str, Dict]):
+        self.root = RouteNode()
+        for endpoint_path, endpoint in paths.items():
+            self.add(endpoint_path, endpoint)
+
+    def add(self, endpoint_path: str, endpoint: Dict) -> None:
+        node = self.root
+        for segment in endpoint_path.split('/'):
+            param_match = PARAM_RE.fullmatch(segment)
+            if param_match:
+                if node.param is None:
+                    node.param, node.param_name = RouteNode(), param_match.group(1)
+                elif node.param_name != param_match.group(1):
+                    # 同一位置的参数名不同，例如/a/{id}和/a/{name}/b，用正则区分参数名
+                    node = self.add_pattern(node, segment)
+                    continue
+                node = node.param
+            elif PARAM_RE.search(segment):
+                node = self.add_pattern(node, segment)
+            else:
+                node = node.literals.setdefault(segment, RouteNode())
+        if node.route is None:
+            operations = {op_method.upper(): operation for op_method, operation in endpoint.items()
+                          if op_method.upper() in http_methods}
+            node.route = Route(endpoint_path, endpoint, operations)
+
+    @staticmethod
+    def add_pattern(node: RouteNode, segment: str) -> RouteNode:
+        patternobj = segment_pattern(segment)
+        for other, child in node.patterns:
+            if other.pattern == patternobj.pattern:
+                return child
+        child = RouteNode()
+        node.patterns.append((patternobj, child))
+        return child
+
+    def match(self, path: str) -> Tuple[Optional[Route], Dict]:
+        """
+        :return (route, url_params)，未匹配时route为None
+        """
+        url_params: Dict[str, str] = {}
+        route = self.match_node(self.root, path.split('/'), 0, url_params)
+        return route, url_params
+
+    def match_node(self, node: RouteNode, segments: List[str], i: int, url_params: Dict) -> Optional[Route]:
+        if i == len(segments):
+            return node.route
+        segment = segments[i]
+        child = node.literals.get(segment)
+        if child is not None:
+            route = self.match_node(child, segments, i + 1, url_params)
+            if route is not None:
+                return route
+        if not segment:  # 参数不能为空
+            return None
+        for patternobj, child in node.patterns:
+            search_ret = patternobj.match(segment)
+            if search_ret:
+                route = self.match_node(child, segments, i + 1, url_params)
+                if route is not None:
+                    url_params.update(search_ret.groupdict())
+                    return route
+        if node.param is not None:
+            route = self.match_node(node.param, segments, i + 1, url_params)
+            if route is not None:
+                url_params[node.param_name] = segment
+                return route
+        return None
@@ -1,6 +1,5 @@
 from typing import Dict, List
-import itertools
-import json
+import copy
 from mako.template import Template  # type: ignore
 from wax.lessweb import BadParamError, Context
 from wax.lessweb.webapi import http_methods
@@ -8,89 +7,13 @@ from wax.service import StateServ
 from wax.load_config import config
 from wax.load_swagger import SwaggerData, parse_operation
 from wax.jsonschema_util import compare_json
+from wax.tag_util import split_tag
+from wax.check_util import deferred_checker
 from wax.kotlin_util import import_headers, schema_to_kclass, endpoint_to_kcontroller, kclass_index
 
 
-def split_tag(tag: str) -> List[str]:
-    if not tag:
-        tag = '其他'
-    segs = tag.replace('/', '-').split('-', 2)
-    if len(segs) == 1:
-        segs.append('API')
-    if len(segs) == 2:
-        segs.append('API')
-    return segs
-
-
-class Operation:
-    method: str
-    path: str
-    summary: str
-    operationId: str
-    description: str
-    # state
-    basic: str
-    extra: str
-    all_example: List[str]  # List[stateBasic]
-
-
-# {majorTag: {dirTag: {menuTag: List[Operation]}}}
-tag_tree: Dict[str, Dict[str, Dict[str, List[Operation]]]] = {}
-op_index: Dict[str, Operation] = {}  # {operationId: Operation}
-
-
-def first_time_append_op(tag_set, major_tag, op) -> bool:
-    tag_set.setdefault(major_tag, set())
-    if (op.method, op.path) not in tag_set[major_tag]:
-        tag_set[major_tag].add((op.method, op.path))
-        return True
-    else:
-        return False
-
-
-def load_tag():
-    tag_set = {}
-    swagger_data = SwaggerData.get()
-    for endpoint_path, endpoint in swagger_data['paths'].items():
-        for op_method, operation in endpoint.items():
-            if op_method.upper() not in http_methods: continue
-            for tag in operation.get('tags', []) or ['']:
-                major_tag, dir_tag, menu_tag = split_tag(tag)
-                tag_tree.setdefault(major_tag, {})
-                tag_tree[major_tag].setdefault(dir_tag, {})
-                tag_tree[major_tag][dir_tag].setdefault(menu_tag, [])
-                op = Operation()
-                op.method = op_method.upper()
-                op.path = endpoint_path
-                try:
-                    op.summary = operation['summary']
-                    op.operationId = operation['operationId']
-                except:
-                    print(endpoint_path, op_method.upper())
-                    raise
-                op.description = operation.get('description', '')
-                op.all_example = []
-                for status_code, response_val in operation.get('responses', {}).items():
-                    if not response_val.get('content'): print(f'WARNING: responses is empty -> {op.method} {op.path}')
-                    for content_key, content_val in response_val.get('content', {}).items():
-                        for example_name, _ in content_val.get('examples', {}).items():
-                            op.all_example.append(f'{status_code}:{content_key}:{example_name}')
-                tag_tree[major_tag][dir_tag][menu_tag].append(op)
-                #
-                tag_tree.setdefault('API', {'API': {'API': []}})
-                tag_tree[major_tag].setdefault('API', {'API': []})
-                if first_time_append_op(tag_set, 'API', op):
-                    tag_tree['API']['API']['API'].append(op)
-                if first_time_append_op(tag_set, major_tag, op) and dir_tag != 'API':
-                    tag_tree[major_tag]['API']['API'].append(op)
-                #
-                op_index[op.operationId] = op
-
-
-load_tag()
-
-
 def operation_list(tag: str='API'):
+    tag_tree = SwaggerData.current().tag_tree
     if not tag and tag_tree:
         tag = list(tag_tree.keys())[0]
     major_tag, dir_tag, menu_tag = split_tag(tag)
@@ -105,33 +28,46 @@ def operation_list(tag: str='API'):
 
 
 def operation_detail(opId: str, show: str=''):
-    op = op_index.get(opId)
-    swagger_data = SwaggerData.get()
-    endpoint = [val for key, val in swagger_data['paths'].items() if key==op.path][0]
+    snapshot = SwaggerData.current()
+    op = snapshot.op_index.get(opId)
+    if not op:
+        raise BadParamError(message='opId不存在', param='opId')
+    swagger_data = snapshot.swagger_data
+    endpoint = swagger_data['paths'][op.path]
     operation = endpoint[op.method.lower()]
     data = {'op': operation, 'path': op.path, 'method': op.method, 'mock_prefix': config['mockapi-prefix']}
     data.update(parse_operation(swagger_data, endpoint, op.method))
     if show == 'json':
         return data
     return Template(filename='wax-www/tpl/op_detail_page.mako', input_encoding='utf-8', output_encoding='utf-8').render(
-        tag_tree=tag_tree,
+        tag_tree=snapshot.tag_tree,
         git_url=config['git-url'],
+        check_failures=deferred_checker.recent(opId),
         **data
     )
 
 
+def operation_check_failures(opId: str=''):
+    """
+    deferred模式下最近的响应校验失败
+    """
+    return {'checked': deferred_checker.checked, 'dropped': deferred_checker.dropped,
+            'failures': deferred_checker.recent(opId)}
+
+
 def operation_example(opId: str, state: StateServ):
-    op = op_index.get(opId)
+    op = SwaggerData.current().op_index.get(opId)
     if not op:
         raise BadParamError(message='opId不存在', param='opId')
     state.operation_id = opId
+    op = copy.copy(op)  # snapshot中的Operation是共享的，不能写入state
     op.basic = state.basic.get()
     op.extra = state.extra.get()
     return op
 
 
 def operation_edit_state(state: StateServ, opId: str, basic:str='', extra:str=''):
-    if opId not in op_index:
+    if opId not in SwaggerData.current().op_index:
         raise BadParamError(message='opId不存在', param='opId')
     state.operation_id = opId
     if basic is not None:
@@ -0,0 +1,83 @@
+from typing import Dict, List, Tuple
+from wax.lessweb.webapi import http_methods
+
+
+def split_tag(tag: str) -> List[str]:
+    if not tag:
+        tag = '其他'
+    segs = tag.replace('/', '-').split('-', 2)
+    if len(segs) == 1:
+        segs.append('API')
+    if len(segs) == 2:
+        segs.append('API')
+    return segs
+
+
+class Operation:
+    method: str
+    path: str
+    summary: str
+    operationId: str
+    description: str
+    # state
+    basic: str
+    extra: str
+    all_example: List[str]  # List[stateBasic]
+
+
+# {majorTag: {dirTag: {menuTag: List[Operation]}}}
+TagTree = Dict[str, Dict[str, Dict[str, List[Operation]]]]
+OpIndex = Dict[str, Operation]  # {operationId: Operation}
+
+
+def first_time_append_op(tag_set, major_tag, op) -> bool:
+    tag_set.setdefault(major_tag, set())
+    if (op.method, op.path) not in tag_set[major_tag]:
+        tag_set[major_tag].add((op.method, op.path))
+        return True
+    else:
+        return False
+
+
+def build_tag_tree(swagger_data: Dict) -> Tuple[TagTree, OpIndex]:
+    """
+    :return (tag_tree, op_index)，每次加载swagger时重新生成
+    """
+    tag_tree: TagTree = {}
+    op_index: OpIndex = {}
+    tag_set: Dict = {}
+    for endpoint_path, endpoint in swagger_data['paths'].items():
+        for op_method, operation in endpoint.items():
+            if op_method.upper() not in http_methods: continue
+            for tag in operation.get('tags', []) or ['']:
+                major_tag, dir_tag, menu_tag = split_tag(tag)
+                tag_tree.setdefault(major_tag, {})
+                tag_tree[major_tag].setdefault(dir_tag, {})
+                tag_tree[major_tag][dir_tag].setdefault(menu_tag, [])
+                op = Operation()
+                op.method = op_method.upper()
+                op.path = endpoint_path
+                try:
+                    op.summary = operation['summary']
+                    op.operationId = operation['operationId']
+                except:
+                    print(endpoint_path, op_method.upper())
+                    raise
+                op.description = operation.get('description', '')
+                op.all_example = []
+                for status_code, response_val in operation.get('responses', {}).items():
+                    if not response_val.get('content'): print(f'WARNING: responses is empty -> {op.method} {op.path}')
+                    for content_key, content_val in response_val.get('content', {}).items():
+                        for example_name, _ in content_val.get('examples', {}).items():
+                            op.all_example.append(f'{status_code}:{content_key}:{example_name}')
+                tag_tree[major_tag][dir_tag][menu_tag].append(op)
+                #
+                tag_tree.setdefault('API', {'API': {'API': []}})
+                tag_tree[major_tag].setdefault('API', {'API': []})
+                if first_time_append_op(tag_set, 'API', op):
+                    tag_tree['API']['API']['API'].append(op)
+                if first_time_append_op(tag_set, major_tag, op) and dir_tag != 'API':
+                    tag_tree[major_tag]['API']['API'].append(op)
+                #
+                op_index[op.operationId] = op
+    return tag_tree, op_index
@@ -0,0 +1,131 @@
+"""
+每个snapshot一份的jsonschema validator缓存。
+validator按(operationId, 位置)缓存，例如('get-user', 'param:path:id')、('get-user', 'body:application/json')、
+('get-user', 'response:200:application/json')。
+"""
+from typing import Dict, Any, Optional, Tuple
+import threading
+import jsonschema
+from jsonschema.validators import validator_for
+from wax.codegen_util import compile_check
+
+
+ValidatorKey = Tuple[str, str]
+VALIDATOR_BACKENDS = ('jsonschema', 'codegen')  # config.json中的validator
+
+
+class SpecResolver(jsonschema.RefResolver):
+    """
+    缓存$ref解析结果的RefResolver，同一snapshot内的全部validator共用
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fragments: Dict[Tuple[int, str], Any] = {}
+
+    def resolve_fragment(self, document, fragment):
+        key = (id(document), fragment)  # document都保存在store中，生命周期与resolver相同
+        try:
+            return self.fragments[key]
+        except KeyError:
+            ret = self.fragments[key] = super().resolve_fragment(document, fragment)
+            return ret
+
+    def resolve_local_refs(self) -> Dict[str, Any]:
+        """
+        解析swagger内部的全部$ref(#/...)
+        :return {fragment: 解析结果}，与swagger一起保存到预编译包，加载后用preload放回缓存
+        """
+        refs: Dict[str, Any] = {}
+        stack = [self.referrer]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                ref = node.get('$ref')
+                if isinstance(ref, str) and ref.startswith('#') and ref[1:] not in refs:
+                    try:
+                        refs[ref[1:]] = self.resolve_fragment(self.referrer, ref[1:])
+                    except jsonschema.RefResolutionError:
+                        pass  # 校验时再报错
+                stack.extend(node.values())
+            elif isinstance(node, list):
+                stack.extend(node)
+        return refs
+
+    def preload(self, refs: Dict[str, Any]) -> None:
+        """
+        :param refs: resolve_local_refs的结果，其中的值应当是self.referrer的一部分(同一个pickle中加载)
+        """
+        for fragment, ret in refs.items():
+            self.fragments[(id(self.referrer), fragment)] = ret
+
+
+class CompiledValidator:
+    """
+    先用编译生成的函数判断，不通过时再交给jsonschema，所以错误信息与jsonschema完全相同
+    """
+    def __init__(self, validator):
+        self.validator = validator
+        self.check = compile_check(validator.schema, validator.resolver, validator.format_checker)
+
+    def iter_errors(self, instance):
+        if self.check(instance):
+            return iter(())
+        return self.validator.iter_errors(instance)
+
+    def is_valid(self, instance) -> bool:
+        return self.check(instance) or self.validator.is_valid(instance)
+
+
+def make_validator(schema: Dict, resolver: SpecResolver, backend: str='jsonschema'):
+    """
+    schema中声明了$schema时按声明的draft，否则按Draft7。schema本身不合法时抛出SchemaError
+    """
+    cls = validator_for(schema, default=jsonschema.Draft7Validator)
+    cls.check_schema(schema)
+    validator = cls(schema, resolver=resolver, format_checker=jsonschema.draft7_format_checker)
+    if backend == 'codegen' and cls is jsonschema.Draft7Validator:
+        return CompiledValidator(validator)
+    return validator
+
+
+class ValidatorCache:
+    """
+    validator在第一次用到时创建，之后同一代swagger内一直复用
+    """
+    def __init__(self, resolver: SpecResolver, backend: str='jsonschema'):
+        self.resolver = resolver
+        self.backend = backend
+        self.validators: Dict[ValidatorKey, Any] = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: Optional[ValidatorKey], schema: Dict):
+        """
+        :param key: None表示schema不属于swagger(例如check_entities提交的schema)，不缓存
+        """
+        if key is None:
+            return make_validator(schema, self.resolver)  # 只用一次，不值得编译
+        validator = self.validators.get(key)
+        if validator is None:
+            with self.lock:
+                validator = self.validators.get(key)
+                if validator is None:
+                    validator = self.validators[key] = make_validator(schema, self.resolver, self.backend)
+        return validator
+
+    def validate(self, instance, *, key: Optional[ValidatorKey], schema: Dict) -> str:
+        """
+        :return 错误信息，与jsonschema.validate抛出的异常信息相同；检查通过时返回''
+        """
+        error = jsonschema.exceptions.best_match(self.get(key, schema).iter_errors(instance))
+        return '' if error is None else str(error)
+
+
+def spec_validators(swagger_data: Dict, backend: str='jsonschema',
+                    refs: Optional[Dict[str, Any]]=None) -> ValidatorCache:
+    """
+    :param refs: 预编译包中已解析的$ref
+    """
+    resolver = SpecResolver.from_schema(swagger_data)
+    if refs:
+        resolver.preload(refs)
+    return ValidatorCache(resolver, backend)
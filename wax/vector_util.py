@@ -0,0 +1,308 @@
+"""
+PQL表达式的静态分析，以及__filter__/__sort__的向量化执行。
+numpy为可选依赖：安装后，较大的entity按字段生成列(numpy数组)，只由it['field']、常量、算术和比较组成的表达式
+整列计算；无法保证结果与逐行执行完全相同的情况(非数值字段、可能溢出、NaN排序等)返回None，由调用者逐行执行
+"""
+from typing import Any, Callable, FrozenSet, NamedTuple, Optional, Tuple
+import ast
+
+try:
+    import numpy  # type: ignore
+except ImportError:
+    numpy = None
+
+
+COLUMNAR_MIN_ROWS = 1000  # 行数较少时逐行执行更快
+INT_LIMIT = 2 ** 63  # int64
+EXACT_FLOAT_LIMIT = 2 ** 53  # 绝对值不超过此值的整数转为float64没有误差
+
+CMP_OPS = {ast.Lt: 'less', ast.LtE: 'less_equal', ast.Gt: 'greater', ast.GtE: 'greater_equal', ast.Eq: 'equal',
+           ast.NotEq: 'not_equal'}
+SAFE_CMP_OPS = (ast.Eq, ast.NotEq, ast.Is, ast.IsNot)  # json的值之间比较不会报错
+ARITH_OPS = {ast.Add: 'add', ast.Sub: 'subtract', ast.Mult: 'multiply'}  # 除法、取模可能除以0，不做向量化
+
+
+def row_field(node: ast.AST, row_names: Tuple[str, ...]) -> Optional[str]:
+    """
+    it['field']或别名['field']
+    """
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id in row_names \
+            and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str):
+        return node.slice.value
+    return None
+
+
+def is_row_free(node: ast.AST, row_names: Tuple[str, ...]) -> bool:
+    """
+    只由常量、变量和下标组成，且不引用当前行的表达式，在一次__from__的所有行中值都相同
+    """
+    if isinstance(node, ast.Constant):
+        return True
+    if isinstance(node, ast.Name):
+        return node.id not in row_names
+    if isinstance(node, ast.Subscript):
+        return is_row_free(node.value, row_names) and is_row_free(node.slice, row_names)
+    return False
+
+
+def is_row_get(node: ast.AST, row_names: Tuple[str, ...]) -> bool:
+    """
+    it.get(常量)或it.get(常量, default)
+    """
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'get' \
+        and isinstance(node.func.value, ast.Name) and node.func.value.id in row_names and not node.keywords \
+        and 1 <= len(node.args) <= 2 and isinstance(node.args[0], ast.Constant)
+
+
+def row_reads(func: Any, row_names: Tuple[str, ...]) -> Optional[FrozenSet[str]]:
+    """
+    表达式只通过it['field']或it.get('field', ...)读取当前行时，返回读取的字段；以其他方式用到当前行时返回None
+    """
+    if not isinstance(func, str):
+        return None
+    try:
+        tree = ast.parse(func.strip(), mode='eval')
+    except Exception:
+        return None
+    fields = set()
+    reads = set()  # 合法使用的Name节点
+    for node in ast.walk(tree):
+        field = row_field(node, row_names)
+        if field is not None:
+            fields.add(field)
+            reads.add(node.value)
+        elif is_row_get(node, row_names) and isinstance(node.args[0].value, str):
+            fields.add(node.args[0].value)
+            reads.add(node.func.value)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in row_names and node not in reads:
+            return None
+    return frozenset(fields)
+
+
+def is_safe(node: ast.AST, row_names: Tuple[str, ...], fields: set) -> bool:
+    field = row_field(node, row_names)
+    if field is not None:
+        fields.add(field)
+        return True
+    if isinstance(node, ast.Constant):
+        return True
+    if is_row_get(node, row_names):
+        return all(is_safe(arg, row_names, fields) for arg in node.args)
+    if isinstance(node, ast.Compare):  # 大小比较可能因为类型不同报错
+        return all(isinstance(op, SAFE_CMP_OPS) for op in node.ops) and \
+            all(is_safe(value, row_names, fields) for value in [node.left] + node.comparators)
+    if isinstance(node, ast.BoolOp):
+        return all(is_safe(value, row_names, fields) for value in node.values)
+    if isinstance(node, ast.UnaryOp):
+        return isinstance(node.op, ast.Not) and is_safe(node.operand, row_names, fields)
+    if isinstance(node, ast.IfExp):
+        return all(is_safe(value, row_names, fields) for value in [node.test, node.body, node.orelse])
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return all(is_safe(value, row_names, fields) for value in node.elts)
+    if isinstance(node, ast.Dict):
+        return all(isinstance(key, ast.Constant) for key in node.keys) and \
+            all(is_safe(value, row_names, fields) for value in node.values)
+    return False
+
+
+def safe_reads(func: Any, row_names: Tuple[str, ...]) -> Optional[FrozenSet[str]]:
+    """
+    表达式只读取当前行和常量，执行时既不会报错也没有副作用(前提是读取的字段每行都有)时，返回it['field']读取的字段；
+    否则返回None。这样的表达式跳过不执行或推迟执行都不会改变结果和报错
+    """
+    if not isinstance(func, str):
+        return None
+    try:
+        tree = ast.parse(func.strip(), mode='eval').body
+    except Exception:
+        return None
+    fields: set = set()
+    if not is_safe(tree, row_names, fields):
+        return None
+    return frozenset(fields)
+
+
+class Column(NamedTuple):
+    values: Any  # numpy.ndarray，int64或float64
+    kind: str  # 'i'或'f'
+    bound: float  # 绝对值的上界，用于判断int64运算是否可能溢出
+
+
+def build_column(rows: list, field: str) -> Optional[Column]:
+    """
+    字段全部是int/float/bool时生成列；有行缺少字段、有其他类型的值，或转换会损失精度时返回None
+    """
+    if numpy is None or len(rows) < COLUMNAR_MIN_ROWS:
+        return None
+    values = []
+    has_float = False
+    for row in rows:
+        if field not in row:
+            return None
+        value = row[field]
+        if type(value) is float:
+            has_float = True
+        elif type(value) not in (int, bool):
+            return None
+        values.append(value)
+    bound = max((abs(value) for value in values if type(value) is not float), default=0)
+    if has_float:
+        if bound > EXACT_FLOAT_LIMIT:
+            return None
+        return Column(numpy.array(values, dtype=numpy.float64), 'f', float('inf'))
+    if bound >= INT_LIMIT:
+        return None
+    return Column(numpy.array(values, dtype=numpy.int64), 'i', bound)
+
+
+class Unsupported(Exception):
+    pass
+
+
+class Vector(NamedTuple):
+    values: Any  # numpy.ndarray或标量
+    kind: str  # 'i'、'f'、'b'
+    bound: float
+
+
+class VectorExpr:
+    """
+    编译时只检查表达式的结构；执行时取entity的列和env中的常量，任何一步不满足条件都返回None
+    """
+    def __init__(self, func: str, row_names: Tuple[str, ...]):
+        self.func = func.strip()
+        self.row_names = row_names
+        self.fields: FrozenSet[str] = frozenset()
+        self.tree: Optional[ast.AST] = None
+        if numpy is None:
+            return
+        try:
+            tree = ast.parse(self.func, mode='eval').body
+        except Exception:
+            return
+        fields: set = set()
+        if self.check(tree, fields):
+            self.tree, self.fields = tree, frozenset(fields)
+
+    def check(self, node: ast.AST, fields: set) -> bool:
+        field = row_field(node, self.row_names)
+        if field is not None:
+            fields.add(field)
+            return True
+        if is_row_free(node, self.row_names):
+            return True
+        if isinstance(node, ast.BinOp):
+            return type(node.op) in ARITH_OPS and self.check(node.left, fields) and self.check(node.right, fields)
+        if isinstance(node, ast.UnaryOp):
+            return isinstance(node.op, (ast.USub, ast.UAdd, ast.Not)) and self.check(node.operand, fields)
+        if isinstance(node, ast.BoolOp):
+            return all(self.check(value, fields) for value in node.values)
+        if isinstance(node, ast.Compare):
+            return all(type(op) in CMP_OPS for op in node.ops) and \
+                all(self.check(value, fields) for value in [node.left] + node.comparators)
+        return False
+
+    def mask(self, entity, const: Callable[[str], Any]) -> Optional[Any]:
+        """
+        :param const: 在env中计算与当前行无关的子表达式
+        :return 满足表达式的行的bool数组
+        """
+        if self.tree is None:
+            return None
+        try:
+            with numpy.errstate(all='ignore'):
+                values = self.truth(self.tree, entity, const)
+        except Unsupported:
+            return None
+        if numpy.ndim(values) == 0:
+            return numpy.full(len(entity.rows), bool(values))
+        return values
+
+    def keys(self, entity, const: Callable[[str], Any]) -> Optional[Any]:
+        """
+        :return 每行的排序key；有NaN时返回None(list.sort与argsort对NaN的处理不同)
+        """
+        if self.tree is None:
+            return None
+        try:
+            with numpy.errstate(all='ignore'):
+                vector = self.value(self.tree, entity, const)
+        except Unsupported:
+            return None
+        values = vector.values
+        if numpy.ndim(values) == 0:
+            values = numpy.full(len(entity.rows), values)
+        if vector.kind == 'f' and numpy.isnan(values).any():
+            return None
+        return values
+
+    def truth(self, node: ast.AST, entity, const) -> Any:
+        if isinstance(node, ast.BoolOp):
+            func = numpy.logical_and if isinstance(node.op, ast.And) else numpy.logical_or
+            result = self.truth(node.values[0], entity, const)
+            for value in node.values[1:]:
+                result = func(result, self.truth(value, entity, const))
+            return result
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return numpy.logical_not(self.truth(node.operand, entity, const))
+        vector = self.value(node, entity, const)
+        return vector.values if vector.kind == 'b' else numpy.not_equal(vector.values, 0)
+
+    def value(self, node: ast.AST, entity, const) -> Vector:
+        field = row_field(node, self.row_names)
+        if field is not None:
+            column = entity.column(field)
+            if column is None:
+                raise Unsupported()
+            return Vector(column.values, column.kind, column.bound)
+        if is_row_free(node, self.row_names):
+            try:
+                value = const(ast.get_source_segment(self.func, node))
+            except Exception:
+                raise Unsupported()
+            if type(value) is float:
+                return Vector(value, 'f', float('inf'))
+            if type(value) in (int, bool) and abs(value) < INT_LIMIT:
+                return Vector(int(value), 'i', abs(value))
+            raise Unsupported()
+        if isinstance(node, ast.BinOp):
+            left, right = self.value(node.left, entity, const), self.value(node.right, entity, const)
+            if 'b' in (left.kind, right.kind):  # bool相加在numpy中是逻辑或，在python中是整数加法
+                raise Unsupported()
+            if left.kind == right.kind == 'i':
+                bound = left.bound * right.bound if isinstance(node.op, ast.Mult) else left.bound + right.bound
+                if bound >= INT_LIMIT:
+                    raise Unsupported()
+                kind = 'i'
+            else:
+                bound, kind = float('inf'), 'f'
+            return Vector(getattr(numpy, ARITH_OPS[type(node.op)])(left.values, right.values), kind, bound)
+        if isinstance(node, ast.UnaryOp) and not isinstance(node.op, ast.Not):
+            operand = self.value(node.operand, entity, const)
+            if operand.kind == 'b':
+                raise Unsupported()
+            values = numpy.negative(operand.values) if isinstance(node.op, ast.USub) else operand.values
+            return Vector(values, operand.kind, operand.bound)
+        if isinstance(node, ast.Compare):
+            operands = [self.value(value, entity, const) for value in [node.left] + node.comparators]
+            result: Any = True
+            for op, left, right in zip(node.ops, operands, operands[1:]):
+                kinds = {left.kind, right.kind}
+                if 'b' in kinds:
+                    raise Unsupported()
+                if kinds == {'i', 'f'} and (left.bound if left.kind == 'i' else right.bound) > EXACT_FLOAT_LIMIT:
+                    raise Unsupported()  # python比较int与float是精确的，numpy先把int转为float64
+                result = numpy.logical_and(result, getattr(numpy, CMP_OPS[type(op)])(left.values, right.values))
+            return Vector(result, 'b', 1)
+        raise Unsupported()  # BoolOp、not的结果不是数值
+
+
+def stable_order(keys: Any, reverse: bool) -> Any:
+    """
+    与list.sort(key, reverse)相同的稳定排序：reverse时先反转、升序排序、再反转，相等的元素保持原来的顺序
+    """
+    if not reverse:
+        return numpy.argsort(keys, kind='stable')
+    n = len(keys)
+    return (n - 1 - numpy.argsort(keys[::-1], kind='stable'))[::-1]
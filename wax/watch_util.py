@@ -0,0 +1,153 @@
+"""
+监听json目录的变化：优先使用inotify，不可用时退化为轮询。
+事件经过debounce合并后，在后台线程中回调on_change(changed_paths)。
+"""
+from typing import Any, Callable, Dict, Set, Tuple
+from pathlib import Path
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+from wax.pack_util import glob_find, SPEC_SUFFIXES
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+             IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct('iIII')  # struct inotify_event {wd, mask, cookie, len}
+
+
+def dir_signature(ref_path) -> Dict[str, Tuple[float, int]]:
+    """
+    {file_path: (mtime, size)}，与dir_mtime不同，文件的删除和改名也能被发现
+    """
+    ret = {}
+    for p in glob_find(ref_path):
+        try:
+            stat = p.stat()
+        except OSError:
+            continue
+        ret[str(p)] = (stat.st_mtime, stat.st_size)
+    return ret
+
+
+class Inotify:
+    """
+    通过ctypes调用libc的inotify，不依赖第三方库
+    """
+    def __init__(self, ref_path: str):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError('libc not found')
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not supported')
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(ref_path), WATCH_MASK)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+        self.ref_path = Path(ref_path)
+
+    def wait(self, timeout) -> Set[str]:
+        """
+        :return 变化的文件路径。超时返回空集合
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buf):
+            _, mask, _, name_len = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = buf[offset:offset + name_len].rstrip(b'\0').decode(errors='replace')
+            offset += name_len
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.add(str(self.ref_path))
+            elif name.endswith(SPEC_SUFFIXES):
+                changed.add(str(self.ref_path / name))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    """
+    inotify不可用时(非Linux或网络文件系统)的轮询实现
+    """
+    def __init__(self, ref_path: str, interval: float):
+        self.ref_path = ref_path
+        self.interval = interval
+        self.signature = dir_signature(ref_path)
+
+    def wait(self, timeout) -> Set[str]:
+        time.sleep(min(timeout, self.interval))
+        signature = dir_signature(self.ref_path)
+        changed = {path for path in signature.keys() | self.signature.keys()
+                   if signature.get(path) != self.signature.get(path)}
+        self.signature = signature
+        return changed
+
+    def close(self):
+        pass
+
+
+class SpecWatcher(threading.Thread):
+    """
+    后台线程：发现json目录变化后等待debounce秒没有新变化，再调用on_change
+    """
+    def __init__(self, ref_path: str, on_change: Callable[[Set[str]], None],
+                 debounce: float=0.3, interval: float=1.0, use_inotify: bool=True):
+        super().__init__(name='wax-spec-watcher', daemon=True)
+        self.on_change = on_change
+        self.debounce = debounce
+        self.source: Any = None
+        if use_inotify:
+            try:
+                self.source = Inotify(ref_path)
+            except (OSError, AttributeError):
+                self.source = None
+        if self.source is None:
+            self.source = Poller(ref_path, interval)
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            changed = self.source.wait(timeout=1.0)
+            if not changed:
+                continue
+            # debounce: 编辑器保存时往往连续产生多个事件
+            while not self._stopped.is_set():
+                more = self.source.wait(timeout=self.debounce)
+                if not more:
+                    break
+                changed |= more
+            if self._stopped.is_set():
+                break
+            try:
+                self.on_change(changed)
+            except Exception as e:
+                print('Reload failed: %s' % e)
+        self.source.close()
+
+    def stop(self):
+        self._stopped.set()